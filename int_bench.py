@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# micro-benchmarks of the int_receive.py decode paths, no mininet or bmv2
+# needed
+#
+# synth_report builds INT reports byte for byte the way int_source.p4,
+# int_transit.p4 and int_report.p4 emit them: the report fixed header,
+# the original ethernet/ipv4 headers with the INT DSCP, an inner UDP or TCP
+# header, the INT shim and header and the metadata stack, newest hop first.
+#
+# every path runs over the same reports and reports reports/s, ns/report
+# and allocations/report. allocations are the memory blocks still allocated
+# after a run that keeps every result alive, divided by the reports, so they
+# count the objects a decoded report is made of and any state a sink or
+# observer keeps, not temporaries freed within the call.
+#
+# the results are written as JSON, --compare prints the change against the
+# JSON of an earlier run
+import argparse
+import gc
+import json
+import os
+import platform
+import socket
+import struct
+import sys
+import tempfile
+import time
+
+import int_receive
+from int_receive import (COLLECTOR_PORT, IP_PROTO_TCP, INT_HEADER_LEN_WORD, WORD_SIZE, np)
+import int_capture
+
+IP_PROTO_UDP = 17
+# int_report.p4 and defines.p4
+INT_REPORT_VERSION = 1
+INT_REPORT_HEADER_LEN_WORDS = 4
+DSCP_INT = 0x17
+INT_TYPE_HOP_BY_HOP = 1
+
+ETH_STRUCT = struct.Struct("!6s6sH")
+IPV4_STRUCT = struct.Struct("!BBHHHBBH4s4s")
+UDP_STRUCT = struct.Struct("!HHHH")
+TCP_STRUCT = struct.Struct("!HHIIHHHH")
+INT_SHIM_STRUCT = struct.Struct("!BBBB")
+INT_HEADER_STRUCT = struct.Struct("!BBBBHH")
+INT_REPORT_HDR_STRUCT = struct.Struct("!IIII")
+
+# bytes of every instruction mask bit, bit 0 being the MSB
+INSTRUCTION_SIZES = (4, 4, 4, 4, 4, 4, 4, 4) + (4,) * 8
+
+REPORTS = 10000
+REPEAT = 3
+BATCH = 256
+OUTPUT_PATH = "int_bench.json"
+
+
+def ipv4_checksum(header):
+    total = sum(struct.unpack("!10H", header))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def ipv4_header(length, protocol, src, dst, dscp=0, ttl=64):
+    header = IPV4_STRUCT.pack(0x45, dscp << 2, length, 0, 0, ttl, protocol, 0, src, dst)
+    return header[:10] + struct.pack("!H", ipv4_checksum(header)) + header[12:]
+
+
+def hop_metadata_words(instruction_mask):
+    size = sum(size for bit, size in enumerate(INSTRUCTION_SIZES) if instruction_mask & (0x8000 >> bit))
+    return size // WORD_SIZE
+
+
+# the metadata one switch pushes for instruction_mask, padded to hop_metadata_len words
+def synth_hop(instruction_mask, hop_metadata_len, sw_id, seq_no):
+    values = (
+        struct.pack("!I", sw_id),
+        struct.pack("!HH", 1, 2),
+        struct.pack("!I", 100 + (seq_no * 7 + sw_id * 13) % 900),
+        struct.pack("!I", (seq_no + sw_id) % 64),
+        struct.pack("!I", (seq_no * 1000 + sw_id) & 0xFFFFFFFF),
+        struct.pack("!I", (seq_no * 1000 + sw_id + 100) & 0xFFFFFFFF),
+        struct.pack("!HH", 3, 4),
+        struct.pack("!I", seq_no % 100),
+    ) + (bytes(4),) * 8
+    hop = b"".join(value for bit, value in enumerate(values) if instruction_mask & (0x8000 >> bit))
+    return hop + bytes(hop_metadata_len * WORD_SIZE - len(hop))
+
+
+# one INT report as the UDP payload the collector receives. the inner packet
+# of flow crossed num_hops switches numbered 1..num_hops, the last one being
+# the sink switch sending the report
+def synth_report(num_hops=3, instruction_mask=0xFF00, tcp=False, seq_no=0, flow=0,
+                 hop_metadata_len=None, payload_size=0, max_hops=8):
+    if hop_metadata_len is None:
+        hop_metadata_len = hop_metadata_words(instruction_mask)
+    stack = b"".join(synth_hop(instruction_mask, hop_metadata_len, sw_id, seq_no)
+                     for sw_id in range(num_hops, 0, -1))
+    int_header = INT_HEADER_STRUCT.pack(0, 0, hop_metadata_len, max(max_hops - num_hops, 0),
+                                        instruction_mask, 0)
+    shim = INT_SHIM_STRUCT.pack(INT_TYPE_HOP_BY_HOP, 0, INT_HEADER_LEN_WORD + len(stack) // WORD_SIZE, 0)
+    int_bytes = shim + int_header + stack
+
+    src_port = 10000 + flow % 50000
+    dst_port = 8001
+    payload = bytes(payload_size)
+    if tcp:
+        l4 = TCP_STRUCT.pack(src_port, dst_port, seq_no, 0, (5 << 12) | 0x10, 65535, 0, 0)
+        protocol = IP_PROTO_TCP
+    else:
+        l4 = UDP_STRUCT.pack(src_port, dst_port, UDP_STRUCT.size + len(int_bytes) + payload_size, 0)
+        protocol = IP_PROTO_UDP
+    src = socket.inet_aton(f"10.0.{1 + flow // 50000 % 250}.1")
+    dst = socket.inet_aton("10.0.2.2")
+    ip = ipv4_header(IPV4_STRUCT.size + len(l4) + len(int_bytes) + payload_size, protocol, src, dst,
+                     dscp=DSCP_INT)
+    eth = ETH_STRUCT.pack(bytes.fromhex("000000000202"), bytes.fromhex("000000000101"), 0x0800)
+
+    word0 = (INT_REPORT_VERSION << 28) | (INT_REPORT_HEADER_LEN_WORDS << 24) | (1 << 6)
+    report_hdr = INT_REPORT_HDR_STRUCT.pack(word0, num_hops, seq_no, (seq_no * 1000) & 0xFFFFFFFF)
+    return report_hdr + eth + ip + l4 + int_bytes + payload
+
+
+# the report as the ethernet frame the sink switch sends to the collector
+def synth_frame(report):
+    ip = ipv4_header(IPV4_STRUCT.size + UDP_STRUCT.size + len(report), IP_PROTO_UDP,
+                     socket.inet_aton("10.0.0.1"), socket.inet_aton("10.0.0.254"))
+    udp = UDP_STRUCT.pack(COLLECTOR_PORT, COLLECTOR_PORT, UDP_STRUCT.size + len(report), 0)
+    return ETH_STRUCT.pack(bytes(6), bytes(6), 0x0800) + ip + udp + report
+
+
+def synth_reports(n, num_hops, instruction_mask, tcp, flows=64):
+    return [synth_report(num_hops, instruction_mask, tcp, seq_no=i, flow=i % flows) for i in range(n)]
+
+
+class NullOutput:
+    def __init__(self, path=None, mode=None):
+        pass
+
+    def write(self, line):
+        pass
+
+    def close(self):
+        pass
+
+
+def run_decode(payloads):
+    decode = int_receive.decode_int_report
+    return [decode(memoryview(p)) for p in payloads]
+
+
+def run_batch(payloads):
+    decode = int_receive.decode_int_reports_batch
+    return [decode(payloads[i : i + BATCH]) for i in range(0, len(payloads), BATCH)]
+
+
+def run_frames(frames):
+    decode = int_receive.decode_int_report
+    udp_payload = int_capture.udp_payload
+    return [decode(udp_payload(memoryview(f), COLLECTOR_PORT)) for f in frames]
+
+
+def run_parser(outputs):
+    def run(payloads):
+        parser = int_receive.int_parser
+        tic = time.perf_counter()
+        return [parser(p, outputs, tic) for p in payloads]
+    return run
+
+
+def run_handle_report(outputs):
+    def run(payloads):
+        handle_report = int_receive.handle_report
+        tic = time.perf_counter()
+        for p in payloads:
+            handle_report(p, outputs, tic)
+    return run
+
+
+# (name, setup) of every path. setup returns the callable run over the inputs,
+# whether it takes frames instead of report payloads and a cleanup callable.
+# the paths write their files to the current directory
+def bench_paths():
+    def plain(run, frames=False):
+        return lambda: (run, frames, lambda: None)
+
+    def text_sink():
+        outputs = int_receive.SwitchOutputs()
+        return run_parser(outputs), False, outputs.close
+
+    def binary_sink():
+        outputs = int_receive.BinaryHopWriter()
+        return run_parser(outputs), False, outputs.close
+
+    def statistics():
+        summaries = int_receive.report_statistics(interval=None, flows=True, quantiles=True, bursts=True)
+
+        def cleanup():
+            int_receive.report_observers.clear()
+            for source in summaries.sources:
+                if hasattr(source, "close"):
+                    source.close()
+        return run_handle_report(int_receive.SwitchOutputs(open_output=NullOutput)), False, cleanup
+
+    paths = [
+        ("decode_int_report", plain(run_decode)),
+        ("ring_frames", plain(run_frames, frames=True)),
+        ("int_parser/null_sink", plain(run_parser(int_receive.SwitchOutputs(open_output=NullOutput)))),
+        ("int_parser/text_sink", text_sink),
+        ("int_parser/binary_sink", binary_sink),
+        ("handle_report/statistics", statistics),
+    ]
+    if np is not None:
+        paths.insert(1, ("decode_int_reports_batch", plain(run_batch)))
+    return paths
+
+
+def allocs_per_report(run, inputs):
+    gc.collect()
+    gc.disable()
+    try:
+        before = sys.getallocatedblocks()
+        results = run(inputs)
+        after = sys.getallocatedblocks()
+    finally:
+        gc.enable()
+    del results
+    return (after - before) / len(inputs)
+
+
+def bench(run, inputs, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        run(inputs)
+        elapsed = time.perf_counter_ns() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def run_benchmarks(hop_counts, masks, l4s, reports=REPORTS, repeat=REPEAT, paths=None):
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.chdir(tmpdir)
+        try:
+            run_cases(results, hop_counts, masks, l4s, reports, repeat, paths)
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def run_cases(results, hop_counts, masks, l4s, reports, repeat, paths):
+    for num_hops in hop_counts:
+        for mask in masks:
+            for l4 in l4s:
+                payloads = synth_reports(reports, num_hops, mask, l4 == "tcp")
+                frames = [synth_frame(p) for p in payloads]
+                for name, setup in bench_paths():
+                    if paths and name not in paths:
+                        continue
+                    run, takes_frames, cleanup = setup()
+                    inputs = frames if takes_frames else payloads
+                    try:
+                        allocs = allocs_per_report(run, inputs)
+                        elapsed = bench(run, inputs, repeat)
+                    finally:
+                        cleanup()
+                    result = {
+                        "path": name,
+                        "hops": num_hops,
+                        "instruction_mask": f"{mask:#06x}",
+                        "l4": l4,
+                        "reports": reports,
+                        "reports_per_s": reports / (elapsed / 1e9),
+                        "ns_per_report": elapsed / reports,
+                        "allocs_per_report": allocs,
+                    }
+                    results.append(result)
+                    print(f"{name:<26} hops {num_hops} mask {mask:#06x} {l4:<3} "
+                          f"{result['reports_per_s']:>12.0f} reports/s {result['ns_per_report']:>10.0f} ns "
+                          f"{allocs:>7.1f} allocs")
+                    sys.stdout.flush()
+
+
+def result_key(result):
+    return (result["path"], result["hops"], result["instruction_mask"], result["l4"])
+
+
+# prints the ns/report change of every result against the same one in baseline
+def compare(results, baseline):
+    old = {result_key(r): r for r in baseline["results"]}
+    print("change against the baseline, ns/report:")
+    for result in results:
+        before = old.get(result_key(result))
+        if before is None:
+            continue
+        change = 100.0 * (result["ns_per_report"] / before["ns_per_report"] - 1.0)
+        print(f"  {result['path']:<26} hops {result['hops']} mask {result['instruction_mask']} "
+              f"{result['l4']:<3} {before['ns_per_report']:>10.0f} -> {result['ns_per_report']:>10.0f} "
+              f"({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="INT collector decode benchmarks")
+    parser.add_argument("--hops", type=int, nargs="+", default=[1, 3, 6],
+                        help="metadata stack depths to benchmark")
+    parser.add_argument("--masks", type=lambda v: int(v, 0), nargs="+", default=[0xFF00, 0xCC00],
+                        help="instruction masks to benchmark, e.g. 0xFF00")
+    parser.add_argument("--l4", choices=["udp", "tcp"], nargs="+", default=["udp", "tcp"],
+                        help="inner transport of the reports")
+    parser.add_argument("--reports", type=int, default=REPORTS, help="reports per run")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="runs per case, the fastest counts")
+    parser.add_argument("--paths", nargs="+", help="only run these decode paths")
+    parser.add_argument("--output", default=OUTPUT_PATH, help="JSON file the results are written to")
+    parser.add_argument("--compare", metavar="JSON", help="results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.hops, args.masks, args.l4, args.reports, args.repeat, args.paths)
+    with open(args.output, "w") as f:
+        json.dump({
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "numpy": None if np is None else np.__version__,
+            "results": results,
+        }, f, indent=1)
+    print(f"results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
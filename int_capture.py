@@ -0,0 +1,507 @@
+#!/usr/bin/env python3
+# native capture backends for int_receive.py
+#
+# TPacketV3Ring reads frames from a Linux AF_PACKET socket through a
+# memory-mapped TPACKET_V3 ring, so frames are handed to the INT decoder as
+# memoryviews into the ring without scapy dissecting them first.
+#
+# UdpBatchReceiver owns the collector UDP port and pulls reports out of the
+# kernel socket in batches with recvmmsg, falling back to recv_into.
+#
+# PcapFileReader replays pcap and pcapng captures, like the ones
+# run_exercise.py writes with --pcap, straight out of a memory-mapped file.
+import ctypes
+import ctypes.util
+import errno
+import mmap
+import select
+import socket
+import struct
+
+# linux/if_packet.h and linux/if_ether.h
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+ETH_P_ALL = 0x0003
+SO_ATTACH_FILTER = 26
+SO_RCVBUFFORCE = 33
+SO_ATTACH_REUSEPORT_CBPF = 51
+# bpf ancillary load of a random u32, SKF_AD_OFF + SKF_AD_RANDOM
+SKF_AD_RANDOM = 0xFFFFF000 + 56
+MSG_DONTWAIT = 0x40
+
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+
+# struct tpacket_req3
+TPACKET_REQ3_STRUCT = struct.Struct("IIIIIII")
+# struct tpacket_stats_v3: tp_packets, tp_drops, tp_freeze_q_cnt
+TPACKET_STATS_V3_STRUCT = struct.Struct("III")
+# struct tpacket_block_desc: version, offset_to_priv and the start of
+# tpacket_hdr_v1: block_status, num_pkts, offset_to_first_pkt
+BLOCK_DESC_STRUCT = struct.Struct("IIIII")
+BLOCK_STATUS_OFFSET = 8
+# struct tpacket3_hdr: tp_next_offset, tp_sec, tp_nsec, tp_snaplen, tp_len,
+# tp_status, tp_mac
+TPACKET3_HDR_STRUCT = struct.Struct("IIIIIIH")
+# the struct sockaddr_ll that follows the aligned tpacket3_hdr, sll_pkttype
+# tells frames the host sent apart from the ones it received
+SLL_PKTTYPE_OFFSET = 48 + 10
+PACKET_OUTGOING = 4
+
+ETH_TYPE_IPV4 = 0x0800
+IP_PROTO_UDP = 17
+
+ETH_HDR_SIZE = 14
+UDP_HDR_SIZE = 8
+ETH_TYPE_STRUCT = struct.Struct("!H")
+UDP_DPORT_STRUCT = struct.Struct("!2xH")
+
+
+# classic BPF equivalent of "ip and udp dst port <port>" for non fragmented
+# packets, so the kernel only copies collector traffic into the ring
+def udp_dport_filter(port):
+    # (code, jt, jf, k)
+    return [
+        (0x28, 0, 0, 12),              # ldh [12]
+        (0x15, 0, 8, ETH_TYPE_IPV4),   # jeq #0x800
+        (0x30, 0, 0, 23),              # ldb [23]
+        (0x15, 0, 6, IP_PROTO_UDP),    # jeq #17
+        (0x28, 0, 0, 20),              # ldh [20]
+        (0x45, 4, 0, 0x1FFF),          # jset #0x1fff (fragment offset)
+        (0xB1, 0, 0, 14),              # ldxb 4*([14]&0xf)
+        (0x48, 0, 0, 16),              # ldh [x + 16]
+        (0x15, 0, 1, port),            # jeq #port
+        (0x06, 0, 0, 0x40000),         # ret #262144
+        (0x06, 0, 0, 0),               # ret #0
+    ]
+
+
+# reuseport program that hands every datagram to a random socket of the
+# group. the default 4-tuple hash sends everything from one sink switch to
+# the same socket
+def reuseport_random_filter(num_socks):
+    return [
+        (0x20, 0, 0, SKF_AD_RANDOM),   # ld rand
+        (0x94, 0, 0, num_socks),       # mod #num_socks
+        (0x16, 0, 0, 0),               # ret a
+    ]
+
+
+def attach_filter(sock, program, optname=SO_ATTACH_FILTER):
+    insns = b"".join(struct.pack("HBBI", *insn) for insn in program)
+    buf = ctypes.create_string_buffer(insns)
+    # struct sock_fprog, the kernel copies the program during setsockopt
+    fprog = struct.pack("HP", len(program), ctypes.addressof(buf))
+    sock.setsockopt(socket.SOL_SOCKET, optname, fprog)
+
+
+# SO_RCVBUFFORCE lets root go past net.core.rmem_max, the kernel doubles
+# the requested size for its own bookkeeping
+def set_rcvbuf(sock, size):
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, size)
+    except OSError:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+
+
+# datagrams the kernel dropped on the UDP sockets bound to port, the last
+# column of /proc/net/udp. None where procfs is not available
+def udp_socket_drops(port, proc_paths=("/proc/net/udp", "/proc/net/udp6")):
+    drops = None
+    for path in proc_paths:
+        try:
+            with open(path) as f:
+                lines = f.readlines()[1:]
+        except OSError:
+            continue
+        for line in lines:
+            fields = line.split()
+            if int(fields[1].rsplit(":", 1)[1], 16) == port:
+                drops = (drops or 0) + int(fields[-1])
+    return drops
+
+
+# returns the UDP payload of an ethernet frame sent to port, or None. frames
+# that are not IPv4, have an IHL below 5 or are cut short before the end of
+# the UDP header are None too
+def udp_payload(frame : memoryview, port):
+    if len(frame) < ETH_HDR_SIZE + 20 + UDP_HDR_SIZE:
+        return None
+    if ETH_TYPE_STRUCT.unpack_from(frame, 12)[0] != ETH_TYPE_IPV4:
+        return None
+    version_ihl = frame[ETH_HDR_SIZE]
+    if version_ihl >> 4 != 4 or version_ihl & 0xF < 5:
+        return None
+    if frame[ETH_HDR_SIZE + 9] != IP_PROTO_UDP:
+        return None
+    udp_idx = ETH_HDR_SIZE + (version_ihl & 0xF) * 4
+    if udp_idx + UDP_HDR_SIZE > len(frame):
+        return None
+    if UDP_DPORT_STRUCT.unpack_from(frame, udp_idx)[0] != port:
+        return None
+    return frame[udp_idx + UDP_HDR_SIZE:]
+
+
+class TPacketV3Ring:
+    # AF_PACKET socket with a TPACKET_V3 rx ring bound to one interface.
+    # the kernel fills whole blocks of frames, blocks() yields the frames of
+    # each block as memoryviews and returns the block to the kernel once the
+    # caller asks for the next one, so frames must not be kept around
+
+    def __init__(self, iface, port=None, block_size=1 << 22, block_nr=64,
+                 frame_size=1 << 11, retire_blk_tov=60):
+        self.iface = iface
+        self.block_size = block_size
+        self.block_nr = block_nr
+
+        # totals of the kernel counters, which reset every time they are read
+        self.packets = 0
+        self.drops = 0
+        self.freeze_q_cnt = 0
+
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        try:
+            if port is not None:
+                attach_filter(self.sock, udp_dport_filter(port))
+            self.sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+            req = TPACKET_REQ3_STRUCT.pack(block_size, block_nr, frame_size,
+                                           (block_size * block_nr) // frame_size,
+                                           retire_blk_tov, 0, 0)
+            self.sock.setsockopt(SOL_PACKET, PACKET_RX_RING, req)
+            self.ring = mmap.mmap(self.sock.fileno(), block_size * block_nr,
+                                  mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            self.sock.bind((iface, ETH_P_ALL))
+        except OSError:
+            self.sock.close()
+            raise
+        self.view = memoryview(self.ring)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.sock.fileno() < 0:
+            return
+        self.stats()
+        self.sock.close()
+        self.view.release()
+        try:
+            self.ring.close()
+        except BufferError:
+            # a caller still holds a view into the ring, the mapping goes away
+            # once that view is garbage collected
+            pass
+
+    # reads the ring counters from the kernel and returns the running totals
+    # of (packets, drops, freeze_q_cnt)
+    def stats(self):
+        raw = self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, TPACKET_STATS_V3_STRUCT.size)
+        packets, drops, freeze_q_cnt = TPACKET_STATS_V3_STRUCT.unpack(raw)
+        self.packets += packets
+        self.drops += drops
+        self.freeze_q_cnt += freeze_q_cnt
+        return self.packets, self.drops, self.freeze_q_cnt
+
+    # fraction of the blocks the kernel has handed over and not got back yet,
+    # the one being read included
+    def backlog(self):
+        ready = 0
+        for i in range(self.block_nr):
+            status = struct.unpack_from("I", self.view, i * self.block_size + BLOCK_STATUS_OFFSET)[0]
+            ready += status & TP_STATUS_USER
+        return ready / self.block_nr
+
+    # yields the frames of every block the kernel hands over. an empty list is
+    # yielded when nothing arrived for timeout seconds so the caller can do
+    # periodic work
+    def blocks(self, timeout=1.0):
+        view = self.view
+        poller = select.poll()
+        poller.register(self.sock, select.POLLIN | select.POLLERR)
+        block_idx = 0
+
+        while True:
+            base = block_idx * self.block_size
+            _, _, status, num_pkts, offset = BLOCK_DESC_STRUCT.unpack_from(view, base)
+            if not status & TP_STATUS_USER:
+                if not poller.poll(timeout * 1000):
+                    yield []
+                continue
+
+            frames = []
+            for _ in range(num_pkts):
+                next_offset, _, _, snaplen, _, _, mac = TPACKET3_HDR_STRUCT.unpack_from(view, base + offset)
+                if view[base + offset + SLL_PKTTYPE_OFFSET] != PACKET_OUTGOING:
+                    start = base + offset + mac
+                    frames.append(view[start : start + snaplen])
+                offset += next_offset
+
+            try:
+                yield frames
+            finally:
+                for frame in frames:
+                    frame.release()
+                struct.pack_into("I", view, base + BLOCK_STATUS_OFFSET, TP_STATUS_KERNEL)
+            block_idx = (block_idx + 1) % self.block_nr
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p),
+                ("iov_len", ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p),
+                ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(iovec)),
+                ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p),
+                ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", msghdr),
+                ("msg_len", ctypes.c_uint)]
+
+
+def load_recvmmsg():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        recvmmsg = libc.recvmmsg
+    except (OSError, AttributeError, TypeError):
+        return None
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint,
+                         ctypes.c_int, ctypes.c_void_p]
+    recvmmsg.restype = ctypes.c_int
+    return recvmmsg
+
+
+class UdpBatchReceiver:
+    # UDP socket bound to the collector port. batches() yields lists of up to
+    # batch datagram payloads as memoryviews into a preallocated buffer that
+    # is reused for the next batch, so payloads must not be kept around.
+    # with reuseport several receivers, usually in different processes, bind
+    # the same port and the kernel spreads the datagrams between them
+
+    def __init__(self, port, host="0.0.0.0", batch=64, rcvbuf=None, max_size=1 << 11,
+                 reuseport=False, reuseport_filter=None):
+        self.batch = batch
+        self.max_size = max_size
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            if rcvbuf is not None:
+                set_rcvbuf(self.sock, rcvbuf)
+            if reuseport:
+                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self.sock.bind((host, port))
+            if reuseport_filter is not None:
+                attach_filter(self.sock, reuseport_filter, SO_ATTACH_REUSEPORT_CBPF)
+        except OSError:
+            self.sock.close()
+            raise
+
+        self.buf = bytearray(batch * max_size)
+        self.view = memoryview(self.buf)
+
+        self.recvmmsg = load_recvmmsg()
+        if self.recvmmsg is not None:
+            cbuf = (ctypes.c_char * len(self.buf)).from_buffer(self.buf)
+            base = ctypes.addressof(cbuf)
+            self.iovecs = (iovec * batch)()
+            self.msgs = (mmsghdr * batch)()
+            for i in range(batch):
+                self.iovecs[i].iov_base = base + i * max_size
+                self.iovecs[i].iov_len = max_size
+                self.msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+                self.msgs[i].msg_hdr.msg_iovlen = 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.sock.close()
+
+    def rcvbuf(self):
+        return self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+
+    # drains up to batch datagrams that are already queued on the socket
+    def recv_batch(self):
+        if self.recvmmsg is not None:
+            n = self.recvmmsg(self.sock.fileno(), self.msgs, self.batch, MSG_DONTWAIT, None)
+            if n < 0:
+                err = ctypes.get_errno()
+                if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return []
+                raise OSError(err, "recvmmsg failed")
+            msgs = self.msgs
+            size = self.max_size
+            return [self.view[i * size : i * size + msgs[i].msg_len] for i in range(n)]
+
+        payloads = []
+        for i in range(self.batch):
+            start = i * self.max_size
+            try:
+                n = self.sock.recv_into(self.view[start : start + self.max_size],
+                                        self.max_size, MSG_DONTWAIT)
+            except BlockingIOError:
+                break
+            payloads.append(self.view[start : start + n])
+        return payloads
+
+    # yields every batch of received payloads. an empty list is yielded when
+    # nothing arrived for timeout seconds so the caller can do periodic work
+    def batches(self, timeout=1.0):
+        poller = select.poll()
+        poller.register(self.sock, select.POLLIN)
+        while True:
+            if not poller.poll(timeout * 1000):
+                yield []
+                continue
+            yield self.recv_batch()
+
+
+# pcap magic numbers as read little-endian, for microsecond and nanosecond
+# timestamps. pcapng starts with a section header block instead
+PCAP_MAGIC_USEC = 0xA1B2C3D4
+PCAP_MAGIC_NSEC = 0xA1B23C4D
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_IDB = 1
+PCAPNG_SPB = 3
+PCAPNG_EPB = 6
+PCAPNG_OPT_IF_TSRESOL = 9
+LINKTYPE_ETHERNET = 1
+
+
+class PcapFileReader:
+    # iterates the (timestamp, frame) pairs of the ethernet frames of a pcap
+    # or pcapng file. frames are memoryviews into the mapped file, valid until
+    # the reader is closed. frames with another link type are counted in
+    # skipped
+
+    def __init__(self, path):
+        self.path = path
+        self.skipped = 0
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            # a caller still holds a frame, the mapping goes away with it
+            pass
+
+    def __iter__(self):
+        if len(self.view) < 4:
+            return iter(())
+        magic = struct.unpack_from("<I", self.view, 0)[0]
+        if magic == PCAPNG_SHB:
+            return self.read_pcapng()
+        return self.read_pcap()
+
+    def read_pcap(self):
+        view = self.view
+        magic = struct.unpack_from("<I", view, 0)[0]
+        if magic in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+            endian = "<"
+        else:
+            endian = ">"
+            magic = struct.unpack_from(">I", view, 0)[0]
+            if magic not in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+                raise ValueError(f"{self.path} is not a pcap or pcapng file")
+        scale = 1e-9 if magic == PCAP_MAGIC_NSEC else 1e-6
+        linktype = struct.unpack_from(endian + "I", view, 20)[0] & 0xFFFF
+
+        record = struct.Struct(endian + "IIII")
+        idx = 24
+        end = len(view) - record.size
+        while idx <= end:
+            ts_sec, ts_frac, incl_len, _ = record.unpack_from(view, idx)
+            idx += record.size
+            if linktype == LINKTYPE_ETHERNET:
+                yield ts_sec + ts_frac * scale, view[idx : idx + incl_len]
+            else:
+                self.skipped += 1
+            idx += incl_len
+
+    def read_pcapng(self):
+        view = self.view
+        endian = "<"
+        # per interface of the current section: (linktype, snaplen, seconds per tick)
+        interfaces = []
+        # simple packets carry no timestamp, they get the one of the packet before
+        timestamp = 0.0
+        idx = 0
+        while idx + 12 <= len(view):
+            block_type, block_len = struct.unpack_from(endian + "II", view, idx)
+            if block_type == PCAPNG_SHB:
+                bom = struct.unpack_from("<I", view, idx + 8)[0]
+                endian = "<" if bom == PCAPNG_BYTE_ORDER_MAGIC else ">"
+                block_len = struct.unpack_from(endian + "I", view, idx + 4)[0]
+                interfaces = []
+            elif block_type == PCAPNG_IDB:
+                linktype, snaplen = struct.unpack_from(endian + "H2xI", view, idx + 8)
+                interfaces.append((linktype, snaplen,
+                                   self.if_tsresol(idx + 16, idx + block_len - 4, endian)))
+            elif block_type == PCAPNG_EPB:
+                if_id, ts_high, ts_low, cap_len = struct.unpack_from(endian + "IIII", view, idx + 8)
+                linktype, _, tick = self.interface(interfaces, if_id, idx)
+                timestamp = ((ts_high << 32) | ts_low) * tick
+                if linktype == LINKTYPE_ETHERNET:
+                    yield timestamp, view[idx + 28 : idx + 28 + cap_len]
+                else:
+                    self.skipped += 1
+            elif block_type == PCAPNG_SPB:
+                # the captured length of a simple packet is its original
+                # length cut to the snap length of the interface, the block
+                # pads it to 32 bits
+                linktype, snaplen, _ = self.interface(interfaces, 0, idx)
+                cap_len = struct.unpack_from(endian + "I", view, idx + 8)[0]
+                if snaplen:
+                    cap_len = min(cap_len, snaplen)
+                if linktype == LINKTYPE_ETHERNET:
+                    yield timestamp, view[idx + 12 : idx + 12 + min(cap_len, block_len - 16)]
+                else:
+                    self.skipped += 1
+            if block_len < 12:
+                raise ValueError(f"{self.path} has a corrupt pcapng block at offset {idx}")
+            idx += block_len
+
+    # the IDB of the current section a packet block at idx refers to
+    def interface(self, interfaces, if_id, idx):
+        if if_id >= len(interfaces):
+            raise ValueError(f"{self.path} has a packet block for unknown interface {if_id} at offset {idx}")
+        return interfaces[if_id]
+
+    # seconds per timestamp tick from the if_tsresol option of an IDB,
+    # microseconds unless the option says otherwise
+    def if_tsresol(self, idx, end, endian):
+        while idx + 4 <= end:
+            code, length = struct.unpack_from(endian + "HH", self.view, idx)
+            if code == 0:
+                break
+            if code == PCAPNG_OPT_IF_TSRESOL:
+                resol = self.view[idx + 4]
+                return 2.0 ** -(resol & 0x7F) if resol & 0x80 else 10.0 ** -resol
+            idx += 4 + ((length + 3) & ~3)
+        return 1e-6
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# logging for the INT collector scripts
+#
+# the collectors log through the logging module instead of printing and
+# flushing stdout for every packet. StatusLine logs one line of rates per
+# interval from a daemon thread, the hot path only adds to its counters,
+# and Sampler picks the 1 in N packets verbose dumps are printed for.
+import logging
+import sys
+import threading
+import time
+
+LEVELS = ("debug", "info", "warning", "error")
+LOG_FORMAT = "%(asctime)s %(levelname)s %(message)s"
+# seconds between status lines
+STATUS_INTERVAL = 1.0
+
+
+# adds --log-level, --status-interval and --dump-every to parser
+def add_arguments(parser, dump_every=0):
+    parser.add_argument("--log-level", choices=LEVELS, default="info",
+                        help="messages below this level are not logged")
+    parser.add_argument("--status-interval", type=float, default=STATUS_INTERVAL,
+                        help="seconds between the status lines with the packet rates, 0 disables them")
+    parser.add_argument("--dump-every", type=int, default=dump_every, metavar="N",
+                        help="print the decoded headers of one packet in N, 0 never does")
+
+
+def setup(level="info"):
+    logging.basicConfig(level=getattr(logging, level.upper()), format=LOG_FORMAT, stream=sys.stdout)
+
+
+class Sampler:
+    # sample() is true for one call in every
+    __slots__ = ("every", "countdown")
+
+    def __init__(self, every):
+        self.every = every
+        self.countdown = every
+
+    def sample(self):
+        self.countdown -= 1
+        if self.countdown:
+            return False
+        self.countdown = self.every
+        return True
+
+
+class StatusLine:
+    # packets and errors are counted by the hot path, the status thread logs
+    # their rates every interval seconds while packets keep arriving.
+    # extra() returns more text for the line, e.g. queue depths
+    def __init__(self, logger, interval=STATUS_INTERVAL, what="packets", extra=None, label=None):
+        self.logger = logger
+        self.interval = interval
+        self.what = what
+        self.extra = extra
+        self.label = label
+        self.packets = 0
+        self.errors = 0
+        self.stop = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        if self.interval:
+            self.stop.clear()
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        last = time.monotonic()
+        last_packets = self.packets
+        last_errors = self.errors
+        while not self.stop.wait(self.interval):
+            now = time.monotonic()
+            packets, errors = self.packets, self.errors
+            if packets != last_packets or errors != last_errors:
+                elapsed = now - last
+                line = (f"{(packets - last_packets) / elapsed:0.0f} {self.what}/s, "
+                        f"{packets} {self.what} total, {errors - last_errors} errors")
+                if self.extra is not None:
+                    line += ", " + self.extra()
+                if self.label is not None:
+                    line = f"{self.label}: {line}"
+                self.logger.info(line)
+            last, last_packets, last_errors = now, packets, errors
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# Prometheus metrics endpoint for int_receive.py
+#
+# the hot path only adds to plain attributes of a counters object owned by
+# the calling thread, so no lock or atomic is ever taken per report. a
+# scrape adds up the counters of every thread and samples the registered
+# gauges, e.g. queue depths, from the HTTP server thread.
+import http.server
+import threading
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class ThreadCounters:
+    # counters of one thread. switch_reports counts the decoded reports of
+    # every sw_id, write_seconds and writes time the writes to the outputs
+    __slots__ = ("received", "decoded", "errors", "switch_reports", "bytes_written", "writes",
+                 "write_seconds")
+
+    def __init__(self):
+        self.received = 0
+        self.decoded = 0
+        self.errors = 0
+        self.switch_reports = {}
+        self.bytes_written = 0
+        self.writes = 0
+        self.write_seconds = 0.0
+
+
+# (attribute, metric name, help) of the plain ThreadCounters counters
+COUNTERS = (
+    ("received", "int_reports_received_total", "INT reports handed to the decoder"),
+    ("decoded", "int_reports_decoded_total", "INT reports decoded"),
+    ("errors", "int_decode_errors_total", "malformed INT reports skipped"),
+    ("bytes_written", "int_output_bytes_written_total", "bytes written to the outputs"),
+)
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, values)) + "}"
+
+
+class Metrics:
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # counters of every thread that ever counted, finished ones included
+        self.threads = []
+        # (name, help, kind, label names, value) sampled on scrape
+        self.samples = []
+
+    # counters of the calling thread
+    def counters(self):
+        try:
+            return self.local.counters
+        except AttributeError:
+            counters = self.local.counters = ThreadCounters()
+            with self.lock:
+                self.threads.append(counters)
+            return counters
+
+    # registers a metric read on scrape. value() returns a number, or with
+    # labels a dict of label value tuples to numbers. kind is gauge or counter
+    def register(self, name, help, value, kind="gauge", labels=()):
+        with self.lock:
+            self.samples.append((name, help, kind, labels, value))
+
+    def render(self):
+        with self.lock:
+            threads = list(self.threads)
+            samples = list(self.samples)
+
+        lines = []
+
+        def metric(name, help, kind, labels, values):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for label_values, value in values:
+                lines.append(f"{name}{format_labels(labels, label_values)} {value}")
+
+        for attr, name, help in COUNTERS:
+            metric(name, help, "counter", (), [((), sum(getattr(t, attr) for t in threads))])
+
+        switch_reports = {}
+        for t in threads:
+            # a scrape can run while the owning thread adds a new switch
+            for sw_id, n in list(t.switch_reports.items()):
+                switch_reports[sw_id] = switch_reports.get(sw_id, 0) + n
+        metric("int_switch_reports_total", "INT reports decoded per sink switch", "counter", ("sw_id",),
+               [((sw_id,), n) for sw_id, n in sorted(switch_reports.items())])
+
+        metric("int_output_write_seconds", "time spent in output writes", "summary", (), [])
+        lines.append(f"int_output_write_seconds_sum {sum(t.write_seconds for t in threads)}")
+        lines.append(f"int_output_write_seconds_count {sum(t.writes for t in threads)}")
+
+        for name, help, kind, labels, value in samples:
+            values = value()
+            if labels:
+                values = sorted(values.items())
+            else:
+                values = [((), values)]
+            metric(name, help, kind, labels, values)
+
+        return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    metrics = None
+
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# serves metrics on http://host:port/metrics from a daemon thread
+def serve(metrics, port, host=""):
+    handler = type("BoundMetricsHandler", (MetricsHandler,), {"metrics": metrics})
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
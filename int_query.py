@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# range and downsampling queries over an int_tsdb store
+#
+# query() aggregates one (switch, metric) series over a time range into
+# buckets of a given width and returns the bucket start times and the
+# aggregates as numpy arrays, what the notebooks' readData builds by hand
+# from the s<id>_data.txt outputs:
+#   times, latency = int_query.query("tsdb", 1, "hop_latency", 0, 60, 1.0, "mean")
+# mean, min, max and count are answered from the coarsest rollup of the
+# store whose resolution divides the bucket width and the range boundaries,
+# percentiles (p50, p99.9, ...) and finer buckets from the raw chunks. the
+# rollups of a series still being written lag its chunks by their newest
+# bucket, that tail comes from the finer rollups and the raw chunks.
+#
+#   python int_query.py DIR SWITCH METRIC [--start S] [--end S] [--width S] [--agg AGG]
+# prints "start, value" lines in the format of the text outputs.
+import argparse
+import math
+
+# numpy holds the results and is required by query()
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import int_tsdb
+
+AGGREGATIONS = ("mean", "min", "max", "count")
+# rollup record columns
+ROLLUP_COUNT = 1
+ROLLUP_SUM = 2
+ROLLUP_MIN = 3
+ROLLUP_MAX = 4
+
+
+# the percentile, 0 to 100, of a pN aggregation, None for the others
+def percentile(agg):
+    if agg in AGGREGATIONS:
+        return None
+    try:
+        q = float(agg[1:]) if agg[:1] == "p" else None
+    except ValueError:
+        q = None
+    if q is None or not 0 <= q <= 100:
+        raise ValueError(f"unknown aggregation {agg}, use one of {', '.join(AGGREGATIONS)} or pN")
+    return q
+
+
+def open_store(store):
+    return int_tsdb.TimeSeriesStore(store) if isinstance(store, str) else store
+
+
+# (start times of the buckets, aggregate of every bucket) of the points of a
+# series in [start, end) split into buckets of width seconds starting at
+# start. start defaults to the first point rounded down to a multiple of
+# width, end to the end of the bucket of the last point. empty buckets are
+# nan, 0 for count.
+# store is a TimeSeriesStore or the path of one
+def query(store, sw_id, metric, start=None, end=None, width=1.0, agg="mean"):
+    if np is None:
+        raise RuntimeError("query needs numpy")
+    q = percentile(agg)
+    store = open_store(store)
+    unit = store.time_unit
+    width_ticks = round(width / unit)
+    if width_ticks < 1:
+        raise ValueError(f"bucket width {width} is below the store resolution {unit}")
+
+    if start is None or end is None:
+        index = store.index(sw_id, metric)
+        if not len(index):
+            return np.zeros(0), np.zeros(0)
+    if start is None:
+        start_tick = int(index["t_min"].min()) // width_ticks * width_ticks
+    else:
+        start_tick = round(start / unit)
+    if end is None:
+        # whole buckets keep the range aligned to the rollups
+        end_tick = int(index["t_max"].max()) + 1
+        end_tick += -(end_tick - start_tick) % width_ticks
+    else:
+        end_tick = round(end / unit)
+    buckets = max(-(-(end_tick - start_tick) // width_ticks), 0)
+    times = (start_tick + np.arange(buckets) * width_ticks) * unit
+
+    # (rows, start tick of every row) from the rollups, then the raw points
+    # from raw_start on
+    parts = []
+    raw_start = start_tick
+    if q is None:
+        raw_start = rollup_parts(store, sw_id, metric, start_tick, end_tick, width_ticks, parts)
+    if raw_start < end_tick:
+        ticks, values = store.read_ticks(sw_id, metric, raw_start, end_tick)
+    else:
+        ticks, values = np.zeros(0, np.int64), np.zeros(0, np.int64)
+    if q is not None:
+        return times, bucket_percentiles((ticks - start_tick) // width_ticks, values, buckets, q)
+    # raw points are rollup rows of a single point
+    parts.append((np.column_stack((ticks, np.ones_like(values), values, values, values)), ticks))
+    rows = np.concatenate([rows for rows, _ in parts])
+    row_ticks = np.concatenate([row_ticks for _, row_ticks in parts])
+    return times, aggregate_rollup(rows, row_ticks, start_tick, width_ticks, buckets, agg)
+
+
+# appends the rollup rows of the series making up the buckets of width_ticks
+# from start_tick to end_tick to parts, from the coarsest rollup the buckets
+# are made of, then from finer ones for the tail the coarser ones do not cover
+# yet. returns the tick the raw points are needed from
+def rollup_parts(store, sw_id, metric, start_tick, end_tick, width_ticks, parts):
+    cursor = start_tick
+    for resolution, ticks in sorted(store.rollups.items(), key=lambda item: -item[1]):
+        if width_ticks % ticks or cursor % ticks or end_tick % ticks:
+            continue
+        if not store.has_rollup(sw_id, metric, resolution):
+            continue
+        rows = store.rollup(sw_id, metric, resolution)
+        if not len(rows):
+            continue
+        row_ticks = rows[:, 0] * ticks
+        covered = min(int(row_ticks.max()) + ticks, end_tick)
+        if covered <= cursor:
+            continue
+        sel = (row_ticks >= cursor) & (row_ticks < covered)
+        parts.append((rows[sel], row_ticks[sel]))
+        cursor = covered
+        if cursor >= end_tick:
+            break
+    return cursor
+
+
+# agg of the rows with start ticks in [start_tick, start_tick + buckets * width_ticks)
+def aggregate_rollup(rows, row_ticks, start_tick, width_ticks, buckets, agg):
+    bucket = (row_ticks - start_tick) // width_ticks
+    sel = (bucket >= 0) & (bucket < buckets)
+    bucket, rows = bucket[sel], rows[sel]
+    counts = np.bincount(bucket, weights=rows[:, ROLLUP_COUNT], minlength=buckets)
+    if agg == "count":
+        return counts
+    if agg == "mean":
+        sums = np.bincount(bucket, weights=rows[:, ROLLUP_SUM], minlength=buckets)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return sums / counts
+    result = np.full(buckets, np.inf if agg == "min" else -np.inf)
+    if agg == "min":
+        np.minimum.at(result, bucket, rows[:, ROLLUP_MIN])
+    else:
+        np.maximum.at(result, bucket, rows[:, ROLLUP_MAX])
+    result[counts == 0] = np.nan
+    return result
+
+
+# q-th percentile of the values of every bucket, interpolated linearly
+# between the closest ranks like np.percentile
+def bucket_percentiles(bucket, values, buckets, q):
+    sel = (bucket >= 0) & (bucket < buckets)
+    bucket, values = bucket[sel], values[sel]
+    order = np.lexsort((values, bucket))
+    values = values[order].astype(np.float64)
+    counts = np.bincount(bucket, minlength=buckets)
+    firsts = np.cumsum(counts) - counts
+    result = np.full(buckets, np.nan)
+    full = counts > 0
+    rank = firsts[full] + (counts[full] - 1) * (q / 100)
+    lower = np.floor(rank).astype(np.int64)
+    upper = np.ceil(rank).astype(np.int64)
+    result[full] = values[lower] + (values[upper] - values[lower]) * (rank - lower)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="aggregate an INT time series over time buckets")
+    parser.add_argument("root", help="int_tsdb store directory")
+    parser.add_argument("switch", type=int, help="switch id")
+    parser.add_argument("metric", help="hop field, e.g. hop_latency or q_occupancy")
+    parser.add_argument("--start", type=float, default=None,
+                        help="seconds, default the first point rounded down to --width")
+    parser.add_argument("--end", type=float, default=None, help="seconds, default after the last point")
+    parser.add_argument("--width", type=float, default=1.0, help="bucket width in seconds")
+    parser.add_argument("--agg", default="mean", help=", ".join(AGGREGATIONS) + " or pN, e.g. p99")
+    args = parser.parse_args()
+
+    try:
+        percentile(args.agg)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        times, values = query(args.root, args.switch, args.metric, args.start, args.end, args.width, args.agg)
+    except KeyError:
+        parser.error(f"{args.root} has no {args.metric} series for switch {args.switch}")
+    for t, v in zip(times.tolist(), values.tolist()):
+        if not math.isnan(v):
+            print(f"{t:0.4f}, {v:g}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,23 +2,166 @@
 import sys
 import struct
 import os
-
-from scapy.all import sniff, sendp, hexdump, get_if_list, get_if_hwaddr
-from scapy.all import Packet, IPOption
-from scapy.all import ShortField, IntField, LongField, BitField, FieldListField, FieldLenField
-from scapy.all import IP, TCP, UDP, Raw
-from scapy.layers.inet import _IPOption_HDR
+import operator
+
+import argparse
+import array
+import asyncio
+import collections
+import contextlib
+import functools
+import glob
+import heapq
+import logging
+import mmap
+import multiprocessing
+import signal
+import socket
+import threading
 import time
+import zlib
+
+# scapy is only needed by the fallback capture backend
+try:
+    from scapy.all import sniff, get_if_list
+    from scapy.all import UDP
+except ImportError:
+    sniff = None
+
+# numpy is only needed by the batch decoder
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import int_capture
+import int_log
+import int_metrics
+import int_shm
+import int_tsdb
+
+log = logging.getLogger("int_receive")
 
 # header sizes in bytes
 INT_REPORT_SIZE = 16
 ETH_SIZE = 14 
 IP_SIZE = 20
 UDP_SIZE = 8
+TCP_SIZE = 20
 INT_SHIM_SIZE = 4
 INT_HEADER = 8
 
-BYTE_SIZE = 8
+# int_shim.len counts the INT shim and INT header words as well as the stack
+INT_HEADER_LEN_WORD = 3
+WORD_SIZE = 4
+
+IP_PROTO_TCP = 6
+
+# udp port the sink switches send INT reports to
+COLLECTOR_PORT = 8002
+
+# report_fixed_header seq_no is a 32 bit per switch counter that wraps
+SEQ_MODULO = 1 << 32
+# seq_no values before the newest one remembered per switch to tell
+# duplicates from reordered reports
+SEQ_WINDOW = 64
+# seconds between the periodic statistics summaries
+SUMMARY_INTERVAL = 10.0
+
+# the report_fixed_header ingress_tstamp counts microseconds and the hop
+# ingress and egress tstamps nanoseconds of the switch clock, in 32 bits
+# that wrap every 71 minutes and every 4.3 seconds
+TSTAMP_MODULO = 1 << 32
+TSTAMP_MASK = TSTAMP_MODULO - 1
+TSTAMP_HALF = TSTAMP_MODULO >> 1
+REPORT_TSTAMP_UNIT = 1e-6
+HOP_TSTAMP_UNIT = 1e-9
+# what the hops are timestamped with: anchored switch timelines starting at
+# the collector arrival of the first report of each switch, switch timelines
+# starting at 0, or the collector arrival of the report
+TIMESTAMP_MODES = ("anchored", "switch", "arrival")
+
+# --profile times one report in PROFILE_EVERY by default
+PROFILE_EVERY = 100
+
+# load shedding levels above 0, which decodes every report: decode 1 in
+# --shed-every flows or reports of a switch, only count the reports from
+# their report header
+SHED_SAMPLED = 1
+SHED_HEADERS = 2
+SHED_EVERY = 8
+# the load is the smoothed fill level of the collector input. shedding goes
+# up a level once the load stayed at or above SHED_HIGH for SHED_HOLD seconds
+# and back down once it stayed at or below SHED_LOW for SHED_RECOVERY seconds
+SHED_HIGH = 0.8
+SHED_LOW = 0.3
+SHED_HOLD = 0.5
+SHED_RECOVERY = 5.0
+# weight of a new fill level in the smoothed load
+SHED_SMOOTHING = 0.25
+
+# flows kept in the flow table, the least recently seen flow is evicted to
+# make room for a new one
+FLOW_TABLE_SIZE = 1 << 18
+# seconds without a report after which a flow is dropped from the table
+FLOW_IDLE_TIMEOUT = 60.0
+# per flow statistics written when the collector stops
+FLOW_OUTPUT_PATH = "flows.txt"
+# reports per distinct path, written when the collector stops
+PATH_OUTPUT_PATH = "paths.txt"
+PATH_OUTPUT_HEADER = "# path_id, reports, path\n"
+# one line for every flow seen taking a new path
+PATH_CHANGE_OUTPUT_PATH = "path_changes.txt"
+PATH_CHANGE_OUTPUT_HEADER = "# time, flow, old_path, new_path\n"
+FLOW_OUTPUT_HEADER = ("# src_addr, dst_addr, protocol, src_port, dst_port, reports, "
+                      "hop_latency_sum, hop_latency_max, q_occupancy_max, path\n")
+
+# log histograms keep 2^HISTOGRAM_SUB_BITS buckets per power of two, a
+# relative error of about 3%, over the 32 bit range of the hop fields
+HISTOGRAM_SUB_BITS = 5
+HISTOGRAM_BUCKETS = (32 - HISTOGRAM_SUB_BITS + 1) << HISTOGRAM_SUB_BITS
+# quantiles are kept over a sliding window of QUANTILE_WINDOW seconds made of
+# QUANTILE_SLOT second slots
+QUANTILE_WINDOW = 10.0
+QUANTILE_SLOT = 1.0
+QUANTILES = (0.5, 0.99, 0.999)
+# quantiles of the current window, appended at every summary
+QUANTILE_OUTPUT_PATH = "quantiles.txt"
+QUANTILE_OUTPUT_HEADER = "# time, sw_id, port, metric, count, p50, p99, p99.9, max\n"
+# whole run histograms written on exit, one sparse bucket:count list per line
+SKETCH_OUTPUT_PATH = "sketches.txt"
+
+# a microburst starts when the queue occupancy of an egress port reaches
+# BURST_RISE and ends when it falls back to BURST_FALL or below
+BURST_RISE = 20
+BURST_FALL = 5
+# distinct flows recorded per burst, the reports of any further flow are
+# only counted
+BURST_FLOWS = 8
+BURST_OUTPUT_PATH = "bursts.txt"
+BURST_OUTPUT_HEADER = "# start, end, duration, sw_id, port, peak, peak_time, samples, flows\n"
+
+# per switch output file, formatted with the switch id
+OUTPUT_PATH_FORMAT = "s{}_data.txt"
+# output files kept open at once, the least recently written one is closed
+# when a new switch shows up and is reopened for appending when needed again
+MAX_OPEN_OUTPUTS = 256
+
+# binary output, one fixed size little-endian record per hop: the collector
+# timestamp, the hop tuple fields and a bitmap of the fields the hop has.
+# written as an .npy file so the analysis side can np.load or np.memmap it
+# without parsing
+BINARY_OUTPUT_PATH = "int_hops.npy"
+# struct codes of the hop fields of a record, in HOP_FIELD_NAMES order
+HOP_RECORD_FIELDS = "HHIBIIIIIHH"
+HOP_RECORD_STRUCT = struct.Struct("<d" + HOP_RECORD_FIELDS + "H")
+# records buffered before one write to disk
+HOP_RECORD_CHUNK = 1 << 14
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+
+# time-series store output, one compressed chunked series per switch and
+# recorded field, see int_tsdb.py
+TSDB_PATH = "tsdb"
 
 # use this constant to specify which int data to collect
 INGRESS_PORT_ID_DATA = 0
@@ -30,28 +173,172 @@ INGRESS_TSTAMP_DATA = 5
 EGRESS_TSTAMP_DATA = 6
 EGRESS_PORT_TX_UTIL_DATA = 7
 
-# convert a byte String to a binary String
-def bytes2bin(byteStr : bytes):
-
-    binaryString = ''
-
-    for byte in byteStr:
-        # [2:] to strip the 0x and add 0 padding to the left
-        b = bin(byte)[2:].rjust(BYTE_SIZE, '0')
-        binaryString += b
-
-    return binaryString
-
-# will read len number of binary from binStr starting 
-# at bin_idx position, then increments bin_idx by len 
-def bin2int(binStr, bin_idx, len):
-    b = binStr[bin_idx : bin_idx + len]
-    bin_idx += len 
-    value = int(b, 2)
-    return value, bin_idx
-
-
-def parse_int_report_hdr(payload : bytes, payload_idx, printInfo=False):
+# precompiled big-endian layouts of the report headers, one struct per header.
+# sub-byte fields are packed into the smallest enclosing integer and extracted
+# with shifts and masks, so no intermediate binary strings are built
+INT_REPORT_HDR_STRUCT = struct.Struct("!IIII")
+ETH_HDR_STRUCT = struct.Struct("!HIHIH")
+IPV4_HDR_STRUCT = struct.Struct("!BBHHHBBHII")
+UDP_HDR_STRUCT = struct.Struct("!HHHH")
+TCP_HDR_STRUCT = struct.Struct("!HHIIHHHH")
+INT_SHIM_HDR_STRUCT = struct.Struct("!BBBB")
+INT_HEADER_STRUCT = struct.Struct("!HBBHH")
+
+# the fixed headers of a report up to the inner L4 ports in a single unpack,
+# skipping the fields the hot path does not need with pad bytes
+# [INT REPORT HDR] sw_id, seq_no, ingress_tstamp
+# [ETH]            skipped
+# [IP]             protocol, src_addr, dst_addr
+# [UDP/TCP]        src_port, dst_port
+INT_REPORT_PREFIX_STRUCT = struct.Struct("!4xIII" "14x" "9xB2xII" "HH")
+INNER_L4_OFFSET = INT_REPORT_SIZE + ETH_SIZE + IP_SIZE
+# tcp data_offset lives in the high nibble of byte 12 of the tcp header,
+# unpacked so a truncated report raises struct.error like the other headers
+TCP_DATA_OFFSET_IDX = INNER_L4_OFFSET + 12
+TCP_DATA_OFFSET_STRUCT = struct.Struct("!B")
+# sw_id and seq_no, all a shed report is decoded for
+SHED_HEADER_STRUCT = struct.Struct("!4xII")
+# sw_id the capture process of --decoders picks the decoder of a report by
+REPORT_SW_ID_STRUCT = struct.Struct("!4xI")
+# ip total length, what a contiguous buffer of reports is split by
+REPORT_IP_LEN_IDX = INT_REPORT_SIZE + ETH_SIZE + 2
+REPORT_IP_LEN_STRUCT = struct.Struct("!H")
+# the inner ip addresses and l4 ports the flow sampling of a shed collector hashes
+FLOW_HASH_START = INT_REPORT_SIZE + ETH_SIZE + 12
+FLOW_HASH_END = INNER_L4_OFFSET + 4
+
+# [INT SHIM]       len
+# [INT HEADER]     hop_metadata_len, remaining_hop_cnt, instruction masks
+INT_HEADERS_STRUCT = struct.Struct("!2xBx" "2xBBH2x")
+INT_HEADERS_SIZE = INT_SHIM_SIZE + INT_HEADER
+
+# decoded INT hop tuples are indexed by the *_DATA constants above, with the
+# fields that have no record constant appended after them
+SWITCH_ID_DATA = 8
+LEVEL2_INGRESS_PORT_ID_DATA = 9
+LEVEL2_EGRESS_PORT_ID_DATA = 10
+HOP_FIELDS = 11
+
+# names of the hop tuple fields, indexed by the *_DATA constants
+HOP_FIELD_NAMES = ("ingress_port_id", "egress_port_id", "hop_latency", "q_id", "q_occupancy",
+                   "ingress_tstamp", "egress_tstamp", "egress_port_tx_util",
+                   "switch_id", "level2_ingress_port_id", "level2_egress_port_id")
+
+# INT v1.0 instructions, from bit 0 (the msb of instruction_mask_0003) on:
+# the struct format each one pushes on the stack and the hop tuple indices
+# its values land in. q_id/q_occupancy share one word and are split after
+# unpacking. instructions 8-15 are reserved and still take one word each
+INT_INSTRUCTIONS = (
+    ("I", (SWITCH_ID_DATA,)),
+    ("HH", (INGRESS_PORT_ID_DATA, EGRESS_PORT_ID_DATA)),
+    ("I", (HOP_LATENCY_DATA,)),
+    ("I", (Q_ID_DATA,)),
+    ("I", (INGRESS_TSTAMP_DATA,)),
+    ("I", (EGRESS_TSTAMP_DATA,)),
+    ("HH", (LEVEL2_INGRESS_PORT_ID_DATA, LEVEL2_EGRESS_PORT_ID_DATA)),
+    ("I", (EGRESS_PORT_TX_UTIL_DATA,)),
+) + (("4x", ()),) * 8
+
+# instruction_mask bits of the hop ingress and egress tstamps
+INGRESS_TSTAMP_BIT = 0x8000 >> 4
+EGRESS_TSTAMP_BIT = 0x8000 >> 5
+
+
+class IntDecodePlan:
+    # the per-hop layout of the INT metadata stack for one combination of
+    # instruction_mask and hop_metadata_len, compiled once by get_decode_plan
+    __slots__ = ("instruction_mask", "hop_metadata_len", "hop_size", "hop_struct",
+                 "getter", "pad", "q_idx", "record_struct", "record_getter", "record_valid")
+
+    def __init__(self, instruction_mask, hop_metadata_len):
+        self.instruction_mask = instruction_mask
+        self.hop_metadata_len = hop_metadata_len
+        self.hop_size = hop_metadata_len * WORD_SIZE
+
+        fmt = "!"
+        positions = [None] * HOP_FIELDS
+        num_values = 0
+        q_idx = None
+        for bit, (field_fmt, data_idx) in enumerate(INT_INSTRUCTIONS):
+            if not instruction_mask & (0x8000 >> bit):
+                continue
+            fmt += field_fmt
+            for idx in data_idx:
+                positions[idx] = num_values
+                num_values += 1
+            if Q_ID_DATA in data_idx:
+                q_idx = positions[Q_ID_DATA]
+
+        hop_struct = struct.Struct(fmt)
+        if hop_struct.size > self.hop_size:
+            raise ValueError(f"instruction mask {instruction_mask:#06x} needs {hop_struct.size} bytes "
+                             f"per hop, hop_metadata_len only allows {self.hop_size}")
+        # hop_metadata_len is authoritative for the stride of the stack
+        self.hop_struct = struct.Struct(fmt + f"{self.hop_size - hop_struct.size}x")
+
+        # fields that were not requested read from a trailing None pad
+        self.pad = (None,)
+        if q_idx is not None:
+            positions[Q_OCCUPANCY_DATA] = q_idx
+        self.getter = operator.itemgetter(*[num_values if p is None else p for p in positions])
+        self.q_idx = q_idx
+
+        # binary hop record of the hops of the plan, the fields it does not
+        # request are zero pad bytes with their valid bit clear.
+        # record_getter is None when every field is requested
+        present = [idx for idx in range(HOP_FIELDS) if positions[idx] is not None]
+        self.record_valid = sum(1 << idx for idx in present)
+        self.record_struct = struct.Struct("<d" + "".join(
+            code if positions[idx] is not None else f"{struct.calcsize(code)}x"
+            for idx, code in enumerate(HOP_RECORD_FIELDS)) + "H")
+        if len(present) == HOP_FIELDS:
+            self.record_getter = None
+        elif len(present) > 1:
+            self.record_getter = operator.itemgetter(*present)
+        else:
+            self.record_getter = lambda hop: [hop[idx] for idx in present]
+
+
+# decode plans cached by (instruction_mask, hop_metadata_len)
+decode_plans = {}
+
+# returns the cached decode plan of a mask combination, compiling it on first use
+def get_decode_plan(instruction_mask, hop_metadata_len):
+    plan = decode_plans.get((instruction_mask, hop_metadata_len))
+    if plan is None:
+        plan = IntDecodePlan(instruction_mask, hop_metadata_len)
+        decode_plans[(instruction_mask, hop_metadata_len)] = plan
+    return plan
+
+
+class IntReport:
+    # the fields of one INT report that the collector keeps, the remaining
+    # header fields are only decoded by the parse_* functions for printing
+    __slots__ = ("sw_id", "seq_no", "ingress_tstamp",
+                 "protocol", "src_addr", "dst_addr", "src_port", "dst_port",
+                 "int_shim_len", "hop_metadata_len", "remaining_hop_cnt",
+                 "instruction_mask", "hops")
+
+    def __init__(self, sw_id, seq_no, ingress_tstamp,
+                 protocol, src_addr, dst_addr, src_port, dst_port,
+                 int_shim_len, hop_metadata_len, remaining_hop_cnt,
+                 instruction_mask, hops):
+        self.sw_id = sw_id
+        self.seq_no = seq_no
+        self.ingress_tstamp = ingress_tstamp
+        self.protocol = protocol
+        self.src_addr = src_addr
+        self.dst_addr = dst_addr
+        self.src_port = src_port
+        self.dst_port = dst_port
+        self.int_shim_len = int_shim_len
+        self.hop_metadata_len = hop_metadata_len
+        self.remaining_hop_cnt = remaining_hop_cnt
+        self.instruction_mask = instruction_mask
+        self.hops = hops
+
+
+def parse_int_report_hdr(payload : memoryview, payload_idx, printInfo=False):
     # header int_report_fixed_header_t
     # bit<4>  ver;
     # bit<4>  len;
@@ -66,35 +353,18 @@ def parse_int_report_hdr(payload : bytes, payload_idx, printInfo=False):
     # bit<32> seq_no;
     # bit<32> ingress_tstamp;
 
-    int_rep_hdr = payload[payload_idx : payload_idx + INT_REPORT_SIZE]
+    word, sw_id, seq_no, ingress_tstamp = INT_REPORT_HDR_STRUCT.unpack_from(payload, payload_idx)
     payload_idx += INT_REPORT_SIZE
 
-    hdr_idx = 0
-    binStr = bytes2bin(int_rep_hdr)
-
-
-    ver, hdr_idx = bin2int(binStr, hdr_idx, 4)
-
-    len, hdr_idx = bin2int(binStr, hdr_idx, 4)
-
-    nproto, hdr_idx = bin2int(binStr, hdr_idx, 3)
-
-    rep_md_bits, hdr_idx = bin2int(binStr, hdr_idx, 6)
-
-    rsvd, hdr_idx = bin2int(binStr, hdr_idx, 6)
-
-    d, hdr_idx = bin2int(binStr, hdr_idx, 1)
-
-    q, hdr_idx = bin2int(binStr, hdr_idx, 1)
-
-    f, hdr_idx = bin2int(binStr, hdr_idx, 1)
-
-    hw_id, hdr_idx = bin2int(binStr, hdr_idx, 6)
-
-    sw_id, hdr_idx = bin2int(binStr, hdr_idx, 32)
-
-    seq_no, hdr_idx = bin2int(binStr, hdr_idx, 32)
-    ingress_tstamp, hdr_idx = bin2int(binStr, hdr_idx, 32)
+    ver = word >> 28
+    len = (word >> 24) & 0xF
+    nproto = (word >> 21) & 0x7
+    rep_md_bits = (word >> 15) & 0x3F
+    rsvd = (word >> 9) & 0x3F
+    d = (word >> 8) & 0x1
+    q = (word >> 7) & 0x1
+    f = (word >> 6) & 0x1
+    hw_id = word & 0x3F
 
     if printInfo:
 
@@ -113,21 +383,17 @@ def parse_int_report_hdr(payload : bytes, payload_idx, printInfo=False):
         print(f'ingress_tstamp is {ingress_tstamp}')
     return payload_idx
 
-def parse_ethernet_hdr(payload : bytes, payload_idx, printInfo=False):
+def parse_ethernet_hdr(payload : memoryview, payload_idx, printInfo=False):
     # header ethernet_t 
     # bit<48> dst_addr;
     # bit<48> src_addr;
     # bit<16>   etherType;
 
-    eth_hdr = payload[payload_idx : payload_idx + ETH_SIZE]
+    dst_hi, dst_lo, src_hi, src_lo, etherType = ETH_HDR_STRUCT.unpack_from(payload, payload_idx)
     payload_idx += ETH_SIZE
 
-    hdr_idx = 0
-    binStr = bytes2bin(eth_hdr)
-
-    dst_addr, hdr_idx = bin2int(binStr, hdr_idx, 48)
-    src_addr, hdr_idx = bin2int(binStr, hdr_idx, 48)
-    etherType, hdr_idx = bin2int(binStr, hdr_idx, 16)
+    dst_addr = (dst_hi << 32) | dst_lo
+    src_addr = (src_hi << 32) | src_lo
 
     if printInfo:
         print("ethernet".center(40, "*"))
@@ -137,7 +403,7 @@ def parse_ethernet_hdr(payload : bytes, payload_idx, printInfo=False):
 
     return payload_idx
 
-def parse_ipv4_hdr(payload : bytes, payload_idx, printInfo=False):
+def parse_ipv4_hdr(payload : memoryview, payload_idx, printInfo=False):
     # bit<4>  version;
     # bit<4>  ihl;
     # bit<6>  dscp;
@@ -151,26 +417,17 @@ def parse_ipv4_hdr(payload : bytes, payload_idx, printInfo=False):
     # bit<16> hdr_checksum;
     # bit<32> src_addr;
     # bit<32> dst_addr;
-    
-    ipv4_hdr = payload[payload_idx : payload_idx + IP_SIZE]
+
+    (version_ihl, dscp_ecn, length, identification, flags_frag,
+     ttl, protocol, hdr_checksum, src_addr, dst_addr) = IPV4_HDR_STRUCT.unpack_from(payload, payload_idx)
     payload_idx += IP_SIZE
 
-    hdr_idx = 0
-    binStr : str = bytes2bin(ipv4_hdr)
-
-    version, hdr_idx = bin2int(binStr, hdr_idx, 4)
-    ihl, hdr_idx = bin2int(binStr, hdr_idx, 4)
-    dscp, hdr_idx = bin2int(binStr, hdr_idx, 6)
-    ecn, hdr_idx = bin2int(binStr, hdr_idx, 2)
-    length, hdr_idx = bin2int(binStr, hdr_idx, 16)
-    identification, hdr_idx = bin2int(binStr, hdr_idx, 16)
-    flags, hdr_idx = bin2int(binStr, hdr_idx, 3)
-    frag_offset, hdr_idx = bin2int(binStr, hdr_idx, 13)
-    ttl, hdr_idx = bin2int(binStr, hdr_idx, 8)
-    protocol, hdr_idx = bin2int(binStr, hdr_idx, 8)
-    hdr_checksum, hdr_idx = bin2int(binStr, hdr_idx, 16)
-    src_addr, hdr_idx = bin2int(binStr, hdr_idx, 32)
-    dst_addr, hdr_idx = bin2int(binStr, hdr_idx, 32)
+    version = version_ihl >> 4
+    ihl = version_ihl & 0xF
+    dscp = dscp_ecn >> 2
+    ecn = dscp_ecn & 0x3
+    flags = flags_frag >> 13
+    frag_offset = flags_frag & 0x1FFF
 
     if printInfo:
         print("ipv4".center(40, "*"))
@@ -191,23 +448,15 @@ def parse_ipv4_hdr(payload : bytes, payload_idx, printInfo=False):
     return payload_idx
 
 
-def parse_udp_hdr(payload : bytes, payload_idx, printInfo=False):
+def parse_udp_hdr(payload : memoryview, payload_idx, printInfo=False):
     # bit<16> src_port;
     # bit<16> dst_port;
     # bit<16> length_;
     # bit<16> checksum;
 
-    udp_hdr = payload[payload_idx : payload_idx + UDP_SIZE]
+    src_port, dst_port, length_, checksum = UDP_HDR_STRUCT.unpack_from(payload, payload_idx)
     payload_idx += UDP_SIZE
 
-    hdr_idx = 0
-    binStr : str = bytes2bin(udp_hdr)
-
-    src_port, hdr_idx = bin2int(binStr, hdr_idx, 16)
-    dst_port, hdr_idx = bin2int(binStr, hdr_idx, 16)
-    length_, hdr_idx = bin2int(binStr, hdr_idx, 16)
-    checksum, hdr_idx = bin2int(binStr, hdr_idx, 16)
-
     if printInfo:
         print("udp".center(40, "*"))
         print(f'src_port is {src_port}')
@@ -217,24 +466,58 @@ def parse_udp_hdr(payload : bytes, payload_idx, printInfo=False):
 
     return payload_idx
 
-def parse_int_shim_hdr(payload : bytes, payload_idx, printInfo=False):
+def parse_tcp_hdr(payload : memoryview, payload_idx, printInfo=False):
+    # bit<16> src_port;
+    # bit<16> dst_port;
+    # bit<32> seq_no;
+    # bit<32> ack_no;
+    # bit<4>  data_offset;
+    # bit<3>  res;
+    # bit<3>  ecn;
+    # bit<6>  ctrl;
+    # bit<16> window;
+    # bit<16> checksum;
+    # bit<16> urgent_ptr;
+
+    (src_port, dst_port, seq_no, ack_no, offset_flags,
+     window, checksum, urgent_ptr) = TCP_HDR_STRUCT.unpack_from(payload, payload_idx)
+
+    data_offset = offset_flags >> 12
+    res = (offset_flags >> 9) & 0x7
+    ecn = (offset_flags >> 6) & 0x7
+    ctrl = offset_flags & 0x3F
+
+    # skip tcp options as well
+    payload_idx += data_offset * WORD_SIZE
+
+    if printInfo:
+        print("tcp".center(40, "*"))
+        print(f'src_port is {src_port}')
+        print(f'dst_port is {dst_port}')
+        print(f'seq_no is {seq_no}')
+        print(f'ack_no is {ack_no}')
+        print(f'data_offset is {data_offset}')
+        print(f'res is {res}')
+        print(f'ecn is {ecn}')
+        print(f'ctrl is {ctrl}')
+        print(f'window is {window}')
+        print(f'checksum is {checksum}')
+        print(f'urgent_ptr is {urgent_ptr}')
+
+    return payload_idx
+
+def parse_int_shim_hdr(payload : memoryview, payload_idx, printInfo=False):
     # bit<8> int_type;
     # bit<8> rsvd1;
     # bit<8> len;
     # bit<6> dscp;
     # bit<2> rsvd2;
-    
-    int_shim_hdr = payload[payload_idx : payload_idx + INT_SHIM_SIZE]
-    payload_idx += INT_SHIM_SIZE
 
-    hdr_idx = 0
-    binStr : str = bytes2bin(int_shim_hdr)
+    int_type, rsvd1, length, dscp_rsvd2 = INT_SHIM_HDR_STRUCT.unpack_from(payload, payload_idx)
+    payload_idx += INT_SHIM_SIZE
 
-    int_type, hdr_idx = bin2int(binStr, hdr_idx, 8)
-    rsvd1, hdr_idx = bin2int(binStr, hdr_idx, 8)
-    length, hdr_idx = bin2int(binStr, hdr_idx, 8)
-    dscp, hdr_idx = bin2int(binStr, hdr_idx, 6)
-    rsvd2, hdr_idx = bin2int(binStr, hdr_idx, 2)
+    dscp = dscp_rsvd2 >> 2
+    rsvd2 = dscp_rsvd2 & 0x3
 
     if printInfo:
         print("int_shim".center(40, "*"))
@@ -246,7 +529,7 @@ def parse_int_shim_hdr(payload : bytes, payload_idx, printInfo=False):
 
     return payload_idx
 
-def parse_int_header(payload : bytes, payload_idx, printInfo=False):
+def parse_int_header(payload : memoryview, payload_idx, printInfo=False):
     # bit<4>  ver;
     # bit<2>  rep;
     # bit<1>  c;
@@ -261,28 +544,22 @@ def parse_int_header(payload : bytes, payload_idx, printInfo=False):
     # bit<4>  instruction_mask_0811;
     # bit<4>  instruction_mask_1215;
     # bit<16> rsvd3;
-    
-    int_hdr = payload[payload_idx : payload_idx + INT_HEADER]
-    payload_idx += INT_HEADER
 
-    hdr_idx = 0
-    binStr : str = bytes2bin(int_hdr)
-
-    ver, hdr_idx = bin2int(binStr, hdr_idx, 4)
-    rep, hdr_idx = bin2int(binStr, hdr_idx, 2)
-    c, hdr_idx = bin2int(binStr, hdr_idx, 1)
-    e, hdr_idx = bin2int(binStr, hdr_idx, 1)
-    m, hdr_idx = bin2int(binStr, hdr_idx, 1)
-    rsvd1, hdr_idx = bin2int(binStr, hdr_idx, 7)
-    rsvd2, hdr_idx = bin2int(binStr, hdr_idx, 3)
-    hop_metadata_len, hdr_idx = bin2int(binStr, hdr_idx, 5)
-    remaining_hop_cnt, hdr_idx = bin2int(binStr, hdr_idx, 8)
-    instruction_mask_0003, hdr_idx = bin2int(binStr, hdr_idx, 4)
-    instruction_mask_0407, hdr_idx = bin2int(binStr, hdr_idx, 4)
-    instruction_mask_0811, hdr_idx = bin2int(binStr, hdr_idx, 4)
-    instruction_mask_1215, hdr_idx = bin2int(binStr, hdr_idx, 4)
-    rsvd3, hdr_idx = bin2int(binStr, hdr_idx, 16)
+    flags, rsvd2_len, remaining_hop_cnt, instruction_mask, rsvd3 = INT_HEADER_STRUCT.unpack_from(payload, payload_idx)
+    payload_idx += INT_HEADER
 
+    ver = flags >> 12
+    rep = (flags >> 10) & 0x3
+    c = (flags >> 9) & 0x1
+    e = (flags >> 8) & 0x1
+    m = (flags >> 7) & 0x1
+    rsvd1 = flags & 0x7F
+    rsvd2 = rsvd2_len >> 5
+    hop_metadata_len = rsvd2_len & 0x1F
+    instruction_mask_0003 = instruction_mask >> 12
+    instruction_mask_0407 = (instruction_mask >> 8) & 0xF
+    instruction_mask_0811 = (instruction_mask >> 4) & 0xF
+    instruction_mask_1215 = instruction_mask & 0xF
 
     if printInfo:
         print("int_header".center(40, "*"))
@@ -302,122 +579,2436 @@ def parse_int_header(payload : bytes, payload_idx, printInfo=False):
         print(f'rsvd3 is {rsvd3}')
 
     return payload_idx
- 
-# currently does not support multiple transits with different modes (different num_fileds) 
-# num_fields is the number of fields that are set valid during int transit
-# num_transits is the number of 
-def parse_int_data(num_fields, num_transits, payload, payload_idx, dataToRecord, s1, s2, s3, s4, tic, printInfo=False) :
-    #  each field is 32 bits, which is 4 bytes
-    int_data = payload[payload_idx : payload_idx + (4 * num_fields * num_transits)]
-    payload_idx += 4 * num_fields * num_transits
-
-    hdr_idx = 0
-    binStr : str = bytes2bin(int_data)
+
+# decodes num_transits hops of the INT metadata stack laid out by plan
+# returns the decoded hops, each hop is a tuple indexed by the *_DATA constants
+# with None for the fields the instruction mask did not request
+def parse_int_data(plan : IntDecodePlan, num_transits, payload : memoryview, payload_idx, printInfo=False):
+    data_size = plan.hop_size * num_transits
+    int_data = payload[payload_idx : payload_idx + data_size]
+    payload_idx += data_size
 
     if printInfo:
         print("int_data".center(40, "*"), "\n")
 
-    for i in range(num_transits):
+    getter = plan.getter
+    pad = plan.pad
+    q_idx = plan.q_idx
 
-        int_switch_id, hdr_idx = bin2int(binStr, hdr_idx, 32)
-        ingress_port_id, hdr_idx = bin2int(binStr, hdr_idx, 16)
-        egress_port_id, hdr_idx = bin2int(binStr, hdr_idx, 16)
-        int_hop_latency, hdr_idx = bin2int(binStr, hdr_idx, 32)
-        q_id, hdr_idx = bin2int(binStr, hdr_idx, 8)
-        q_occupancy, hdr_idx = bin2int(binStr, hdr_idx, 24)
-        int_ingress_tstamp, hdr_idx = bin2int(binStr, hdr_idx, 32)
-        int_egress_tstamp, hdr_idx = bin2int(binStr, hdr_idx, 32)
-        ingress_port_id, hdr_idx = bin2int(binStr, hdr_idx, 16)
-        egress_port_id, hdr_idx = bin2int(binStr, hdr_idx, 16)
-        int_egress_port_tx_util, hdr_idx = bin2int(binStr, hdr_idx, 32)
+    hops = []
+    for values in plan.hop_struct.iter_unpack(int_data):
+        hop = getter(values + pad)
+        if q_idx is not None:
+            q_word = values[q_idx]
+            hop = hop[:Q_ID_DATA] + (q_word >> 24, q_word & 0xFFFFFF) + hop[Q_OCCUPANCY_DATA + 1:]
 
         if printInfo:
-            print(f"switch {int_switch_id}".center(40, "*"))
-            print(f'ingress_port_id is {ingress_port_id}')
-            print(f'egress_port_id is {egress_port_id}')
-            print(f'int_hop_latency is {int_hop_latency}')
-            print(f'q_id is {q_id}')     
-            print(f'q_occupancy is {q_occupancy}')
-            print(f'int_ingress_tstamp is {int_ingress_tstamp}')
-            print(f'int_egress_tstamp is {int_egress_tstamp}')
-            print(f'int_egress_port_tx_util is {int_egress_port_tx_util}')
-
-        toc = time.perf_counter()
-
-        fileToWrite = None
-
-        if int_switch_id == 1:
-            fileToWrite = s1
-        elif int_switch_id == 2:
-            fileToWrite = s2
-        elif int_switch_id == 3:
-            fileToWrite = s3
-        elif int_switch_id == 4:
-            fileToWrite = s4
-        
-        if dataToRecord == HOP_LATENCY_DATA:
-            fileToWrite.write(f"{toc - tic:0.4f}, {int_hop_latency}\n")
-        elif dataToRecord == Q_OCCUPANCY_DATA:
-            fileToWrite.write(f"{toc - tic:0.4f}, {q_occupancy}\n")
+            print(f"switch {hop[SWITCH_ID_DATA]}".center(40, "*"))
+            print(f'ingress_port_id is {hop[INGRESS_PORT_ID_DATA]}')
+            print(f'egress_port_id is {hop[EGRESS_PORT_ID_DATA]}')
+            print(f'int_hop_latency is {hop[HOP_LATENCY_DATA]}')
+            print(f'q_id is {hop[Q_ID_DATA]}')
+            print(f'q_occupancy is {hop[Q_OCCUPANCY_DATA]}')
+            print(f'int_ingress_tstamp is {hop[INGRESS_TSTAMP_DATA]}')
+            print(f'int_egress_tstamp is {hop[EGRESS_TSTAMP_DATA]}')
+            print(f'level2_ingress_port_id is {hop[LEVEL2_INGRESS_PORT_ID_DATA]}')
+            print(f'level2_egress_port_id is {hop[LEVEL2_EGRESS_PORT_ID_DATA]}')
+            print(f'int_egress_port_tx_util is {hop[EGRESS_PORT_TX_UTIL_DATA]}')
+
+        hops.append(hop)
+
+    return hops, payload_idx
+
+# decodes the headers of an INT report up to its metadata stack. returns the
+# report without hops, the decode plan and hop count of the stack and the
+# offset the stack starts at. the hop count and per-hop layout come from
+# int_shim.len, hop_metadata_len and the instruction masks
+def decode_int_headers(payload : memoryview, printInfo=False):
+
+    (sw_id, seq_no, ingress_tstamp, protocol, src_addr, dst_addr,
+     src_port, dst_port) = INT_REPORT_PREFIX_STRUCT.unpack_from(payload, 0)
+
+    if printInfo:
+        payload_idx = 0
+        payload_idx = parse_int_report_hdr(payload, payload_idx, printInfo=printInfo)
+        payload_idx = parse_ethernet_hdr(payload, payload_idx, printInfo=printInfo)
+        payload_idx = parse_ipv4_hdr(payload, payload_idx, printInfo=printInfo)
+        if protocol == IP_PROTO_TCP:
+            payload_idx = parse_tcp_hdr(payload, payload_idx, printInfo=printInfo)
+        else:
+            payload_idx = parse_udp_hdr(payload, payload_idx, printInfo=printInfo)
+        payload_idx = parse_int_shim_hdr(payload, payload_idx, printInfo=printInfo)
+        payload_idx = parse_int_header(payload, payload_idx, printInfo=printInfo)
+
+    if protocol == IP_PROTO_TCP:
+        data_offset = TCP_DATA_OFFSET_STRUCT.unpack_from(payload, TCP_DATA_OFFSET_IDX)[0] >> 4
+        payload_idx = INNER_L4_OFFSET + data_offset * WORD_SIZE
+    else:
+        payload_idx = INNER_L4_OFFSET + UDP_SIZE
+
+    (int_shim_len, rsvd2_len, remaining_hop_cnt,
+     instruction_mask) = INT_HEADERS_STRUCT.unpack_from(payload, payload_idx)
+    payload_idx += INT_HEADERS_SIZE
+
+    hop_metadata_len = rsvd2_len & 0x1F
+    if hop_metadata_len == 0:
+        raise ValueError("INT header has a zero hop_metadata_len")
+    plan = get_decode_plan(instruction_mask, hop_metadata_len)
+
+    # the stack length comes from the shim, bounded by what was actually captured
+    stack_size = min((int_shim_len - INT_HEADER_LEN_WORD) * WORD_SIZE, len(payload) - payload_idx)
+    num_transits = max(stack_size, 0) // plan.hop_size
+
+    report = IntReport(sw_id, seq_no, ingress_tstamp, protocol, src_addr, dst_addr, src_port, dst_port,
+                       int_shim_len, hop_metadata_len, remaining_hop_cnt, instruction_mask, None)
+    return report, plan, num_transits, payload_idx
+
+
+# decodes a whole INT report straight from the memoryview of the UDP payload,
+# through the cached decode plan of its stack
+def decode_int_report(payload : memoryview, printInfo=False):
+    report, plan, num_transits, payload_idx = decode_int_headers(payload, printInfo=printInfo)
+    report.hops, _ = parse_int_data(plan, num_transits, payload, payload_idx, printInfo=printInfo)
+    return report
+
+class SwitchOutputs:
+    # registry of the per switch outputs keyed by switch id. an output is
+    # opened the first time its switch shows up in a report, and at most
+    # max_open outputs stay open, closing the least recently used one.
+    # open_output(path, mode) creates the file-like outputs, plain open by default
+    # and field is the *_DATA index of the hop field written to them
+    def __init__(self, path_format=OUTPUT_PATH_FORMAT, max_open=MAX_OPEN_OUTPUTS, open_output=open,
+                 field=HOP_LATENCY_DATA):
+        self.path_format = path_format
+        self.field = field
+        self.max_open = max_open
+        self.open_output = open_output
+        self.files = collections.OrderedDict()
+        # path of every switch seen so far, including the closed ones
+        self.paths = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, sw_id):
+        f = self.files.get(sw_id)
+        if f is None:
+            return self.open(sw_id)
+        self.files.move_to_end(sw_id)
+        return f
+
+    def open(self, sw_id):
+        path = self.paths.get(sw_id)
+        if path is None:
+            path = self.path_format.format(sw_id)
+            self.paths[sw_id] = path
+            mode = "w"
+        else:
+            mode = "a"
+        if self.max_open is not None and len(self.files) >= self.max_open:
+            _, lru = self.files.popitem(last=False)
+            lru.close()
+        f = self.open_output(path, mode)
+        self.files[sw_id] = f
+        return f
+
+    # writes the recorded field of a hop to the output of its switch
+    def write_hop(self, timestamp, hop, plan=None):
+        int_switch_id = hop[SWITCH_ID_DATA]
+        value = hop[self.field]
+        # hops pushed without the switch id instruction cannot be attributed
+        # and hops without the recorded field have nothing to write
+        if int_switch_id is None or value is None:
+            return
+        line = f"{timestamp:0.4f}, {value}\n"
+        self.get(int_switch_id).write(line)
+        if metrics is not None:
+            metrics.counters().bytes_written += len(line)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+
+
+class TimeSeriesOutputs:
+    # appends the recorded fields of every hop to the series of its switch in
+    # an int_tsdb store. the series of a switch are looked up once, after that
+    # a hop is one buffered append per field and a chunk is compressed every
+    # int_tsdb.CHUNK_POINTS hops of a switch
+    def __init__(self, path=TSDB_PATH, fields=(HOP_LATENCY_DATA,)):
+        self.store = int_tsdb.TimeSeriesStore(path)
+        self.fields = fields
+        self.series = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self, sw_id):
+        series = self.series[sw_id] = [(field, self.store.series(sw_id, HOP_FIELD_NAMES[field]))
+                                       for field in self.fields]
+        return series
+
+    def write_hop(self, timestamp, hop, plan=None):
+        int_switch_id = hop[SWITCH_ID_DATA]
+        if int_switch_id is None:
+            return
+        series = self.series.get(int_switch_id)
+        if series is None:
+            series = self.open(int_switch_id)
+        for field, s in series:
+            value = hop[field]
+            # fields missing from the instruction mask are not recorded
+            if value is not None:
+                s.append(timestamp, value)
+
+    def close(self):
+        self.store.close()
+        self.series.clear()
+
+
+# numpy dtype description of HOP_RECORD_STRUCT. fields the instruction mask
+# did not request are stored as 0 with their bit in valid clear, bit n for
+# HOP_FIELD_NAMES[n]
+HOP_RECORD_DESCR = [("timestamp", "<f8")] + [
+    (name, fmt) for name, fmt in zip(HOP_FIELD_NAMES, ("<u2", "<u2", "<u4", "<u1", "<u4", "<u4", "<u4",
+                                                        "<u4", "<u4", "<u2", "<u2"))] + [("valid", "<u2")]
+HOP_FIELDS_VALID = (1 << len(HOP_FIELD_NAMES)) - 1
+
+
+# (timestamp, hop) of a hop record, the fields it does not have are None
+def record_hop(record):
+    timestamp, *hop, valid = record
+    if valid != HOP_FIELDS_VALID:
+        hop = [v if valid >> i & 1 else None for i, v in enumerate(hop)]
+    return timestamp, hop
+
+
+# .npy version 1.0 header for count hop records. the shape is padded to a
+# fixed width so the header can be rewritten in place as the file grows
+def npy_header(count):
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%20d,), }" % (HOP_RECORD_DESCR, count)
+    # magic, version and the header length take 10 bytes, the data starts 64 byte aligned
+    header += " " * (-(len(NPY_MAGIC) + 2 + len(header) + 1) % 64) + "\n"
+    return NPY_MAGIC + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+class BinaryHopWriter:
+    # binary output with every field of every hop. records are packed into a
+    # preallocated chunk and each full chunk is written with one call, after
+    # which the record count in the .npy header is brought up to date
+    def __init__(self, path=BINARY_OUTPUT_PATH, chunk=HOP_RECORD_CHUNK):
+        self.file = open(path, "wb")
+        self.buf = bytearray(chunk * HOP_RECORD_STRUCT.size)
+        self.chunk = chunk
+        self.pending = 0
+        self.count = 0
+        self.file.write(npy_header(0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # plan is the IntDecodePlan the hop was decoded with, which knows the
+    # fields the hop does not have. without one they are found by packing
+    def write_hop(self, timestamp, hop, plan=None):
+        offset = self.pending * HOP_RECORD_STRUCT.size
+        if plan is not None and plan.record_getter is not None:
+            plan.record_struct.pack_into(self.buf, offset, timestamp, *plan.record_getter(hop), plan.record_valid)
+        else:
+            try:
+                HOP_RECORD_STRUCT.pack_into(self.buf, offset, timestamp, *hop, HOP_FIELDS_VALID)
+            except struct.error:
+                self.pack_partial(offset, timestamp, hop)
+        self.pending += 1
+        if self.pending == self.chunk:
+            self.flush()
+
+    # packs a hop with missing fields as 0 with their valid bit clear
+    def pack_partial(self, offset, timestamp, hop):
+        valid = 0
+        for i, v in enumerate(hop):
+            if v is not None:
+                valid |= 1 << i
+        HOP_RECORD_STRUCT.pack_into(self.buf, offset, timestamp, *[0 if v is None else v for v in hop], valid)
+
+    def flush(self):
+        if not self.pending:
+            return
+        start = time.perf_counter()
+        size = self.pending * HOP_RECORD_STRUCT.size
+        self.file.write(memoryview(self.buf)[:size])
+        self.count += self.pending
+        self.pending = 0
+        self.file.seek(0)
+        self.file.write(npy_header(self.count))
+        self.file.seek(0, os.SEEK_END)
+        self.file.flush()
+        if metrics is not None:
+            counters = metrics.counters()
+            counters.bytes_written += size
+            counters.writes += 1
+            counters.write_seconds += time.perf_counter() - start
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+
+
+class HopRecordStore:
+    # read side of a BinaryHopWriter file, every field of every hop captured in
+    # one run. the records stay in the mapped file and any hop field can be
+    # projected out of them afterwards, so the capture does not have to pick one
+    def __init__(self, path=BINARY_OUTPUT_PATH):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header_len = struct.unpack_from("<H", self.map, len(NPY_MAGIC))[0]
+        offset = len(NPY_MAGIC) + 2 + header_len
+        # a writer that did not get to close leaves records the header does not count yet
+        end = offset + (len(self.map) - offset) // HOP_RECORD_STRUCT.size * HOP_RECORD_STRUCT.size
+        self.data = memoryview(self.map)[offset:end]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.data) // HOP_RECORD_STRUCT.size
+
+    # (timestamp, *hop, valid) tuples in the order they were captured
+    def records(self):
+        return HOP_RECORD_STRUCT.iter_unpack(self.data)
+
+    # (timestamp, hop) pairs in the order they were captured, None for the
+    # fields a hop does not have
+    def hops(self):
+        return map(record_hop, self.records())
+
+    # all values of one column, a zero copy numpy view when numpy is
+    # available. the fields a hop does not have read as 0, see the valid column
+    def column(self, name):
+        if np is not None:
+            return np.frombuffer(self.data, dtype=np.dtype(HOP_RECORD_DESCR))[name]
+        idx = [descr[0] for descr in HOP_RECORD_DESCR].index(name)
+        return [record[idx] for record in self.records()]
+
+    # writes the text output of every field in fields, field names from
+    # HOP_FIELD_NAMES, with one path_format per field, in a single pass.
+    # hops without a field are left out of its output
+    def export_text(self, fields, path_formats, max_open=MAX_OPEN_OUTPUTS):
+        with contextlib.ExitStack() as stack:
+            outputs = [stack.enter_context(SwitchOutputs(path_format, max_open=max_open,
+                                                         field=HOP_FIELD_NAMES.index(field)))
+                       for field, path_format in zip(fields, path_formats)]
+            for timestamp, hop in self.hops():
+                for out in outputs:
+                    out.write_hop(timestamp, hop)
+
+    def close(self):
+        self.data.release()
+        self.map.close()
+
+
+# path format of the text output of field. a single projection keeps the usual
+# s<id>_data.txt names, several get one directory per field
+def projection_path_format(field, fields):
+    if len(fields) == 1:
+        return OUTPUT_PATH_FORMAT
+    os.makedirs(field, exist_ok=True)
+    return os.path.join(field, OUTPUT_PATH_FORMAT)
+
+
+# projects the fields of a recorded capture to per switch text files
+def export_projections(path, fields, max_open=MAX_OPEN_OUTPUTS):
+    with HopRecordStore(path) as store:
+        store.export_text(fields, [projection_path_format(f, fields) for f in fields], max_open=max_open)
+        log.info("exported %s of %d hops from %s", ", ".join(fields), len(store), path)
+
+
+class Timeline:
+    # one 32 bit switch timestamp counter unwrapped into a 64 bit count. a raw
+    # value less than half the counter range ahead of the newest one moves the
+    # timeline forward, any other is a late one from before the newest and
+    # does not move it. the first value maps to origin seconds.
+    # with collector arrival times, a timeline not seen for longer than half
+    # the counter range is moved by the arrival time elapsed since instead,
+    # rounded to the nearest raw value
+    __slots__ = ("raw", "value", "first", "unit", "origin", "arrival", "gap")
+
+    def __init__(self, raw, unit, origin=0.0):
+        self.raw = raw
+        self.value = raw
+        self.first = raw
+        self.unit = unit
+        self.origin = origin
+        self.arrival = origin
+        # seconds the counter takes to cover half its range
+        self.gap = TSTAMP_HALF * unit
+
+    def unwrap(self, raw, arrival=None):
+        if arrival is not None:
+            elapsed = arrival - self.arrival
+            self.arrival = arrival
+            if elapsed > self.gap:
+                expected = self.value + elapsed / self.unit
+                self.raw = raw
+                self.value = raw + round((expected - raw) / TSTAMP_MODULO) * TSTAMP_MODULO
+                return self.value
+        delta = (raw - self.raw) & TSTAMP_MASK
+        if delta < TSTAMP_HALF:
+            self.raw = raw
+            self.value += delta
+            return self.value
+        return self.value + delta - TSTAMP_MODULO
+
+    def seconds(self, raw, arrival=None):
+        return self.origin + (self.unwrap(raw, arrival) - self.first) * self.unit
+
+
+class SwitchClocks:
+    # timestamp engine. unwraps the report header tstamps of every sink switch
+    # and the hop tstamps of every switch on its own Timeline and times each
+    # hop by the egress tstamp of its switch, the ingress tstamp without one,
+    # or the report header tstamp of the sink without either. the clock is
+    # never read, anchored mode takes the report arrival int_parser passes
+    def __init__(self, mode="anchored"):
+        self.mode = mode
+        self.reports = {}
+        self.hops = {}
+
+    # the time of every hop of report, arrival is when it reached the
+    # collector in seconds since tic, None in switch mode
+    def hop_times(self, report, arrival=None):
+        if report.instruction_mask & EGRESS_TSTAMP_BIT:
+            idx = EGRESS_TSTAMP_DATA
+        elif report.instruction_mask & INGRESS_TSTAMP_BIT:
+            idx = INGRESS_TSTAMP_DATA
+        else:
+            return [self.report_time(report, arrival)] * len(report.hops)
+
+        timelines = self.hops
+        times = []
+        for hop in report.hops:
+            timeline = timelines.get(hop[SWITCH_ID_DATA])
+            if timeline is None:
+                timeline = timelines[hop[SWITCH_ID_DATA]] = Timeline(hop[idx], HOP_TSTAMP_UNIT, arrival or 0.0)
+            times.append(timeline.seconds(hop[idx], arrival))
+        return times
+
+    # the report header tstamp of report on the Timeline of its sink switch
+    def report_time(self, report, arrival=None):
+        timeline = self.reports.get(report.sw_id)
+        if timeline is None:
+            timeline = self.reports[report.sw_id] = Timeline(report.ingress_tstamp, REPORT_TSTAMP_UNIT,
+                                                             arrival or 0.0)
+        return timeline.seconds(report.ingress_tstamp, arrival)
+
+
+# SwitchClocks of --timestamps, None records the collector arrival
+clocks = None
+
+
+# event time of a report in seconds the report observers time it by, the
+# unwrapped report tstamp of its sink switch in switch mode, else its arrival
+# at the collector in seconds since tic
+def report_time(report, arrival):
+    if clocks is not None and clocks.mode == "switch":
+        return clocks.report_time(report)
+    return arrival
+
+
+# records the hops of a decoded report with their timestamps in seconds,
+# plan is the IntDecodePlan they were decoded with
+def write_hops(report, outputs, tic, now=None, plan=None):
+    if clocks is not None and clocks.mode == "switch":
+        times = clocks.hop_times(report)
+    else:
+        arrival = (time.perf_counter() if now is None else now) - tic
+        if clocks is None:
+            for hop in report.hops:
+                outputs.write_hop(arrival, hop, plan)
+            return
+        times = clocks.hop_times(report, arrival)
+    for timestamp, hop in zip(times, report.hops):
+        outputs.write_hop(timestamp, hop, plan)
 
-    return payload_idx
 
 # printInfo sets either to print the packet headers and int data
-def int_parser(payload : bytes, s1, s2, s3, s4, tic, printInfo=False) :
+# now is the arrival time of the report when it is not being received live,
+# e.g. the capture timestamp of a pcap record
+# outputs is a SwitchOutputs for text output or a BinaryHopWriter
+def int_parser(payload : bytes, outputs, tic, printInfo=False, now=None) :
 
-    dataToRecord = HOP_LATENCY_DATA
     #  INT report strucure
     # [Eth][IP][UDP][INT RAPORT HDR][ETH][IP][UDP/TCP][INT SHIM][INT HEADER][INT DATA]
     # payload : [INT RAPORT HDR]      [ETH]                  [IP]             
     #           16 bytes : 0-15       14 bytes : 16-29      20 bytes : 30-49
     #           [UDP/TCP]             [INT SHIM]             [INT HEADER]              [INT DATA]
     #           8 bytes : 50->57      4 bytes : 58->61       8 bytes : 62-69
+
+    # the headers are decoded in place, slicing a memoryview does not copy
+    payload = memoryview(payload)
+    report, plan, num_transits, payload_idx = decode_int_headers(payload, printInfo=printInfo)
+    report.hops, _ = parse_int_data(plan, num_transits, payload, payload_idx, printInfo=printInfo)
+
+    write_hops(report, outputs, tic, now, plan)
+
+    return report
     
-    # start parsing from index = payload_idx
-    payload_idx = 0
-    payload_idx = parse_int_report_hdr(payload, payload_idx, printInfo=printInfo)
-    payload_idx = parse_ethernet_hdr(payload, payload_idx, printInfo=printInfo)
-    payload_idx = parse_ipv4_hdr(payload, payload_idx, printInfo=printInfo)
-    payload_idx = parse_udp_hdr(payload, payload_idx, printInfo=printInfo)
-    payload_idx = parse_int_shim_hdr(payload, payload_idx, printInfo=printInfo)
-    payload_idx = parse_int_header(payload, payload_idx, printInfo=printInfo)
-    payload_idx = parse_int_data(8, 3, payload, payload_idx, dataToRecord, s1, s2, s3, s4, tic, printInfo=printInfo)
-    
+# big-endian numpy layout of the fixed headers of a report with an inner UDP
+# header, field for field the same bytes INT_REPORT_PREFIX_STRUCT and
+# INT_HEADERS_STRUCT read
+INT_REPORT_BATCH_FIELDS = [
+    ("report_word", ">u4"), ("sw_id", ">u4"), ("seq_no", ">u4"), ("report_ingress_tstamp", ">u4"),
+    ("ethernet", "V14"),
+    ("version_ihl", "u1"), ("dscp_ecn", "u1"), ("ip_len", ">u2"), ("identification", ">u2"),
+    ("flags_frag", ">u2"), ("ttl", "u1"), ("protocol", "u1"), ("hdr_checksum", ">u2"),
+    ("src_addr", ">u4"), ("dst_addr", ">u4"),
+    ("src_port", ">u2"), ("dst_port", ">u2"), ("udp_len", ">u2"), ("udp_checksum", ">u2"),
+    ("int_type", "u1"), ("shim_rsvd1", "u1"), ("int_shim_len", "u1"), ("shim_dscp_rsvd2", "u1"),
+    ("int_flags", ">u2"), ("rsvd2_len", "u1"), ("remaining_hop_cnt", "u1"),
+    ("instruction_mask", ">u2"), ("int_rsvd3", ">u2"),
+]
+
+# report level columns of a decoded batch
+INT_REPORT_BATCH_COLUMNS = ("sw_id", "seq_no", "report_ingress_tstamp", "protocol", "src_addr", "dst_addr",
+                            "src_port", "dst_port", "int_shim_len", "remaining_hop_cnt", "instruction_mask")
+
+
+# numpy structured dtype of one report whose metadata stack is laid out by plan
+def int_report_batch_dtype(plan : IntDecodePlan, num_transits):
+    hop_fields = []
+    hop_size = 0
+    for bit, (field_fmt, data_idx) in enumerate(INT_INSTRUCTIONS):
+        if not plan.instruction_mask & (0x8000 >> bit):
+            continue
+        if data_idx == (Q_ID_DATA,):
+            hop_fields.append(("q_word", ">u4"))
+        elif field_fmt == "I":
+            hop_fields.append((HOP_FIELD_NAMES[data_idx[0]], ">u4"))
+        elif field_fmt == "HH":
+            hop_fields += [(HOP_FIELD_NAMES[idx], ">u2") for idx in data_idx]
+        else:
+            hop_fields.append((f"reserved_{bit}", "V4"))
+        hop_size += WORD_SIZE
+    if plan.hop_size > hop_size:
+        hop_fields.append(("pad", f"V{plan.hop_size - hop_size}"))
+
+    return np.dtype(INT_REPORT_BATCH_FIELDS + [("hops", np.dtype(hop_fields), (num_transits,))])
+
+
+class IntReportBatch:
+    # result of decode_int_reports_batch. columns maps the report level
+    # columns to arrays of shape (n,) and every hop field the instruction mask
+    # requested to arrays of shape (n, num_transits), index holds the position
+    # of each row in the input. reports with a different layout are decoded by
+    # the scalar path into fallback as (position, IntReport), malformed ones are
+    # only counted in errors
+    __slots__ = ("columns", "index", "fallback", "errors")
+
+    def __init__(self, columns, index, fallback, errors):
+        self.columns = columns
+        self.index = index
+        self.fallback = fallback
+        self.errors = errors
+
+
+# reads the layout of a report, returns (plan, num_transits, report size)
+# for reports the batch decoder can handle or None
+def batch_layout(payload):
+    payload = memoryview(payload)
+    try:
+        protocol = INT_REPORT_PREFIX_STRUCT.unpack_from(payload, 0)[3]
+        if protocol == IP_PROTO_TCP:
+            return None
+        int_shim_len, rsvd2_len, _, instruction_mask = INT_HEADERS_STRUCT.unpack_from(payload, INNER_L4_OFFSET + UDP_SIZE)
+        plan = get_decode_plan(instruction_mask, rsvd2_len & 0x1F)
+    except (struct.error, ValueError, ZeroDivisionError):
+        return None
+    stack_size = (int_shim_len - INT_HEADER_LEN_WORD) * WORD_SIZE
+    if stack_size < 0 or stack_size % plan.hop_size:
+        return None
+    return plan, stack_size // plan.hop_size, INNER_L4_OFFSET + UDP_SIZE + INT_HEADERS_SIZE + stack_size
+
+
+# splits a contiguous buffer of reports by the ip total length of every report
+def split_reports(buf : memoryview):
+    payloads = []
+    idx = 0
+    while idx < len(buf):
+        try:
+            size = INT_REPORT_SIZE + ETH_SIZE + REPORT_IP_LEN_STRUCT.unpack_from(buf, idx + REPORT_IP_LEN_IDX)[0]
+        except struct.error:
+            size = 0
+        if size < INNER_L4_OFFSET or idx + size > len(buf):
+            raise ValueError(f"report at offset {idx} of a {len(buf)} byte buffer is truncated or malformed")
+        payloads.append(buf[idx : idx + size])
+        idx += size
+    return payloads
+
+
+# decodes n INT reports at once with a numpy structured dtype. payloads is
+# either a list of report payloads or one contiguous buffer of reports. the
+# layout of the first decodable report is used for the whole batch, reports
+# that do not share it go through decode_int_report. a buffer of equally
+# sized reports of that layout is read in place, any other buffer is split
+# into reports by split_reports first
+def decode_int_reports_batch(payloads):
+    if np is None:
+        raise RuntimeError("decode_int_reports_batch needs numpy")
+
+    contiguous = not isinstance(payloads, (list, tuple))
+    if contiguous:
+        buf = memoryview(payloads)
+        layout = batch_layout(buf) if len(buf) else None
+        if layout is None or len(buf) % layout[2]:
+            payloads = split_reports(buf)
+            contiguous = False
+        else:
+            size = layout[2]
+            payloads = [buf[i : i + size] for i in range(0, len(buf), size)]
+    if not contiguous:
+        layout = None
+        for payload in payloads:
+            layout = batch_layout(payload)
+            if layout is not None:
+                break
+
+    fallback = []
+    errors = 0
+    if layout is None:
+        index = np.zeros(0, dtype=np.int64)
+        rows = None
+    else:
+        plan, num_transits, size = layout
+        dtype = int_report_batch_dtype(plan, num_transits)
+        if contiguous:
+            index = np.arange(len(payloads))
+            rows = np.frombuffer(buf, dtype=dtype)
+        else:
+            index = np.array([i for i, payload in enumerate(payloads) if len(payload) == size], dtype=np.int64)
+            rows = np.frombuffer(b"".join(payloads[i] for i in index), dtype=dtype)
+
+        # vectorized check that every row really has the layout of the batch
+        same = ((rows["protocol"] != IP_PROTO_TCP)
+                & (rows["int_shim_len"] == INT_HEADER_LEN_WORD + num_transits * plan.hop_metadata_len)
+                & ((rows["rsvd2_len"] & 0x1F) == plan.hop_metadata_len)
+                & (rows["instruction_mask"] == plan.instruction_mask))
+        if not same.all():
+            if contiguous:
+                # the reports are not all of the size of the first one
+                return decode_int_reports_batch(split_reports(buf))
+            rows = rows[same]
+            index = index[same]
+
+    in_batch = np.zeros(len(payloads), dtype=bool)
+    in_batch[index] = True
+    for i in np.flatnonzero(~in_batch):
+        try:
+            fallback.append((int(i), decode_int_report(memoryview(payloads[i]))))
+        except (struct.error, ValueError):
+            errors += 1
+
+    columns = {}
+    if rows is not None:
+        for name in INT_REPORT_BATCH_COLUMNS:
+            columns[name] = rows[name].astype(rows.dtype[name].newbyteorder("="))
+        columns["hop_metadata_len"] = rows["rsvd2_len"] & 0x1F
+
+        hops = rows["hops"]
+        for name in hops.dtype.names:
+            if name == "q_word":
+                q_word = hops["q_word"].astype(np.uint32)
+                columns["q_id"] = q_word >> 24
+                columns["q_occupancy"] = q_word & 0xFFFFFF
+            elif not name.startswith(("reserved_", "pad")):
+                columns[name] = hops[name].astype(hops.dtype[name].newbyteorder("="))
+
+    return IntReportBatch(columns, index, fallback, errors)
+
+
 def get_if():
-    ifs = get_if_list()
+    if sniff is not None:
+        if_list = get_if_list()
+    else:
+        if_list = [name for _, name in socket.if_nameindex()]
     iface = None
-    for i in get_if_list():
+    for i in if_list:
         if "eth0" in i:
             iface = i
             break
     if not iface:
-        print("Cannot find eth0 interface")
+        log.error("Cannot find eth0 interface")
         exit(1)
     return iface
 
 
-def handle_pkt(pkt, s1, s2, s3, s4, tic):
-    if UDP in pkt and pkt[UDP].dport == 8002:
-        print("got a packet")
-        # pkt.show2()
-        payload = bytes(pkt[UDP].payload)
-        int_parser(payload, s1, s2, s3, s4, tic)
+class SeqState:
+    # sequence state of one switch: the newest seq_no seen, a bitmap of the
+    # SEQ_WINDOW seq_no values before it that arrived, bit n for newest - n,
+    # the number of window positions accounted since the first or resync seq_no,
+    # the ones below it were never counted lost, and the counters
+    __slots__ = ("newest", "window", "span", "received", "lost", "duplicates", "reordered", "late",
+                 "late_run", "resets")
+
+    def __init__(self, seq_no):
+        self.newest = seq_no
+        self.window = 1
+        self.span = 1
+        self.received = 1
+        self.lost = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.late = 0
+        self.late_run = 0
+        self.resets = 0
+
+    def resync(self, seq_no):
+        self.newest = seq_no
+        self.window = 1
+        self.span = 1
+        self.late_run = 0
+        self.resets += 1
+
+
+class SeqAccounting:
+    # report loss, duplicate and reorder accounting on the report seq_no of
+    # every switch in constant state per switch. a jump of the newest seq_no
+    # counts the numbers it skips as lost, one of them turning up later inside
+    # the window is moved from lost to reordered. reports older than the window,
+    # or than the first report of the switch, cannot be told from duplicates
+    # and were never counted lost, they are counted late, SEQ_WINDOW late
+    # reports in a row are taken as a restarted switch and resync the state
+    def __init__(self):
+        self.switches = {}
+
+    def __call__(self, report, now):
+        self.count(report.sw_id, report.seq_no)
+
+    # accounts a report from its header fields alone, e.g. one that was shed
+    def count(self, sw_id, seq_no):
+        state = self.switches.get(sw_id)
+        if state is None:
+            self.switches[sw_id] = SeqState(seq_no)
+            return
+        state.received += 1
+        # signed distance from the newest seq_no across the 32 bit wrap
+        delta = (seq_no - state.newest) % SEQ_MODULO
+        if delta >= SEQ_MODULO >> 1:
+            delta -= SEQ_MODULO
+
+        if delta > 0:
+            state.lost += delta - 1
+            if delta < SEQ_WINDOW:
+                state.window = ((state.window << delta) | 1) & ((1 << SEQ_WINDOW) - 1)
+            else:
+                state.window = 1
+            state.newest = seq_no
+            state.span = min(state.span + delta, SEQ_WINDOW)
+            state.late_run = 0
+        elif delta > -state.span:
+            bit = 1 << -delta
+            if state.window & bit:
+                state.duplicates += 1
+            else:
+                state.window |= bit
+                state.reordered += 1
+                state.lost -= 1
+        else:
+            state.late += 1
+            state.late_run += 1
+            if state.late_run >= SEQ_WINDOW:
+                state.resync(seq_no)
+
+    def summary(self):
+        lines = []
+        for sw_id in sorted(self.switches):
+            state = self.switches[sw_id]
+            expected = state.received + state.lost
+            loss = 100.0 * state.lost / expected if expected else 0.0
+            line = (f"switch {sw_id} seq: received {state.received}, lost {state.lost} ({loss:0.3f}%), "
+                    f"duplicates {state.duplicates}, reordered {state.reordered}, late {state.late}")
+            if state.resets:
+                line += f", resets {state.resets}"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+class FlowStats:
+    # running statistics of one inner flow. the latency of a report is the sum
+    # of the hop latencies along its path and path is the PathTable id of the
+    # path of the last report
+    __slots__ = ("reports", "latency_sum", "latency_max", "q_occupancy_max", "path", "last_seen")
+
+    def __init__(self):
+        self.reports = 0
+        self.latency_sum = 0
+        self.latency_max = 0
+        self.q_occupancy_max = 0
+        self.path = None
+        self.last_seen = 0.0
+
+
+# (switch id, ingress port, egress port) of every hop of a report in
+# forwarding order, the stack holds the newest hop first. hops without a
+# switch id are left out
+def report_path(report):
+    return tuple((hop[SWITCH_ID_DATA], hop[INGRESS_PORT_ID_DATA], hop[EGRESS_PORT_ID_DATA])
+                 for hop in reversed(report.hops) if hop[SWITCH_ID_DATA] is not None)
+
+
+# switch(ingress>egress) of every hop joined by dashes
+def format_path(path):
+    return "-".join(f"{sw_id}({ingress}>{egress})" for sw_id, ingress, egress in path)
+
+
+class PathTable:
+    # interns report paths into small integer ids, so a flow keeps its path as
+    # one int, and counts the reports taking every path
+    def __init__(self):
+        self.ids = {}
+        self.paths = []
+        self.reports = []
+
+    def __len__(self):
+        return len(self.paths)
+
+    # id of path, counting one more report on it
+    def add(self, path):
+        path_id = self.ids.get(path)
+        if path_id is None:
+            path_id = self.ids[path] = len(self.paths)
+            self.paths.append(path)
+            self.reports.append(0)
+        self.reports[path_id] += 1
+        return path_id
+
+    def format(self, path_id):
+        return "" if path_id is None else format_path(self.paths[path_id])
+
+    def write(self, output_path):
+        with open(output_path, "w") as f:
+            f.write(PATH_OUTPUT_HEADER)
+            for path_id, path in enumerate(self.paths):
+                f.write(f"{path_id}, {self.reports[path_id]}, {format_path(path)}\n")
+
+
+# src_addr, dst_addr, protocol, src_port, dst_port of the inner packet
+def flow_key(report):
+    return (report.src_addr, report.dst_addr, report.protocol, report.src_port, report.dst_port)
+
+
+class FlowTable:
+    # per flow statistics keyed on the inner 5-tuple. the table is kept in
+    # least recently seen order, so both evicting the LRU flow when max_flows
+    # is reached and expiring idle flows only ever look at its front.
+    # a flow whose path id changes gets a line in the path change output
+    def __init__(self, max_flows=FLOW_TABLE_SIZE, idle_timeout=FLOW_IDLE_TIMEOUT,
+                 output_path=FLOW_OUTPUT_PATH, path_output_path=PATH_OUTPUT_PATH,
+                 path_change_output_path=PATH_CHANGE_OUTPUT_PATH):
+        self.max_flows = max_flows
+        self.idle_timeout = idle_timeout
+        self.output_path = output_path
+        self.path_output_path = path_output_path
+        self.flows = collections.OrderedDict()
+        self.paths = PathTable()
+        self.evicted = 0
+        self.expired = 0
+        self.path_changes = 0
+        self.path_change_output = None
+        if path_change_output_path is not None:
+            self.path_change_output = open(path_change_output_path, "w")
+            self.path_change_output.write(PATH_CHANGE_OUTPUT_HEADER)
+
+    def __call__(self, report, now):
+        flows = self.flows
+        key = flow_key(report)
+        flow = flows.get(key)
+        if flow is None:
+            if len(flows) >= self.max_flows:
+                flows.popitem(last=False)
+                self.evicted += 1
+            flow = flows[key] = FlowStats()
+        else:
+            flows.move_to_end(key)
+
+        latency = 0
+        q_occupancy_max = flow.q_occupancy_max
+        for hop in report.hops:
+            if hop[HOP_LATENCY_DATA] is not None:
+                latency += hop[HOP_LATENCY_DATA]
+            if hop[Q_OCCUPANCY_DATA] is not None and hop[Q_OCCUPANCY_DATA] > q_occupancy_max:
+                q_occupancy_max = hop[Q_OCCUPANCY_DATA]
+        path = self.paths.add(report_path(report))
+
+        flow.reports += 1
+        flow.latency_sum += latency
+        if latency > flow.latency_max:
+            flow.latency_max = latency
+        flow.q_occupancy_max = q_occupancy_max
+        if path != flow.path:
+            if flow.path is not None:
+                self.path_change(now, key, flow.path, path)
+            flow.path = path
+        flow.last_seen = now
+
+        self.expire(now)
+
+    # drops the flows idle for longer than idle_timeout
+    def expire(self, now):
+        flows = self.flows
+        deadline = now - self.idle_timeout
+        while flows:
+            flow = next(iter(flows.values()))
+            if flow.last_seen >= deadline:
+                break
+            flows.popitem(last=False)
+            self.expired += 1
+
+    def path_change(self, now, key, old_path, new_path):
+        self.path_changes += 1
+        if self.path_change_output is not None:
+            self.path_change_output.write(f"{now:0.4f}, {format_flow_key(key)}, "
+                                          f"{self.paths.format(old_path)}, {self.paths.format(new_path)}\n")
+
+    def dump(self):
+        if self.path_change_output is not None:
+            self.path_change_output.flush()
+
+    def summary(self):
+        return (f"flows: {len(self.flows)} active, {self.evicted} evicted, "
+                f"{self.expired} expired, {len(self.paths)} paths, {self.path_changes} path changes")
+
+    # writes the statistics of the flows in the table, most active first, and
+    # the reports of every path
+    def close(self):
+        if self.path_change_output is not None:
+            self.path_change_output.close()
+        if self.path_output_path is not None:
+            self.paths.write(self.path_output_path)
+        if self.output_path is None:
+            return
+        flows = sorted(self.flows.items(), key=lambda item: item[1].reports, reverse=True)
+        with open(self.output_path, "w") as f:
+            f.write(FLOW_OUTPUT_HEADER)
+            for key, flow in flows:
+                f.write(format_flow(key, flow.reports, flow.latency_sum, flow.latency_max,
+                                    flow.q_occupancy_max, self.paths.format(flow.path)))
+
+
+def format_flow(key, reports, latency_sum, latency_max, q_occupancy_max, path):
+    src_addr, dst_addr, protocol, src_port, dst_port = key
+    return (f"{socket.inet_ntoa(src_addr.to_bytes(4, 'big'))}, "
+            f"{socket.inet_ntoa(dst_addr.to_bytes(4, 'big'))}, {protocol}, {src_port}, {dst_port}, "
+            f"{reports}, {latency_sum}, {latency_max}, {q_occupancy_max}, {path}\n")
+
+
+# compact src:sport-dst:dport/protocol form of a flow key
+def format_flow_key(key):
+    src_addr, dst_addr, protocol, src_port, dst_port = key
+    return (f"{socket.inet_ntoa(src_addr.to_bytes(4, 'big'))}:{src_port}-"
+            f"{socket.inet_ntoa(dst_addr.to_bytes(4, 'big'))}:{dst_port}/{protocol}")
+
+
+def parse_flow(line):
+    src_addr, dst_addr, protocol, src_port, dst_port, reports, latency_sum, latency_max, \
+        q_occupancy_max, path = line.rstrip("\n").split(", ")
+    key = (int.from_bytes(socket.inet_aton(src_addr), "big"),
+           int.from_bytes(socket.inet_aton(dst_addr), "big"),
+           int(protocol), int(src_port), int(dst_port))
+    return key, int(reports), int(latency_sum), int(latency_max), int(q_occupancy_max), path
+
+
+# merges the flow statistics of the workers into output_path. a flow seen by
+# several workers gets its counts added up and the path of the last file
+def merge_flow_outputs(num_workers, output_path=FLOW_OUTPUT_PATH):
+    worker_paths = [worker_output(output_path, i) for i in range(num_workers)]
+    worker_paths = [p for p in worker_paths if os.path.exists(p)]
+    if not worker_paths:
+        return
+    flows = {}
+    for p in worker_paths:
+        with open(p) as f:
+            for line in f:
+                if line.startswith("#"):
+                    continue
+                key, reports, latency_sum, latency_max, q_occupancy_max, path = parse_flow(line)
+                merged = flows.get(key)
+                if merged is not None:
+                    reports += merged[0]
+                    latency_sum += merged[1]
+                    latency_max = max(latency_max, merged[2])
+                    q_occupancy_max = max(q_occupancy_max, merged[3])
+                flows[key] = (reports, latency_sum, latency_max, q_occupancy_max, path)
+    with open(output_path, "w") as f:
+        f.write(FLOW_OUTPUT_HEADER)
+        for key, flow in sorted(flows.items(), key=lambda item: item[1][0], reverse=True):
+            f.write(format_flow(key, *flow))
+    for p in worker_paths:
+        os.remove(p)
+
+
+# merges the path counts of the workers into output_path, numbering the
+# paths again as every worker has its own ids
+def merge_path_outputs(num_workers, output_path=PATH_OUTPUT_PATH):
+    worker_paths = [worker_output(output_path, i) for i in range(num_workers)]
+    worker_paths = [p for p in worker_paths if os.path.exists(p)]
+    if not worker_paths:
+        return
+    reports = collections.Counter()
+    for p in worker_paths:
+        with open(p) as f:
+            for line in f:
+                if line.startswith("#"):
+                    continue
+                _, n, path = line.rstrip("\n").split(", ", 2)
+                reports[path] += int(n)
+    with open(output_path, "w") as f:
+        f.write(PATH_OUTPUT_HEADER)
+        for path_id, (path, n) in enumerate(reports.most_common()):
+            f.write(f"{path_id}, {n}, {path}\n")
+    for p in worker_paths:
+        os.remove(p)
+
+
+# histogram bucket of value: values below 2 << HISTOGRAM_SUB_BITS have their
+# own bucket, larger ones keep their HISTOGRAM_SUB_BITS + 1 top bits
+def histogram_bucket(value):
+    if value < 2 << HISTOGRAM_SUB_BITS:
+        return value
+    shift = value.bit_length() - HISTOGRAM_SUB_BITS - 1
+    return min((shift << HISTOGRAM_SUB_BITS) + (value >> shift), HISTOGRAM_BUCKETS - 1)
+
+
+# middle of the values falling into bucket
+def histogram_value(bucket):
+    if bucket < 2 << HISTOGRAM_SUB_BITS:
+        return bucket
+    shift = (bucket >> HISTOGRAM_SUB_BITS) - 1
+    low = (bucket - (shift << HISTOGRAM_SUB_BITS)) << shift
+    return low + ((1 << shift) - 1) // 2
+
+
+class LogHistogram:
+    # constant size log-linear histogram, HDR histogram style. two histograms
+    # merge by adding up their buckets, so the histograms of time slots or of
+    # worker processes combine into the same histogram one stream would give
+    __slots__ = ("counts", "count", "max")
+
+    def __init__(self):
+        self.counts = array.array("Q", bytes(8 * HISTOGRAM_BUCKETS))
+        self.count = 0
+        self.max = 0
+
+    def record(self, value):
+        self.record_bucket(histogram_bucket(value), value)
+
+    # record() with the histogram_bucket of value already worked out
+    def record_bucket(self, bucket, value):
+        self.counts[bucket] += 1
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        self.counts = array.array("Q", map(operator.add, self.counts, other.counts))
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def clear(self):
+        self.counts = array.array("Q", bytes(8 * HISTOGRAM_BUCKETS))
+        self.count = 0
+        self.max = 0
+
+    # values of the quantiles qs, ascending, in one pass over the buckets
+    def quantiles(self, qs=QUANTILES):
+        values = []
+        if not self.count:
+            return [0] * len(qs)
+        ranks = [q * self.count for q in qs]
+        seen = 0
+        for bucket, n in enumerate(self.counts):
+            if not n:
+                continue
+            seen += n
+            while len(values) < len(ranks) and seen >= ranks[len(values)]:
+                values.append(min(histogram_value(bucket), self.max))
+            if len(values) == len(ranks):
+                break
+        return values
+
+    # sparse text form, the max followed by bucket:count of the used buckets
+    def to_text(self):
+        return " ".join([str(self.max)] + [f"{b}:{n}" for b, n in enumerate(self.counts) if n])
+
+    @classmethod
+    def from_text(cls, text):
+        histogram = cls()
+        max_value, *buckets = text.split()
+        histogram.max = int(max_value)
+        for item in buckets:
+            b, n = item.split(":")
+            histogram.counts[int(b)] = int(n)
+            histogram.count += int(n)
+        return histogram
+
+
+class WindowedHistogram:
+    # log histogram over the last window seconds as a ring of slot second
+    # histograms. a value is recorded into its slot only, a slot is merged
+    # into retired when the ring comes back to it, so retired and the slots
+    # together hold the whole run
+    __slots__ = ("slots", "slot_ids", "retired")
+
+    def __init__(self, num_slots):
+        self.slots = [LogHistogram() for _ in range(num_slots)]
+        self.slot_ids = [None] * num_slots
+        self.retired = LogHistogram()
+
+    # slot_id is the current time in slots, bucket the histogram_bucket of value
+    def record(self, slot_id, bucket, value):
+        i = slot_id % len(self.slots)
+        slot = self.slots[i]
+        if self.slot_ids[i] != slot_id:
+            if self.slot_ids[i] is not None and slot_id < self.slot_ids[i]:
+                # a late value older than the ring only counts for the whole run
+                slot = self.retired
+            else:
+                if slot.count:
+                    self.retired.merge(slot)
+                    slot.clear()
+                self.slot_ids[i] = slot_id
+        slot.counts[bucket] += 1
+        slot.count += 1
+        if value > slot.max:
+            slot.max = value
+
+    # merges the slots of the window ending at slot_id into histogram
+    def window(self, slot_id, histogram):
+        for hist_id, slot in zip(self.slot_ids, self.slots):
+            if hist_id is not None and slot_id - len(self.slots) < hist_id <= slot_id and slot.count:
+                histogram.merge(slot)
+        return histogram
+
+    # merges the whole run into histogram
+    def total(self, histogram):
+        histogram.merge(self.retired)
+        for slot in self.slots:
+            if slot.count:
+                histogram.merge(slot)
+        return histogram
+
+
+class HopSketches:
+    # windowed hop latency and queue occupancy quantiles of every switch and
+    # of every switch egress port, port None standing for the whole switch.
+    # a hop is recorded once, into the histograms of its egress port, and the
+    # switch wide histograms are merged from the ports when they are written
+    METRICS = ("hop_latency", "q_occupancy")
+
+    def __init__(self, window=QUANTILE_WINDOW, slot=QUANTILE_SLOT, output_path=QUANTILE_OUTPUT_PATH,
+                 sketch_path=SKETCH_OUTPUT_PATH):
+        self.num_slots = max(int(round(window / slot)), 1)
+        self.slot = slot
+        # event time of the newest report, the windows end there
+        self.now = 0.0
+        # sw_id -> port -> [latency WindowedHistogram, q occupancy WindowedHistogram],
+        # port None for hops without the egress port
+        self.sketches = {}
+        self.sketch_path = sketch_path
+        self.output = None
+        if output_path is not None:
+            self.output = open(output_path, "w")
+            self.output.write(QUANTILE_OUTPUT_HEADER)
+
+    def get(self, sw_id, port):
+        ports = self.sketches.get(sw_id)
+        if ports is None:
+            ports = self.sketches[sw_id] = {}
+        sketch = ports[port] = [WindowedHistogram(self.num_slots), WindowedHistogram(self.num_slots)]
+        return sketch
+
+    def __call__(self, report, now):
+        if now > self.now:
+            self.now = now
+        slot_id = int(now / self.slot)
+        sketches = self.sketches
+        for hop in report.hops:
+            sw_id = hop[SWITCH_ID_DATA]
+            if sw_id is None:
+                continue
+            ports = sketches.get(sw_id)
+            sketch = None if ports is None else ports.get(hop[EGRESS_PORT_ID_DATA])
+            if sketch is None:
+                sketch = self.get(sw_id, hop[EGRESS_PORT_ID_DATA])
+            latency = hop[HOP_LATENCY_DATA]
+            if latency is not None:
+                sketch[0].record(slot_id, histogram_bucket(latency), latency)
+            q_occupancy = hop[Q_OCCUPANCY_DATA]
+            if q_occupancy is not None:
+                sketch[1].record(slot_id, histogram_bucket(q_occupancy), q_occupancy)
+
+    # (sw_id, port, metric, histogram) of every switch and egress port, the
+    # switch wide one before the ports of its switch. histogram_of(windowed)
+    # gives the LogHistogram of a WindowedHistogram
+    def histograms(self, histogram_of):
+        for sw_id in sorted(self.sketches):
+            ports = self.sketches[sw_id]
+            port_histograms = {port: [histogram_of(windowed) for windowed in sketch]
+                               for port, sketch in ports.items()}
+            for i, metric in enumerate(self.METRICS):
+                switch_wide = LogHistogram()
+                for histograms in port_histograms.values():
+                    switch_wide.merge(histograms[i])
+                yield sw_id, None, metric, switch_wide
+            for port in sorted(port for port in port_histograms if port is not None):
+                for metric, histogram in zip(self.METRICS, port_histograms[port]):
+                    yield sw_id, port, metric, histogram
+
+    def windows(self):
+        now = self.now
+        slot_id = int(now / self.slot)
+        for sw_id, port, metric, histogram in self.histograms(
+                lambda windowed: windowed.window(slot_id, LogHistogram())):
+            yield now, sw_id, port, metric, histogram
+
+    # appends the quantiles of the current window of every sketch to the output
+    def dump(self):
+        if self.output is None:
+            return
+        for now, sw_id, port, metric, window in self.windows():
+            if window.count:
+                p50, p99, p999 = window.quantiles()
+                self.output.write(f"{now:0.4f}, {sw_id}, {'' if port is None else port}, {metric}, "
+                                  f"{window.count}, {p50}, {p99}, {p999}, {window.max}\n")
+        self.output.flush()
+
+    def summary(self):
+        lines = []
+        for now, sw_id, port, metric, window in self.windows():
+            if port is None and window.count:
+                p50, p99, p999 = window.quantiles()
+                lines.append(f"switch {sw_id} {metric}: p50 {p50}, p99 {p99}, p99.9 {p999}, "
+                             f"max {window.max} over {window.count} hops")
+        return "\n".join(lines)
+
+    # writes the whole run histograms, which merge_sketch_outputs can combine
+    def close(self):
+        if self.output is not None:
+            self.output.close()
+        if self.sketch_path is None:
+            return
+        with open(self.sketch_path, "w") as f:
+            for sw_id, port, metric, histogram in self.histograms(
+                    lambda windowed: windowed.total(LogHistogram())):
+                f.write(f"{sw_id}, {'' if port is None else port}, {metric}, {histogram.to_text()}\n")
+
+
+# merges the whole run histograms of the workers into sketch_path and their
+# time ordered quantile outputs into output_path
+def merge_sketch_outputs(num_workers, sketch_path=SKETCH_OUTPUT_PATH, output_path=QUANTILE_OUTPUT_PATH):
+    histograms = {}
+    worker_paths = [worker_output(sketch_path, i) for i in range(num_workers)]
+    worker_paths = [p for p in worker_paths if os.path.exists(p)]
+    for p in worker_paths:
+        with open(p) as f:
+            for line in f:
+                sw_id, port, metric, text = line.rstrip("\n").split(", ", 3)
+                histogram = LogHistogram.from_text(text)
+                merged = histograms.get((sw_id, port, metric))
+                if merged is None:
+                    histograms[(sw_id, port, metric)] = histogram
+                else:
+                    merged.merge(histogram)
+        os.remove(p)
+    if worker_paths:
+        with open(sketch_path, "w") as f:
+            for (sw_id, port, metric), histogram in histograms.items():
+                f.write(f"{sw_id}, {port}, {metric}, {histogram.to_text()}\n")
+
+    merge_timed_outputs(num_workers, output_path, QUANTILE_OUTPUT_HEADER)
+
+
+# merges time ordered worker outputs starting with a header line into output_path
+def merge_timed_outputs(num_workers, output_path, header):
+    worker_paths = [worker_output(output_path, i) for i in range(num_workers)]
+    worker_paths = [p for p in worker_paths if os.path.exists(p)]
+    if not worker_paths:
+        return
+    with contextlib.ExitStack() as stack:
+        inputs = [stack.enter_context(open(p)) for p in worker_paths]
+        for f in inputs:
+            f.readline()
+        with open(output_path, "w") as out:
+            out.write(header)
+            out.writelines(heapq.merge(*inputs, key=output_line_time))
+    for p in worker_paths:
+        os.remove(p)
+
+
+class Burst:
+    # one ongoing microburst of an egress port. flows counts the reports of at
+    # most BURST_FLOWS distinct inner flows, other_flows those of the rest
+    __slots__ = ("start", "last", "peak", "peak_time", "samples", "flows", "other_flows")
+
+    def __init__(self, now, q_occupancy):
+        self.start = now
+        self.last = now
+        self.peak = q_occupancy
+        self.peak_time = now
+        self.samples = 0
+        self.flows = {}
+        self.other_flows = 0
+
+
+class BurstDetector:
+    # microburst detection on the queue occupancy of every (switch, egress
+    # port). a port is in a burst from the first sample at or above rise until
+    # the first one at or below fall, only ports in a burst keep any state.
+    # every finished burst is written as one line to output_path
+    def __init__(self, rise=BURST_RISE, fall=BURST_FALL, output_path=BURST_OUTPUT_PATH):
+        self.rise = rise
+        self.fall = fall
+        self.active = {}
+        self.finished = 0
+        self.output = open(output_path, "w")
+        self.output.write(BURST_OUTPUT_HEADER)
+
+    def __call__(self, report, now):
+        key = None
+        active = self.active
+        rise = self.rise
+        for hop in report.hops:
+            q_occupancy = hop[Q_OCCUPANCY_DATA]
+            # below rise with no burst going on anywhere, the common case
+            if q_occupancy is None or (q_occupancy < rise and not active):
+                continue
+            port = (hop[SWITCH_ID_DATA], hop[EGRESS_PORT_ID_DATA])
+            burst = active.get(port)
+            if burst is None:
+                if q_occupancy < self.rise:
+                    continue
+                burst = self.active[port] = Burst(now, q_occupancy)
+            burst.last = now
+            burst.samples += 1
+            if q_occupancy > burst.peak:
+                burst.peak = q_occupancy
+                burst.peak_time = now
+            if key is None:
+                key = flow_key(report)
+            if key in burst.flows:
+                burst.flows[key] += 1
+            elif len(burst.flows) < BURST_FLOWS:
+                burst.flows[key] = 1
+            else:
+                burst.other_flows += 1
+            if q_occupancy <= self.fall:
+                self.write(port, self.active.pop(port))
+
+    def write(self, port, burst):
+        flows = sorted(burst.flows.items(), key=lambda item: item[1], reverse=True)
+        flows = " ".join(f"{format_flow_key(key)}x{n}" for key, n in flows)
+        if burst.other_flows:
+            flows += f" otherx{burst.other_flows}"
+        self.output.write(f"{burst.start:0.4f}, {burst.last:0.4f}, {burst.last - burst.start:0.4f}, "
+                          f"{port[0]}, {port[1]}, {burst.peak}, {burst.peak_time:0.4f}, "
+                          f"{burst.samples}, {flows}\n")
+        self.finished += 1
+
+    def dump(self):
+        self.output.flush()
+
+    def summary(self):
+        if not self.finished and not self.active:
+            return ""
+        return f"bursts: {self.finished} finished, {len(self.active)} ongoing"
+
+    # bursts still going on when the collector stops end at their last sample
+    def close(self):
+        for port, burst in sorted(self.active.items(), key=lambda item: item[1].start):
+            self.write(port, burst)
+        self.active.clear()
+        self.output.close()
+
+
+class LoadShedder:
+    # overload policy of the collector. the capture feeds the fill level of its
+    # input to update(), between 0 for idle and 1 for a full backlog, and the
+    # level goes up and down with the smoothed load. shed() is asked about
+    # every report while shedding: sampled keeps 1 in every flows, by a hash
+    # of the inner addresses and ports, or the reports of every switch whose
+    # seq_no is a multiple of every, headers keeps none. shed reports are only
+    # counted per switch, for rescaling the statistics of the decoded ones,
+    # and still go to the seq accounting
+    def __init__(self, key="flow", every=SHED_EVERY, high=SHED_HIGH, low=SHED_LOW, seq=None,
+                 hold=SHED_HOLD, recovery=SHED_RECOVERY, clock=time.monotonic):
+        self.key = key
+        self.every = every
+        self.high = high
+        self.low = low
+        self.seq = seq
+        self.hold = hold
+        self.recovery = recovery
+        self.clock = clock
+        self.level = 0
+        self.load = 0.0
+        # direction the level is about to move in and since when
+        self.pending = 0
+        self.since = 0.0
+        self.changes = 0
+        self.shed_reports = {}
+
+    def update(self, fill):
+        load = self.load = self.load + SHED_SMOOTHING * (fill - self.load)
+        if load >= self.high and self.level < SHED_HEADERS:
+            direction, wait = 1, self.hold
+        elif load <= self.low and self.level:
+            direction, wait = -1, self.recovery
+        else:
+            self.pending = 0
+            return
+        now = self.clock()
+        if self.pending != direction:
+            self.pending = direction
+            self.since = now
+        elif now - self.since >= wait:
+            self.level += direction
+            self.changes += 1
+            self.pending = 0
+            log.warning("load %0.2f, %s", load, self.describe())
+
+    def describe(self):
+        if self.level == SHED_SAMPLED:
+            return f"decoding 1 in {self.every} {'flows' if self.key == 'flow' else 'reports per switch'}"
+        if self.level == SHED_HEADERS:
+            return "counting report headers only"
+        return "decoding every report"
+
+    # whether to skip decoding the report, which is then counted
+    def shed(self, payload):
+        if len(payload) < FLOW_HASH_END:
+            # too short to tell, the decoder reports it as malformed
+            return False
+        sw_id, seq_no = SHED_HEADER_STRUCT.unpack_from(payload, 0)
+        if self.level == SHED_SAMPLED:
+            if self.key == "flow":
+                if zlib.crc32(payload[FLOW_HASH_START:FLOW_HASH_END]) % self.every == 0:
+                    return False
+            elif seq_no % self.every == 0:
+                return False
+        self.shed_reports[sw_id] = self.shed_reports.get(sw_id, 0) + 1
+        if self.seq is not None:
+            self.seq.count(sw_id, seq_no)
+        return True
+
+    def summary(self):
+        if not self.changes and not self.shed_reports:
+            return ""
+        shed = ", ".join(f"switch {sw_id} {n}" for sw_id, n in sorted(self.shed_reports.items()))
+        return (f"shedding: {self.describe()}, load {self.load:0.2f}, "
+                f"{self.changes} level changes, shed reports: {shed or 'none'}")
+
+
+# callables every decoded report is passed to after its hops are recorded,
+# with its report_time
+report_observers = []
+
+# LoadShedder of --shed, None when the collector decodes every report
+shedder = None
+
+# int_metrics.Metrics of the --metrics-port endpoint, None when it is off
+metrics = None
+
+# report rates of this process, logged every --status-interval while it is entered
+status = int_log.StatusLine(log, what="reports")
+
+# int_log.Sampler of the reports whose headers and int data are printed,
+# None prints none
+dumps = None
+
+
+class StageProfiler:
+    # per stage latency histograms of one report in every, in nanoseconds.
+    # capture is the time from the end of a sampled report to the start of
+    # the next one, the receive calls, scapy dissection and any wait for
+    # traffic included. outputs covers writing the hops, flushes included
+    STAGES = ("capture", "headers", "int_data", "outputs", "observers", "total")
+
+    def __init__(self, every=PROFILE_EVERY, label=None):
+        self.every = every
+        self.countdown = every
+        self.label = label
+        self.histograms = {stage: LogHistogram() for stage in self.STAGES}
+        # end of the last sampled report, 0 once the next report has taken it
+        self.end_ns = 0
+
+    # whether to time the report about to be handled
+    def sample(self):
+        if self.end_ns:
+            self.histograms["capture"].record(time.perf_counter_ns() - self.end_ns)
+            self.end_ns = 0
+        self.countdown -= 1
+        if self.countdown:
+            return False
+        self.countdown = self.every
+        return True
+
+    def print_stages(self, *args):
+        title = f"stage latency, 1 in {self.every} reports, us"
+        if self.label is not None:
+            title = f"{self.label}: {title}"
+        print(title)
+        print(f"  {'stage':<10} {'count':>9} {'mean':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+        for stage in self.STAGES:
+            histogram = self.histograms[stage]
+            if not histogram.count:
+                continue
+            mean = sum(histogram_value(b) * n for b, n in enumerate(histogram.counts)) / histogram.count
+            p50, p90, p99 = histogram.quantiles((0.5, 0.9, 0.99))
+            print(f"  {stage:<10} {histogram.count:>9} {mean / 1e3:>9.2f} {p50 / 1e3:>9.2f} "
+                  f"{p90 / 1e3:>9.2f} {p99 / 1e3:>9.2f} {histogram.max / 1e3:>9.2f}")
         sys.stdout.flush()
 
 
+# StageProfiler of --profile, None when it is off
+profiler = None
+
+
+# times one report in every from now on, printing the stage histograms on
+# SIGUSR1 and when the returned context exits
+@contextlib.contextmanager
+def profiling(every, label=None):
+    global profiler
+    if not every:
+        yield
+        return
+    profiler = StageProfiler(every, label)
+    signal.signal(signal.SIGUSR1, profiler.print_stages)
+    try:
+        yield
+    finally:
+        profiler.print_stages()
+
+
+# serves the collector metrics on port from now on
+def start_metrics(port):
+    global metrics
+    metrics = int_metrics.Metrics()
+    int_metrics.serve(metrics, port)
+    log.info("serving metrics on http://0.0.0.0:%d/metrics", port)
+
+
+# configures the logging of this process, the sampled dumps and the status
+# line, which is returned for the capture to enter
+def report_logging(level="info", status_interval=int_log.STATUS_INTERVAL, dump_every=0, label=None):
+    global dumps
+    int_log.setup(level)
+    status.interval = status_interval
+    status.label = label
+    dumps = int_log.Sampler(dump_every) if dump_every else None
+    return status
+
+
+class PeriodicSummaries:
+    # prints the summary() of every source each interval seconds from a daemon
+    # thread while the capture runs, and once more when it ends before closing
+    # the sources that have a close(). no interval only prints the final summaries
+    def __init__(self, sources, interval=SUMMARY_INTERVAL, label=None):
+        self.sources = sources
+        self.interval = interval
+        self.label = label
+        self.stop = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        if self.interval:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.print_summaries()
+        for source in self.sources:
+            if hasattr(source, "close"):
+                source.close()
+
+    def run(self):
+        while not self.stop.wait(self.interval):
+            self.print_summaries()
+
+    def print_summaries(self):
+        for source in self.sources:
+            if hasattr(source, "dump"):
+                source.dump()
+            summary = source.summary()
+            if not summary:
+                continue
+            if self.label is not None:
+                summary = "\n".join(f"{self.label}: {line}" for line in summary.splitlines())
+            log.info(summary)
+
+
+# sets up the report statistics of this process and registers their
+# observers, the returned PeriodicSummaries prints them. the seq accounting
+# is on unless seq is false, the flow table, the quantile sketches and the
+# burst detector are only set up when flows, quantiles or bursts ask for
+# them. each costs on the order of microseconds per report, a few times the
+# seq accounting: with 3 hop reports about 3us the flow table, 4us the
+# sketches and up to 2us the burst detector, against about 10us for
+# decoding and writing the report.
+# worker_idx gives the statistics outputs their worker file names and the
+# summaries their label unless label is given.
+# shed is the LoadShedder key, flow or switch, of a collector that sheds load.
+# timestamps, one of TIMESTAMP_MODES, also sets up the switch clocks the hops
+# are timestamped by
+def report_statistics(interval=SUMMARY_INTERVAL, seq=True, flows=False, quantiles=False, bursts=False,
+                      flow_table_size=FLOW_TABLE_SIZE, flow_idle_timeout=FLOW_IDLE_TIMEOUT,
+                      quantile_window=QUANTILE_WINDOW, burst_rise=BURST_RISE, burst_fall=BURST_FALL,
+                      shed=None, shed_every=SHED_EVERY, shed_high=SHED_HIGH, shed_low=SHED_LOW,
+                      timestamps="arrival", worker_idx=None, label=None):
+    global shedder, clocks
+
+    clocks = None if timestamps == "arrival" else SwitchClocks(timestamps)
+
+    def output(path):
+        return path if worker_idx is None else worker_output(path, worker_idx)
+
+    sources = []
+    accounting = None
+    if seq:
+        accounting = SeqAccounting()
+        sources.append(accounting)
+        if metrics is not None:
+            metrics.register("int_reports_lost_total", "INT reports missing from the seq_no sequence",
+                             lambda: {(sw_id,): state.lost
+                                      for sw_id, state in list(accounting.switches.items())},
+                             "counter", ("sw_id",))
+    if flows:
+        sources.append(FlowTable(flow_table_size, flow_idle_timeout, output(FLOW_OUTPUT_PATH),
+                                 output(PATH_OUTPUT_PATH), output(PATH_CHANGE_OUTPUT_PATH)))
+    if quantiles:
+        sources.append(HopSketches(quantile_window, output_path=output(QUANTILE_OUTPUT_PATH),
+                                   sketch_path=output(SKETCH_OUTPUT_PATH)))
+    if bursts:
+        sources.append(BurstDetector(burst_rise, burst_fall, output(BURST_OUTPUT_PATH)))
+    report_observers.extend(sources)
+    if shed is not None:
+        shedder = LoadShedder(shed, shed_every, shed_high, shed_low, seq=accounting)
+        sources.append(shedder)
+        if metrics is not None:
+            metrics.register("int_shed_level", "load shedding level, 0 decodes every report, 1 samples, "
+                             "2 only counts the reports", lambda: shedder.level)
+            metrics.register("int_reports_shed_total", "INT reports counted without being decoded",
+                             lambda: {(sw_id,): n for sw_id, n in list(shedder.shed_reports.items())},
+                             "counter", ("sw_id",))
+    if label is None and worker_idx is not None:
+        label = f"worker {worker_idx}"
+    return PeriodicSummaries(sources, interval, label)
+
+
+# decodes and records one INT report, malformed reports are counted, logged
+# at debug level and skipped
+def handle_report(payload, outputs, tic, now=None):
+    status.packets += 1
+    if shedder is not None and shedder.level and shedder.shed(payload):
+        return
+    if profiler is not None and profiler.sample():
+        profile_report(payload, outputs, tic, now)
+        return
+    if metrics is not None:
+        counters = metrics.counters()
+        counters.received += 1
+    if now is None:
+        now = time.perf_counter()
+    try:
+        report = int_parser(payload, outputs, tic, printInfo=dumps is not None and dumps.sample(), now=now)
+    except (struct.error, ValueError) as e:
+        status.errors += 1
+        if metrics is not None:
+            counters.errors += 1
+        log.debug("malformed INT report: %s", e)
+        return
+    if metrics is not None:
+        counters.decoded += 1
+        counters.switch_reports[report.sw_id] = counters.switch_reports.get(report.sw_id, 0) + 1
+    if report_observers:
+        now = report_time(report, now - tic)
+        for observe in report_observers:
+            observe(report, now)
+
+
+# handle_report of a report the profiler sampled, with every stage timed
+def profile_report(payload, outputs, tic, now=None):
+    histograms = profiler.histograms
+    start = time.perf_counter_ns()
+    if metrics is not None:
+        counters = metrics.counters()
+        counters.received += 1
+    try:
+        payload = memoryview(payload)
+        report, plan, num_transits, payload_idx = decode_int_headers(payload)
+        headers_end = time.perf_counter_ns()
+        report.hops, _ = parse_int_data(plan, num_transits, payload, payload_idx, printInfo=False)
+        int_data_end = time.perf_counter_ns()
+    except (struct.error, ValueError) as e:
+        status.errors += 1
+        if metrics is not None:
+            counters.errors += 1
+        log.debug("malformed INT report: %s", e)
+        profiler.end_ns = time.perf_counter_ns()
+        return
+
+    write_hops(report, outputs, tic, now, plan)
+    outputs_end = time.perf_counter_ns()
+
+    if metrics is not None:
+        counters.decoded += 1
+        counters.switch_reports[report.sw_id] = counters.switch_reports.get(report.sw_id, 0) + 1
+    if report_observers:
+        now = report_time(report, (time.perf_counter() if now is None else now) - tic)
+        for observe in report_observers:
+            observe(report, now)
+    end = time.perf_counter_ns()
+
+    histograms["headers"].record(headers_end - start)
+    histograms["int_data"].record(int_data_end - headers_end)
+    histograms["outputs"].record(outputs_end - int_data_end)
+    histograms["observers"].record(end - outputs_end)
+    histograms["total"].record(end - start)
+    profiler.end_ns = time.perf_counter_ns()
+
+
+def handle_pkt(pkt, outputs, tic):
+    if UDP in pkt and pkt[UDP].dport == COLLECTOR_PORT:
+        payload = bytes(pkt[UDP].payload)
+        handle_report(payload, outputs, tic)
+
+
+def log_ring_stats(ring, level=logging.INFO):
+    packets, drops, freeze_q_cnt = ring.stats()
+    log.log(level, "ring: %d packets, %d drops, %d queue freezes", packets, drops, freeze_q_cnt)
+
+
+# captures from a TPACKET_V3 ring, frames go straight from the ring to the
+# INT decoder. ring drops are logged as warnings whenever they grow
+def capture_ring(iface, outputs, tic):
+    with int_capture.TPacketV3Ring(iface, port=COLLECTOR_PORT) as ring, \
+         contextlib.closing(ring.blocks()) as blocks:
+        if metrics is not None:
+            # the capture loop keeps the cumulative ring statistics current
+            metrics.register("int_capture_packets_total", "frames the ring captured",
+                             lambda: ring.packets, "counter")
+            metrics.register("int_capture_drops_total", "frames the ring dropped",
+                             lambda: ring.drops, "counter")
+        last_drops = 0
+        try:
+            for frames in blocks:
+                if shedder is not None:
+                    shedder.update(ring.backlog())
+                for frame in frames:
+                    payload = int_capture.udp_payload(frame, COLLECTOR_PORT)
+                    if payload is not None:
+                        handle_report(payload, outputs, tic)
+                if ring.stats()[1] != last_drops:
+                    last_drops = ring.drops
+                    log_ring_stats(ring, logging.WARNING)
+        finally:
+            log_ring_stats(ring)
+
+
+# receives the reports on a kernel UDP socket bound to the collector port, the
+# datagram payloads go to the INT decoder without any L2 capture
+def capture_udp(outputs, tic, batch=64, rcvbuf=None, reuseport=False, reuseport_filter=None):
+    with int_capture.UdpBatchReceiver(COLLECTOR_PORT, batch=batch, rcvbuf=rcvbuf, reuseport=reuseport,
+                                      reuseport_filter=reuseport_filter) as receiver:
+        mode = "recvmmsg" if receiver.recvmmsg is not None else "recv"
+        if metrics is not None:
+            metrics.register("int_capture_drops_total", "datagrams the kernel dropped on the collector port",
+                             lambda: int_capture.udp_socket_drops(COLLECTOR_PORT) or 0, "counter")
+        log.info("receiving on udp port %d with %s, batch %d, SO_RCVBUF %d",
+                 COLLECTOR_PORT, mode, batch, receiver.rcvbuf())
+        for payloads in receiver.batches():
+            # a full batch means more datagrams are queued on the socket
+            if shedder is not None:
+                shedder.update(len(payloads) / batch)
+            for payload in payloads:
+                handle_report(payload, outputs, tic)
+
+
+def raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+# worker output files get the worker index appended to the final file name
+def worker_output(path, worker_idx):
+    return f"{path}.w{worker_idx}"
+
+
+# hop outputs of a worker or decoder process, merged by merge_outputs
+def worker_outputs(worker_idx, binary, max_open, field):
+    if binary:
+        return BinaryHopWriter(worker_output(BINARY_OUTPUT_PATH, worker_idx))
+    return SwitchOutputs(worker_output(OUTPUT_PATH_FORMAT, worker_idx), max_open=max_open, field=field)
+
+
+# one collector process of --workers mode. every worker binds the collector
+# port with SO_REUSEPORT and writes its share of the reports to its own files.
+# the coordinator stops the workers with SIGTERM so ctrl-c in the terminal
+# cannot interrupt a worker in the middle of a write
+def udp_worker(worker_idx, num_workers, tic, batch, rcvbuf, spread, max_open, binary, field,
+               statistics, metrics_port, profile_every, log_setup):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, raise_keyboard_interrupt)
+    status = log_setup(label=f"worker {worker_idx}")
+
+    if metrics_port is not None:
+        start_metrics(metrics_port + worker_idx)
+
+    reuseport_filter = None
+    if spread == "random" and worker_idx == 0:
+        reuseport_filter = int_capture.reuseport_random_filter(num_workers)
+
+    outputs = worker_outputs(worker_idx, binary, max_open, field)
+    # random spread splits the reports of a switch between workers, so no
+    # worker sees a whole seq_no sequence
+    statistics = statistics(seq=spread == "flow", worker_idx=worker_idx)
+    with profiling(profile_every, label=f"worker {worker_idx}"), outputs, statistics, status:
+        try:
+            capture_udp(outputs, tic, batch=batch, rcvbuf=rcvbuf, reuseport=True,
+                        reuseport_filter=reuseport_filter)
+        except KeyboardInterrupt:
+            pass
+
+
+def output_line_time(line):
+    return float(line.split(",", 1)[0])
+
+
+# merges the time ordered worker files of every switch any worker saw into
+# the final per switch files
+def merge_worker_outputs(num_workers):
+    final_paths = collections.defaultdict(list)
+    for i in range(num_workers):
+        prefix, suffix = worker_output(OUTPUT_PATH_FORMAT, i).split("{}")
+        for p in glob.glob(glob.escape(prefix) + "*" + glob.escape(suffix)):
+            sw_id = p[len(prefix) : len(p) - len(suffix)]
+            final_paths[OUTPUT_PATH_FORMAT.format(sw_id)].append(p)
+
+    for path, worker_paths in final_paths.items():
+        with contextlib.ExitStack() as stack:
+            inputs = [stack.enter_context(open(p)) for p in worker_paths]
+            with open(path, "w") as out:
+                out.writelines(heapq.merge(*inputs, key=output_line_time))
+        for p in worker_paths:
+            os.remove(p)
+
+
+def read_hop_records(path):
+    with open(path, "rb") as f:
+        f.seek(len(NPY_MAGIC))
+        header_len = struct.unpack("<H", f.read(2))[0]
+        f.seek(header_len, os.SEEK_CUR)
+        yield from HOP_RECORD_STRUCT.iter_unpack(f.read())
+
+
+def hop_record_time(record):
+    return record[0]
+
+
+# merges the time ordered binary worker outputs into BINARY_OUTPUT_PATH
+def merge_binary_worker_outputs(num_workers):
+    worker_paths = [worker_output(BINARY_OUTPUT_PATH, i) for i in range(num_workers)]
+    worker_paths = [p for p in worker_paths if os.path.exists(p)]
+    with BinaryHopWriter(BINARY_OUTPUT_PATH) as out:
+        records = heapq.merge(*[read_hop_records(p) for p in worker_paths], key=hop_record_time)
+        for record in records:
+            out.write_hop(*record_hop(record))
+    for p in worker_paths:
+        os.remove(p)
+
+
+# runs num_workers udp_worker processes until ctrl-c, then merges their outputs.
+# all workers share tic, perf_counter is the same monotonic clock in every process.
+# statistics and log_setup are report_statistics and report_logging with the
+# options of the workers bound. worker i serves its metrics on metrics_port + i
+def run_workers(num_workers, tic, batch, rcvbuf, spread, max_open=MAX_OPEN_OUTPUTS, binary=False,
+                field=HOP_LATENCY_DATA, statistics=report_statistics, metrics_port=None, profile_every=None,
+                log_setup=report_logging):
+    workers = [multiprocessing.Process(target=udp_worker,
+                                       args=(i, num_workers, tic, batch, rcvbuf, spread, max_open,
+                                             binary, field, statistics, metrics_port, profile_every,
+                                             log_setup))
+               for i in range(num_workers)]
+    for worker in workers:
+        worker.start()
+    log.info("started %d collector workers", num_workers)
+
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+
+    merge_outputs(num_workers, binary)
+
+
+# merges the hop and statistics outputs of num_workers worker or decoder
+# processes into the final files
+def merge_outputs(num_workers, binary):
+    if binary:
+        merge_binary_worker_outputs(num_workers)
+    else:
+        merge_worker_outputs(num_workers)
+    merge_flow_outputs(num_workers)
+    merge_path_outputs(num_workers)
+    merge_timed_outputs(num_workers, PATH_CHANGE_OUTPUT_PATH, PATH_CHANGE_OUTPUT_HEADER)
+    merge_sketch_outputs(num_workers)
+    merge_timed_outputs(num_workers, BURST_OUTPUT_PATH, BURST_OUTPUT_HEADER)
+
+
+# receives the reports on the collector UDP port and puts them into the
+# shared memory ring of the decoder of their sw_id, so every switch sequence
+# stays with one decoder. the reports of a batch share its arrival time
+def capture_shm(ring, batch=64, rcvbuf=None):
+    decoders = ring.rings
+    with int_capture.UdpBatchReceiver(COLLECTOR_PORT, batch=batch, rcvbuf=rcvbuf) as receiver:
+        if metrics is not None:
+            metrics.register("int_capture_drops_total", "datagrams the kernel dropped on the collector port",
+                             lambda: int_capture.udp_socket_drops(COLLECTOR_PORT) or 0, "counter")
+            metrics.register("int_ring_fill", "fraction of the ring slots of a decoder waiting to be decoded",
+                             lambda: {(i,): ring.fill(i) for i in range(decoders)}, labels=("decoder",))
+            metrics.register("int_ring_drops_total", "reports dropped on a full decoder ring",
+                             lambda: {(i,): ring.drops(i) for i in range(decoders)}, "counter", ("decoder",))
+            metrics.register("int_ring_overruns_total", "reports overwritten before their decoder read them",
+                             lambda: {(i,): ring.overruns(i) for i in range(decoders)}, "counter",
+                             ("decoder",))
+        log.info("receiving on udp port %d for %d decoders, batch %d, SO_RCVBUF %d",
+                 COLLECTOR_PORT, decoders, batch, receiver.rcvbuf())
+        for payloads in receiver.batches():
+            if not payloads:
+                continue
+            now = time.perf_counter()
+            status.packets += len(payloads)
+            for payload in payloads:
+                sw_id = REPORT_SW_ID_STRUCT.unpack_from(payload, 0)[0] if len(payload) >= 8 else 0
+                ring.put(sw_id % decoders, payload, now)
+            ring.publish()
+
+
+# ring fill levels, drops and overruns for the status line of the capture process
+def shm_ring_stats(ring):
+    fills = ", ".join(f"{ring.fill(i):0.2f}" for i in range(ring.rings))
+    drops = sum(ring.drops(i) for i in range(ring.rings))
+    overruns = sum(ring.overruns(i) for i in range(ring.rings))
+    return f"ring fill [{fills}], dropped {drops}, overrun {overruns}"
+
+
+# one decode process of --decoders mode, decoding the reports the capture
+# process puts into ring decoder_idx of the shared memory ring ring_name. it
+# stops once the capture process has finished the ring and it read the rest
+def shm_decoder(decoder_idx, ring_name, tic, max_open, binary, field, statistics, metrics_port,
+                profile_every, log_setup):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    label = f"decoder {decoder_idx}"
+    status = log_setup(label=label)
+
+    # the capture process serves the ring metrics on metrics_port
+    if metrics_port is not None:
+        start_metrics(metrics_port + 1 + decoder_idx)
+
+    outputs = worker_outputs(decoder_idx, binary, max_open, field)
+    statistics = statistics(worker_idx=decoder_idx, label=label)
+    with int_shm.ShmRing.attach(ring_name) as ring, \
+         contextlib.closing(ring.reader(decoder_idx)) as reader, \
+         profiling(profile_every, label=label), outputs, statistics, status:
+        for reports in reader:
+            if shedder is not None:
+                shedder.update(ring.fill(decoder_idx))
+            for now, payload in reports:
+                handle_report(payload, outputs, tic, now=now)
+
+
+# runs num_decoders shm_decoder processes fed by this process through a ring
+# of slots reports per decoder in shared memory, until ctrl-c. policy is what
+# a full ring does, see int_shm.POLICIES. the decoders drain their rings
+# before their outputs are merged like those of run_workers
+def run_decoders(num_decoders, tic, batch, rcvbuf, slots=int_shm.SLOTS, policy="drop",
+                 max_open=MAX_OPEN_OUTPUTS, binary=False, field=HOP_LATENCY_DATA,
+                 statistics=report_statistics, metrics_port=None, profile_every=None,
+                 log_setup=report_logging):
+    with int_shm.ShmRing.create(num_decoders, slots, policy=policy) as ring:
+        decoders = [multiprocessing.Process(target=shm_decoder,
+                                            args=(i, ring.name, tic, max_open, binary, field, statistics,
+                                                  metrics_port, profile_every, log_setup))
+                    for i in range(num_decoders)]
+        for decoder in decoders:
+            decoder.start()
+        log.info("started %d decoders, %d ring slots each, %s when full", num_decoders, slots, policy)
+
+        status.extra = functools.partial(shm_ring_stats, ring)
+        try:
+            with status:
+                capture_shm(ring, batch=batch, rcvbuf=rcvbuf)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            ring.finish()
+            for decoder in decoders:
+                decoder.join()
+            log.info(shm_ring_stats(ring))
+
+    merge_outputs(num_decoders, binary)
+
+
+class AsyncQueueWriter:
+    # file-like stand in for an output file that int_parser writes to. lines go
+    # into a bounded queue drained by a sink task and are counted as dropped
+    # when the sink falls behind, so decoding never waits on the sink
+    def __init__(self, maxsize):
+        self.queue = asyncio.Queue(maxsize)
+        self.drops = 0
+
+    def write(self, line):
+        try:
+            self.queue.put_nowait(line)
+        except asyncio.QueueFull:
+            self.drops += 1
+
+    # the sink task owns the file, it is closed when the collector stops
+    def close(self):
+        pass
+
+
+class AsyncFileSink:
+    # sink writing batches of lines to a file. the blocking write and flush run
+    # in the default executor so a slow disk does not stall the event loop.
+    # other sinks only need the same write_batch and close coroutines
+    def __init__(self, path, mode="w"):
+        self.file = open(path, mode)
+
+    def write_lines(self, lines):
+        start = time.perf_counter()
+        self.file.writelines(lines)
+        self.file.flush()
+        if metrics is not None:
+            # runs in an executor thread, which counts in its own counters
+            counters = metrics.counters()
+            counters.writes += 1
+            counters.write_seconds += time.perf_counter() - start
+
+    async def write_batch(self, lines):
+        await asyncio.get_running_loop().run_in_executor(None, self.write_lines, lines)
+
+    async def close(self):
+        self.file.close()
+
+
+class IntReportProtocol(asyncio.DatagramProtocol):
+    # queues the raw report payloads for the decode task, counting the ones
+    # that did not fit
+    def __init__(self, queue):
+        self.queue = queue
+        self.received = 0
+        self.drops = 0
+
+    def datagram_received(self, data, addr):
+        self.received += 1
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            self.drops += 1
+
+
+class AsyncOutputOpener:
+    # open_output of the SwitchOutputs of the asyncio collector. every new
+    # output gets a queue writer, a sink from make_sink(path, mode) and a
+    # task draining one into the other
+    def __init__(self, queue_size, batch, make_sink=AsyncFileSink):
+        self.queue_size = queue_size
+        self.batch = batch
+        self.make_sink = make_sink
+        # (writer, sink, task) of every output
+        self.outputs = []
+
+    def __call__(self, path, mode):
+        writer = AsyncQueueWriter(self.queue_size)
+        sink = self.make_sink(path, mode)
+        task = asyncio.create_task(drain_sink(writer, sink, self.batch))
+        self.outputs.append((writer, sink, task))
+        return writer
+
+
+async def decode_reports(queue, outputs, tic):
+    while True:
+        payload = await queue.get()
+        if shedder is not None and queue.maxsize:
+            shedder.update(queue.qsize() / queue.maxsize)
+        handle_report(payload, outputs, tic)
+
+
+# moves up to batch lines at a time from a writer queue to its sink
+async def drain_sink(writer, sink, batch):
+    queue = writer.queue
+    while True:
+        lines = [await queue.get()]
+        while len(lines) < batch and not queue.empty():
+            lines.append(queue.get_nowait())
+        await sink.write_batch(lines)
+
+
+def drain_remaining(queue):
+    lines = []
+    while not queue.empty():
+        lines.append(queue.get_nowait())
+    return lines
+
+
+# queue depths and drops of the asyncio collector for the status line
+def async_queue_stats(protocol, report_queue, opener):
+    outputs = list(opener.outputs)
+    depths = ", ".join(str(writer.queue.qsize()) for writer, _, _ in outputs)
+    drops = sum(writer.drops for writer, _, _ in outputs)
+    return (f"received {protocol.received}, report queue {report_queue.qsize()} "
+            f"(dropped {protocol.drops}), sink queues [{depths}] (dropped {drops})")
+
+
+# asyncio collector: a datagram endpoint on the collector port feeds a bounded
+# report queue, a decode task turns reports into output lines on one bounded
+# queue per switch and one task per switch writes them to its sink in batches.
+# the queue depths and drops go on the status line
+async def collect_async(tic, queue_size=1 << 16, batch=1024, rcvbuf=None, make_sink=AsyncFileSink,
+                        field=HOP_LATENCY_DATA):
+    loop = asyncio.get_running_loop()
+    report_queue = asyncio.Queue(queue_size)
+    # sinks own their files, so the registry never closes them
+    opener = AsyncOutputOpener(queue_size, batch, make_sink)
+    outputs = SwitchOutputs(max_open=None, open_output=opener, field=field)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if rcvbuf is not None:
+        int_capture.set_rcvbuf(sock, rcvbuf)
+    sock.bind(("0.0.0.0", COLLECTOR_PORT))
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: IntReportProtocol(report_queue), sock=sock)
+    if metrics is not None:
+        metrics.register("int_report_queue_depth", "reports waiting for the decode task", report_queue.qsize)
+        metrics.register("int_report_queue_drops_total", "reports dropped on a full report queue",
+                         lambda: protocol.drops, "counter")
+        metrics.register("int_output_queue_depth", "lines waiting for the output sinks",
+                         lambda: sum(writer.queue.qsize() for writer, _, _ in opener.outputs))
+        metrics.register("int_output_queue_drops_total", "lines dropped on a full output queue",
+                         lambda: sum(writer.drops for writer, _, _ in opener.outputs), "counter")
+        metrics.register("int_capture_drops_total", "datagrams the kernel dropped on the collector port",
+                         lambda: int_capture.udp_socket_drops(COLLECTOR_PORT) or 0, "counter")
+    status.extra = functools.partial(async_queue_stats, protocol, report_queue, opener)
+    log.info("receiving on udp port %d with asyncio", COLLECTOR_PORT)
+
+    tasks = [asyncio.create_task(decode_reports(report_queue, outputs, tic))]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        transport.close()
+        tasks += [task for _, _, task in opener.outputs]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # decode what was already received and flush everything that is queued
+        for payload in drain_remaining(report_queue):
+            handle_report(payload, outputs, tic)
+        for writer, sink, _ in opener.outputs:
+            lines = drain_remaining(writer.queue)
+            if lines:
+                await sink.write_batch(lines)
+            await sink.close()
+
+
+def capture_async(tic, queue_size, batch, rcvbuf=None, field=HOP_LATENCY_DATA,
+                  statistics=report_statistics):
+    with statistics():
+        try:
+            asyncio.run(collect_async(tic, queue_size=queue_size, batch=batch, rcvbuf=rcvbuf, field=field))
+        except KeyboardInterrupt:
+            pass
+
+
+def pcap_frame_time(record):
+    return record[0]
+
+
+# replays the collector flow of one or more pcap/pcapng files through the INT
+# decoder. records of all files are merged in timestamp order and stamped
+# relative to the first one, so the output matches a live run
+def replay_pcaps(paths, outputs):
+    start = time.perf_counter()
+    reports = 0
+    first_ts = None
+    last_ts = None
+    with contextlib.ExitStack() as stack:
+        readers = [stack.enter_context(int_capture.PcapFileReader(path)) for path in paths]
+        for ts, frame in heapq.merge(*readers, key=pcap_frame_time):
+            payload = int_capture.udp_payload(frame, COLLECTOR_PORT)
+            if payload is None:
+                continue
+            if first_ts is None:
+                first_ts = ts
+            last_ts = ts
+            handle_report(payload, outputs, first_ts, now=ts)
+            reports += 1
+        skipped = sum(reader.skipped for reader in readers)
+
+    elapsed = time.perf_counter() - start
+    span = last_ts - first_ts if reports else 0.0
+    log.info("replayed %d reports from %d files in %0.2fs, %0.1fx real time (%d non ethernet frames skipped)",
+             reports, len(paths), elapsed, span / elapsed if elapsed else 0, skipped)
+
+
+def capture_scapy(iface, outputs, tic):
+    sniff(iface=iface,
+        prn=lambda x: handle_pkt(x, outputs, tic))
+
+
+# single process capture from the source the command line picked
+def capture(args, backend, outputs):
+    tic = time.perf_counter()
+
+    if args.pcap:
+        replay_pcaps(args.pcap, outputs)
+        return
+
+    if args.udp:
+        capture_udp(outputs, tic, batch=args.batch, rcvbuf=args.rcvbuf)
+        return
+
+    iface = get_if()
+    log.info("sniffing on %s", iface)
+
+    if backend == "ring":
+        try:
+            capture_ring(iface, outputs, tic)
+            return
+        except PermissionError:
+            if args.backend == "ring" or sniff is None:
+                raise
+            log.warning("cannot open an AF_PACKET ring, falling back to scapy")
+    capture_scapy(iface, outputs, tic)
+
+
 def main():
 
-    with open("s1_data.txt", "w") as s1, \
-         open("s2_data.txt", "w") as s2, \
-         open("s3_data.txt", "w") as s3, \
-         open("s4_data.txt", "w") as s4: 
-        
-        tic = time.perf_counter()
-        iface = get_if()
-        print("sniffing on %s" % iface)
-        sys.stdout.flush()
-        sniff(iface=iface,
-            prn=lambda x: handle_pkt(x, s1, s2, s3, s4, tic))
+    parser = argparse.ArgumentParser(description="INT report collector")
+    parser.add_argument("--backend", choices=["auto", "ring", "scapy"], default="auto",
+                        help="capture with an AF_PACKET TPACKET_V3 ring or with scapy sniff, "
+                             "auto uses the ring when the platform supports it")
+    parser.add_argument("--udp", action="store_true",
+                        help=f"receive the reports on a UDP socket bound to port {COLLECTOR_PORT} "
+                             "instead of capturing on eth0")
+    parser.add_argument("--batch", type=int, default=64,
+                        help="datagrams pulled per recvmmsg call in --udp mode")
+    parser.add_argument("--rcvbuf", type=int, default=None,
+                        help="SO_RCVBUF size in bytes for the --udp and --asyncio socket")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of --udp collector processes sharing the port with SO_REUSEPORT")
+    parser.add_argument("--spread", choices=["flow", "random"], default="flow",
+                        help="how the kernel spreads reports between workers, flow hashes the "
+                             "4-tuple so all reports of one sink switch land on one worker")
+    parser.add_argument("--asyncio", action="store_true",
+                        help=f"receive on UDP port {COLLECTOR_PORT} with an asyncio collector that "
+                             "decouples decoding from the output writers with bounded queues")
+    parser.add_argument("--queue-size", type=int, default=1 << 16,
+                        help="capacity of each --asyncio queue, reports or lines beyond it are dropped")
+    parser.add_argument("--pcap", nargs="+", metavar="FILE",
+                        help="decode the collector flow of pcap/pcapng files, e.g. from the pcaps "
+                             "directory, instead of capturing live. pick the captures of one link "
+                             "only, the same report seen on several interfaces is decoded every time")
+    parser.add_argument("--max-open-files", type=int, default=MAX_OPEN_OUTPUTS,
+                        help="per switch output files kept open at once")
+    parser.add_argument("--format", choices=["store", "text", "binary", "tsdb"], default=None,
+                        help=f"store records every field of every hop to {BINARY_OUTPUT_PATH} and "
+                             "exports the --record fields to s<id>_data.txt files on exit, text "
+                             "writes the first --record field to s<id>_data.txt as reports arrive, "
+                             "binary only records, for np.load/np.memmap, tsdb appends the --record "
+                             f"fields to the compressed per switch series of the {TSDB_PATH} "
+                             "directory, see int_tsdb.py. default store, text with --asyncio")
+    parser.add_argument("--record", nargs="+", metavar="FIELD", choices=HOP_FIELD_NAMES,
+                        default=[HOP_FIELD_NAMES[HOP_LATENCY_DATA]],
+                        help="hop fields written to the text outputs, several fields are exported "
+                             "to one directory per field. choices: " + ", ".join(HOP_FIELD_NAMES))
+    parser.add_argument("--export", metavar="FILE",
+                        help="export the --record fields of a capture recorded with --format "
+                             "store or binary and exit")
+    parser.add_argument("--summary-interval", type=float, default=SUMMARY_INTERVAL,
+                        help="seconds between the report loss, flow and quantile summaries, "
+                             "0 prints them only when the collector stops")
+    parser.add_argument("--flows", action="store_true",
+                        help=f"track the inner flows in a table written to {FLOW_OUTPUT_PATH} and the "
+                             f"reports per path to {PATH_OUTPUT_PATH} on exit, flows changing path "
+                             f"to {PATH_CHANGE_OUTPUT_PATH}. costs about 3us per report")
+    parser.add_argument("--flow-table-size", type=int, default=FLOW_TABLE_SIZE,
+                        help="inner flows tracked at once by --flows, the least recently seen one "
+                             "is evicted beyond it")
+    parser.add_argument("--flow-idle-timeout", type=float, default=FLOW_IDLE_TIMEOUT,
+                        help="seconds without a report after which a flow leaves the table")
+    parser.add_argument("--quantiles", action="store_true",
+                        help="keep per switch and per port latency and queue occupancy sketches, "
+                             f"their windowed quantiles are appended to {QUANTILE_OUTPUT_PATH} at "
+                             f"every summary and the whole run written to {SKETCH_OUTPUT_PATH} on "
+                             "exit. costs about 4us per report")
+    parser.add_argument("--quantile-window", type=float, default=QUANTILE_WINDOW,
+                        help="seconds of the sliding window of the --quantiles")
+    parser.add_argument("--bursts", action="store_true",
+                        help="detect microbursts on the queue occupancy of every egress port, "
+                             f"finished bursts are written to {BURST_OUTPUT_PATH}. costs up to 2us "
+                             "per report")
+    parser.add_argument("--burst-rise", type=int, default=BURST_RISE,
+                        help="queue occupancy at which a microburst of an egress port starts")
+    parser.add_argument("--burst-fall", type=int, default=BURST_FALL,
+                        help="queue occupancy at or below which a microburst ends")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve Prometheus metrics on this TCP port, --workers serve theirs "
+                             "on the following ports, one per worker, --decoders on the ports after it")
+    parser.add_argument("--profile", type=int, nargs="?", const=PROFILE_EVERY, default=None, metavar="N",
+                        help="time the decode stages of one report in N, default "
+                             f"{PROFILE_EVERY}, and print their latency histograms on exit or SIGUSR1")
+    parser.add_argument("--shed", choices=["flow", "switch"], default=None,
+                        help="shed load when the live input backs up: decode only 1 in --shed-every "
+                             "flows, or reports of every switch, and only count the reports from their "
+                             "headers if that is not enough. shed reports are counted per switch in the "
+                             "summaries, decoding resumes once the input drains. off by default")
+    parser.add_argument("--shed-every", type=int, default=SHED_EVERY, metavar="N",
+                        help="sampling interval of the sampled --shed level")
+    parser.add_argument("--shed-high", type=float, default=SHED_HIGH,
+                        help="input fill level, 0 to 1, above which --shed sheds more")
+    parser.add_argument("--shed-low", type=float, default=SHED_LOW,
+                        help="input fill level, 0 to 1, below which --shed sheds less")
+    parser.add_argument("--timestamps", choices=TIMESTAMP_MODES, default="anchored",
+                        help="time the hops by the egress tstamp of their switch, unwrapped per switch, "
+                             "starting at the arrival of the first report of the switch (anchored) or "
+                             "at 0 (switch), or by the arrival of their report at the collector "
+                             "(arrival). without hop tstamps in the instruction mask the report header "
+                             "tstamp of the sink switch is used")
+    parser.add_argument("--decoders", type=int, default=1,
+                        help="decode the reports of the collector UDP port in this many processes, fed by "
+                             "one capture process through a ring in shared memory, one ring per decoder")
+    parser.add_argument("--ring-slots", type=int, default=int_shm.SLOTS,
+                        help="reports each --decoders ring holds")
+    parser.add_argument("--ring-policy", choices=int_shm.POLICIES, default="drop",
+                        help="whether a full --decoders ring drops new reports or overwrites the oldest "
+                             "unread ones")
+    int_log.add_arguments(parser)
+    args = parser.parse_args()
+
+    output_format = args.format or ("text" if args.asyncio else "store")
+    if args.asyncio and output_format != "text":
+        parser.error(f"--format {output_format} is not supported with --asyncio")
+    if args.profile is not None and args.profile < 1:
+        parser.error("--profile takes a positive sampling interval")
+    if args.flow_table_size < 1:
+        parser.error("--flow-table-size takes a positive number of flows")
+    if args.quantile_window <= 0:
+        parser.error("--quantile-window takes a positive number of seconds")
+    if args.burst_fall >= args.burst_rise:
+        parser.error("--burst-fall must be below --burst-rise")
+    if args.shed_every < 1:
+        parser.error("--shed-every takes a positive sampling interval")
+    if not 0 <= args.shed_low < args.shed_high <= 1:
+        parser.error("--shed-low and --shed-high must satisfy 0 <= low < high <= 1")
+    if args.pcap and (args.workers > 1 or args.asyncio):
+        parser.error("--pcap cannot be combined with --workers or --asyncio")
+    if args.asyncio and args.workers > 1:
+        parser.error("--asyncio cannot be combined with --workers")
+    if args.decoders > 1 and (args.workers > 1 or args.asyncio or args.pcap):
+        parser.error("--decoders cannot be combined with --workers, --asyncio or --pcap")
+    if args.ring_slots < 1:
+        parser.error("--ring-slots takes a positive number of slots")
+    if output_format == "tsdb" and (args.workers > 1 or args.decoders > 1):
+        parser.error("--format tsdb cannot be combined with --workers or --decoders")
+    if output_format == "text" and len(args.record) > 1:
+        parser.error("--format text records a single field")
+    field = HOP_FIELD_NAMES.index(args.record[0])
+
+    statistics = functools.partial(report_statistics, args.summary_interval, flows=args.flows,
+                                   quantiles=args.quantiles, bursts=args.bursts,
+                                   flow_table_size=args.flow_table_size,
+                                   flow_idle_timeout=args.flow_idle_timeout,
+                                   quantile_window=args.quantile_window,
+                                   burst_rise=args.burst_rise, burst_fall=args.burst_fall,
+                                   shed=args.shed, shed_every=args.shed_every,
+                                   shed_high=args.shed_high, shed_low=args.shed_low,
+                                   timestamps=args.timestamps)
+    log_setup = functools.partial(report_logging, args.log_level, args.status_interval, args.dump_every)
+    status = log_setup()
+
+    if args.export:
+        export_projections(args.export, args.record, max_open=args.max_open_files)
+        return
+
+    if args.metrics_port is not None and args.workers == 1:
+        start_metrics(args.metrics_port)
+
+    if args.asyncio:
+        with profiling(args.profile), status:
+            capture_async(time.perf_counter(), args.queue_size, args.batch, rcvbuf=args.rcvbuf, field=field,
+                          statistics=statistics)
+        return
+
+    if args.decoders > 1:
+        run_decoders(args.decoders, time.perf_counter(), args.batch, args.rcvbuf, slots=args.ring_slots,
+                     policy=args.ring_policy, max_open=args.max_open_files, binary=output_format != "text",
+                     field=field, statistics=statistics, metrics_port=args.metrics_port,
+                     profile_every=args.profile, log_setup=log_setup)
+        if output_format == "store":
+            export_projections(BINARY_OUTPUT_PATH, args.record, max_open=args.max_open_files)
+        return
+
+    if args.workers > 1:
+        run_workers(args.workers, time.perf_counter(), args.batch, args.rcvbuf, args.spread,
+                    max_open=args.max_open_files, binary=output_format != "text", field=field,
+                    statistics=statistics, metrics_port=args.metrics_port, profile_every=args.profile,
+                    log_setup=log_setup)
+        if output_format == "store":
+            export_projections(BINARY_OUTPUT_PATH, args.record, max_open=args.max_open_files)
+        return
+
+    backend = args.backend
+    if backend == "auto":
+        backend = "ring" if hasattr(socket, "AF_PACKET") else "scapy"
+
+    if output_format == "text":
+        outputs = SwitchOutputs(max_open=args.max_open_files, field=field)
+    elif output_format == "tsdb":
+        outputs = TimeSeriesOutputs(fields=[HOP_FIELD_NAMES.index(f) for f in args.record])
+    else:
+        outputs = BinaryHopWriter()
+
+    # ctrl-c ends a live capture, the outputs still get closed and exported
+    with profiling(args.profile), outputs, statistics(), status:
+        try:
+            capture(args, backend, outputs)
+        except KeyboardInterrupt:
+            pass
+
+    if output_format == "store":
+        export_projections(BINARY_OUTPUT_PATH, args.record, max_open=args.max_open_files)
 
 
 if __name__ == '__main__':
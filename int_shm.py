@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# shared memory ring between the capture process and the decode processes of
+# int_receive.py --decoders
+#
+# one multiprocessing.shared_memory segment holds a single producer single
+# consumer ring per decoder. the capture process is the only writer of the
+# head and drop counter of every ring and each decoder the only writer of the
+# tail and overrun counter of its own ring, so no cursor is ever written by
+# two processes and no lock is taken. a slot is published by storing the head
+# after the slot itself, which relies on the stores of the producer becoming
+# visible in program order, as they do on x86.
+# decoders read the payloads as memoryviews straight into the segment, or
+# as copies with the overwrite policy, where the producer can reuse a slot
+# while it is being decoded
+import struct
+import time
+from multiprocessing import shared_memory
+
+MAGIC = b"INTR"
+# magic, rings, slots per ring, slot size, policy, closed
+SEGMENT_HEADER_STRUCT = struct.Struct("4sIIIII")
+CACHE_LINE = 64
+SEGMENT_HEADER_SIZE = CACHE_LINE
+CLOSED_OFFSET = SEGMENT_HEADER_STRUCT.size - 4
+
+# ring header, the producer and the consumer cursors on separate cache lines.
+# cursors are read and written through a memoryview cast to 64 bit words, a
+# single store, where struct.pack_into zeroes the field before packing it
+HEAD_OFFSET = 0
+DROPS_OFFSET = 8
+TAIL_OFFSET = CACHE_LINE
+OVERRUNS_OFFSET = CACHE_LINE + 8
+RING_HEADER_SIZE = 2 * CACHE_LINE
+
+# slot: sequence number, capture time, payload length, payload. the sequence
+# number is the slot position plus one once the slot holds that position
+SLOT_HEADER_STRUCT = struct.Struct("QdI4x")
+SLOT_HEADER_SIZE = SLOT_HEADER_STRUCT.size
+SLOT_SIZE = 1 << 11
+SLOTS = 1 << 12
+
+# a full ring drops the new payload or overwrites the oldest unread one
+POLICIES = ("drop", "overwrite")
+
+# consumers poll an empty ring, sleeping from IDLE_SLEEP up to IDLE_SLEEP_MAX
+IDLE_SLEEP = 50e-6
+IDLE_SLEEP_MAX = 1e-3
+
+
+class ShmRing:
+    # create() makes the segment in the capture process, attach() maps it in
+    # a decoder. the capture process put()s payloads into the ring of their
+    # decoder and publish()es them after every batch, decoder i iterates
+    # reader(i). slot_size is the largest payload, larger ones are dropped
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.view = shm.buf
+        self.words = self.view.cast("Q")
+        magic, self.rings, self.slots, self.slot_size, policy, _ = \
+            SEGMENT_HEADER_STRUCT.unpack_from(self.view, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{shm.name} is not an INT report ring")
+        self.overwrite = POLICIES[policy] == "overwrite"
+        self.slot_stride = SLOT_HEADER_SIZE + self.slot_size
+        self.ring_size = RING_HEADER_SIZE + self.slots * self.slot_stride
+        # producer side copies of the heads and of the tails last read
+        self.heads = [self.cursor(i, HEAD_OFFSET) for i in range(self.rings)]
+        self.tails = [self.cursor(i, TAIL_OFFSET) for i in range(self.rings)]
+        self.dropped = [self.cursor(i, DROPS_OFFSET) for i in range(self.rings)]
+        self.dirty = set()
+
+    @classmethod
+    def create(cls, rings, slots=SLOTS, slot_size=SLOT_SIZE, policy="drop"):
+        # slots stay aligned to the cursor words
+        slot_size = -(-slot_size // 8) * 8
+        size = SEGMENT_HEADER_SIZE + rings * (RING_HEADER_SIZE + slots * (SLOT_HEADER_SIZE + slot_size))
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        SEGMENT_HEADER_STRUCT.pack_into(shm.buf, 0, MAGIC, rings, slots, slot_size, POLICIES.index(policy), 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.view is None:
+            return
+        self.words.release()
+        self.view = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def ring_base(self, ring):
+        return SEGMENT_HEADER_SIZE + ring * self.ring_size
+
+    def cursor(self, ring, offset):
+        return self.words[(self.ring_base(ring) + offset) >> 3]
+
+    def set_cursor(self, ring, offset, value):
+        self.words[(self.ring_base(ring) + offset) >> 3] = value
+
+    # copies payload into the next slot of ring, returns False when it was
+    # dropped. the slot is only visible to the decoder after publish()
+    def put(self, ring, payload, now):
+        head = self.heads[ring]
+        n = len(payload)
+        if n > self.slot_size:
+            return self.drop(ring)
+        if head - self.tails[ring] >= self.slots and not self.overwrite:
+            self.tails[ring] = self.cursor(ring, TAIL_OFFSET)
+            if head - self.tails[ring] >= self.slots:
+                return self.drop(ring)
+        base = self.ring_base(ring) + RING_HEADER_SIZE + (head % self.slots) * self.slot_stride
+        view = self.view
+        if self.overwrite:
+            # a decoder still reading the old position sees the slot change
+            SLOT_HEADER_STRUCT.pack_into(view, base, 0, 0.0, 0)
+        view[base + SLOT_HEADER_SIZE : base + SLOT_HEADER_SIZE + n] = payload
+        SLOT_HEADER_STRUCT.pack_into(view, base, head + 1, now, n)
+        self.heads[ring] = head + 1
+        self.dirty.add(ring)
+        return True
+
+    def drop(self, ring):
+        self.dropped[ring] += 1
+        self.set_cursor(ring, DROPS_OFFSET, self.dropped[ring])
+        return False
+
+    # makes the slots put since the last publish visible to the decoders
+    def publish(self):
+        for ring in self.dirty:
+            self.set_cursor(ring, HEAD_OFFSET, self.heads[ring])
+        self.dirty.clear()
+
+    # tells the decoders to stop once they have read what was published
+    def finish(self):
+        self.publish()
+        struct.pack_into("I", self.view, CLOSED_OFFSET, 1)
+
+    def closed(self):
+        return struct.unpack_from("I", self.view, CLOSED_OFFSET)[0] != 0
+
+    # fraction of the slots of ring holding payloads its decoder has not read
+    def fill(self, ring):
+        used = self.cursor(ring, HEAD_OFFSET) - self.cursor(ring, TAIL_OFFSET)
+        return min(used, self.slots) / self.slots
+
+    def drops(self, ring):
+        return self.cursor(ring, DROPS_OFFSET)
+
+    def overruns(self, ring):
+        return self.cursor(ring, OVERRUNS_OFFSET)
+
+    # yields lists of up to batch (capture time, payload) pairs of ring, the
+    # payloads are memoryviews that are released when the next list is asked
+    # for. an empty list is yielded when nothing arrived for timeout seconds,
+    # the generator returns once the ring is finished and read.
+    # with the drop policy the payloads point straight into the segment. with
+    # overwrite they are copied out and the slot sequence number checked again
+    # after the copy, a slot the producer started to overwrite meanwhile is left
+    # out. a decoder lapped by an overwriting producer skips ahead half a ring,
+    # what it skipped and the slots overwritten under it count as overruns
+    def reader(self, ring, batch=64, timeout=1.0):
+        view = self.view
+        slots = self.slots
+        slots_base = self.ring_base(ring) + RING_HEADER_SIZE
+        tail = self.cursor(ring, TAIL_OFFSET)
+        overruns = self.cursor(ring, OVERRUNS_OFFSET)
+        sleep = IDLE_SLEEP
+        idle = 0.0
+
+        while True:
+            head = self.cursor(ring, HEAD_OFFSET)
+            if head == tail:
+                if self.closed() and self.cursor(ring, HEAD_OFFSET) == tail:
+                    return
+                if idle >= timeout:
+                    idle = 0.0
+                    yield []
+                time.sleep(sleep)
+                idle += sleep
+                sleep = min(sleep * 2, IDLE_SLEEP_MAX)
+                continue
+            sleep = IDLE_SLEEP
+            idle = 0.0
+
+            if head - tail > slots:
+                skip = head - tail - slots // 2
+                tail += skip
+                overruns += skip
+
+            end = min(head, tail + batch)
+            reports = []
+            for position in range(tail, end):
+                base = slots_base + (position % slots) * self.slot_stride
+                seq, now, n = SLOT_HEADER_STRUCT.unpack_from(view, base)
+                if seq != position + 1:
+                    overruns += 1
+                    continue
+                payload = view[base + SLOT_HEADER_SIZE : base + SLOT_HEADER_SIZE + n]
+                if self.overwrite:
+                    # the producer clears the sequence number before it
+                    # touches the payload, so an unchanged one means a whole copy
+                    copy = memoryview(bytes(payload))
+                    payload.release()
+                    payload = copy
+                    if SLOT_HEADER_STRUCT.unpack_from(view, base)[0] != position + 1:
+                        payload.release()
+                        overruns += 1
+                        continue
+                reports.append((now, payload))
+            try:
+                yield reports
+            finally:
+                for _, payload in reports:
+                    payload.release()
+            if self.overwrite:
+                self.set_cursor(ring, OVERRUNS_OFFSET, overruns)
+            tail = end
+            self.set_cursor(ring, TAIL_OFFSET, tail)
@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+# chunked time-series store for INT telemetry
+#
+# every (switch, metric) series is a file of zlib compressed chunks of up to
+# CHUNK_POINTS points next to an index file holding the time range, offset,
+# size and point count of each chunk. times, in TIME_UNIT ticks, and integer
+# values are stored as zigzag varint deltas from the previous point of the
+# chunk, so a range read only reads and decodes the chunks it overlaps.
+# appends go to a per series buffer, a chunk is only encoded once it is full.
+# writing a chunk also adds its points to the count, sum, min and max of the
+# ROLLUPS buckets of the series, kept in one file per resolution, which
+# int_query.py answers coarse queries from without reading the chunks.
+#
+# int_receive.py --format tsdb records the collector outputs into a store,
+#   python int_tsdb.py import DIR FILE...
+# converts the s<id>_data.txt outputs of earlier runs and
+#   python int_tsdb.py info DIR
+# lists the series of a store.
+import argparse
+import glob
+import os
+import re
+import struct
+import zlib
+
+# numpy makes the chunk encoding and decoding vectorized and is optional
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CHUNK_POINTS = 4096
+# seconds per time tick
+TIME_UNIT = 1e-6
+ZLIB_LEVEL = 6
+
+# rollup resolutions in seconds, multiples of TIME_UNIT
+ROLLUPS = (1.0, 10.0, 60.0)
+
+CHUNK_SUFFIX = ".tsc"
+INDEX_SUFFIX = ".tsi"
+ROLLUP_SUFFIX = ".tsr"
+SERIES_FORMAT = "s{}_{}"
+SERIES_RE = re.compile(r"s(\d+)_(\w+)" + re.escape(INDEX_SUFFIX) + "$")
+
+# index record per chunk: min tick, max tick, offset in the chunk file,
+# compressed size, points
+INDEX_STRUCT = struct.Struct("<qqQII")
+INDEX_DTYPE = None if np is None else np.dtype([("t_min", "<i8"), ("t_max", "<i8"), ("offset", "<u8"),
+                                                ("size", "<u4"), ("points", "<u4")])
+
+# rollup record per bucket: bucket, the start tick divided by the resolution
+# in ticks, count, sum, min, max. a bucket written by several chunks, when
+# points arrive late or a series is flushed mid-bucket, has several records
+ROLLUP_STRUCT = struct.Struct("<qqqqq")
+ROLLUP_FIELDS = 5
+
+# s<id>_data.txt file names of the collector text outputs
+TEXT_OUTPUT_RE = re.compile(r"s(\d+)_data\.txt$")
+
+
+# zigzag varints, small negative deltas stay short
+def encode_varints(values, out):
+    for v in values:
+        v = v << 1 if v >= 0 else ((-v) << 1) - 1
+        while v >= 0x80:
+            out.append((v & 0x7F) | 0x80)
+            v >>= 7
+        out.append(v)
+
+
+def decode_varints(data, count, pos=0):
+    values = []
+    for _ in range(count):
+        v = 0
+        shift = 0
+        while True:
+            b = data[pos]
+            pos += 1
+            v |= (b & 0x7F) << shift
+            if b < 0x80:
+                break
+            shift += 7
+        values.append((v >> 1) ^ -(v & 1))
+    return values, pos
+
+
+def deltas(values):
+    previous = 0
+    out = []
+    for v in values:
+        out.append(v - previous)
+        previous = v
+    return out
+
+
+def running_sums(values):
+    total = 0
+    out = []
+    for v in values:
+        total += v
+        out.append(total)
+    return out
+
+
+# int64 array to zigzag varints, the bytes of every varint are written one
+# position at a time across all values at once
+def np_encode_varints(values):
+    zz = ((values << 1) ^ (values >> 63)).view(np.uint64)
+    lengths = np.ones(len(zz), np.int64)
+    for k in range(1, 10):
+        lengths += zz >= np.uint64(1 << (7 * k))
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    out = np.empty(int(ends[-1]) if len(ends) else 0, np.uint8)
+    for k in range(int(lengths.max()) if len(lengths) else 0):
+        sel = lengths > k
+        byte = (zz[sel] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        byte |= (lengths[sel] > k + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[sel] + k] = byte
+    return out
+
+
+# the first count zigzag varints of data as an int64 array
+def np_decode_varints(data, count):
+    if not count:
+        return np.zeros(0, np.int64)
+    b = np.frombuffer(data, np.uint8)
+    ends = np.flatnonzero(b < 0x80)[:count]
+    if len(ends) < count:
+        raise ValueError("truncated varint stream")
+    b = b[: ends[-1] + 1]
+    starts = np.empty(count, np.int64)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    shifts = (np.arange(len(b)) - np.repeat(starts, ends - starts + 1)) * 7
+    # the 7 bit groups of one varint never overlap, so adding them ors them
+    zz = np.add.reduceat((b & 0x7F).astype(np.uint64) << shifts.astype(np.uint64), starts)
+    return (zz >> np.uint64(1)).view(np.int64) ^ -(zz & np.uint64(1)).view(np.int64)
+
+
+# compressed chunk of ticks and values, deltas of the ticks then of the values
+def encode_chunk(ticks, values, level=ZLIB_LEVEL):
+    if np is not None:
+        ticks = np.asarray(ticks, np.int64)
+        values = np.asarray(values, np.int64)
+        data = np.concatenate((np_encode_varints(np.diff(ticks, prepend=0)),
+                               np_encode_varints(np.diff(values, prepend=0))))
+        return zlib.compress(data.tobytes(), level)
+    data = bytearray()
+    encode_varints(deltas(ticks), data)
+    encode_varints(deltas(values), data)
+    return zlib.compress(data, level)
+
+
+def decode_chunk(blob, points):
+    data = zlib.decompress(blob)
+    if np is not None:
+        both = np_decode_varints(data, 2 * points)
+        return np.cumsum(both[:points]), np.cumsum(both[points:])
+    tick_deltas, pos = decode_varints(data, points)
+    value_deltas, _ = decode_varints(data, points, pos)
+    return running_sums(tick_deltas), running_sums(value_deltas)
+
+
+# [bucket, count, sum, min, max] rows of the points per bucket of resolution
+# ticks, sorted by bucket
+def aggregate(ticks, values, resolution):
+    if np is not None:
+        buckets = ticks // resolution
+        order = np.argsort(buckets, kind="stable")
+        buckets = buckets[order]
+        values = np.asarray(values, np.int64)[order]
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        return np.column_stack((buckets[starts], np.diff(np.r_[starts, len(buckets)]),
+                                np.add.reduceat(values, starts), np.minimum.reduceat(values, starts),
+                                np.maximum.reduceat(values, starts))).tolist()
+    rows = {}
+    for t, v in zip(ticks, values):
+        row = rows.get(t // resolution)
+        if row is None:
+            rows[t // resolution] = [t // resolution, 1, v, v, v]
+        else:
+            row[1] += 1
+            row[2] += v
+            row[3] = min(row[3], v)
+            row[4] = max(row[4], v)
+    return [rows[bucket] for bucket in sorted(rows)]
+
+
+class Series:
+    # the append buffer of one series of a TimeSeriesStore. append() is the
+    # collector hot path, two list appends until the chunk is full.
+    # the newest rollup bucket of every resolution is kept pending until a
+    # chunk with later points shows up, so buckets spanning chunks are
+    # usually written once. the rollups of a series being written therefore
+    # cover its chunks up to the start of their newest bucket
+    __slots__ = ("store", "path", "times", "values", "offset", "pending")
+
+    def __init__(self, store, path):
+        self.store = store
+        self.path = path
+        self.times = []
+        self.values = []
+        chunk_path = path + CHUNK_SUFFIX
+        self.offset = os.path.getsize(chunk_path) if os.path.exists(chunk_path) else 0
+        self.pending = dict.fromkeys(store.rollups)
+
+    def append(self, t, value):
+        self.times.append(t)
+        self.values.append(value)
+        if len(self.times) >= self.store.chunk_points:
+            self.write_chunk()
+
+    # writes the buffered points and the pending rollup buckets
+    def flush(self):
+        self.write_chunk()
+        for resolution, row in self.pending.items():
+            if row is not None:
+                self.write_rollup(resolution, [row])
+                self.pending[resolution] = None
+
+    def write_rollup(self, resolution, rows):
+        with open(self.store.rollup_path(self.path, resolution), "ab") as f:
+            f.write(b"".join(ROLLUP_STRUCT.pack(*row) for row in rows))
+
+    # encodes the buffered points into a chunk, appended to the chunk file
+    # before its index record so readers never see a record without its chunk
+    def write_chunk(self):
+        if not self.times:
+            return
+        unit = self.store.time_unit
+        if np is not None:
+            ticks = np.rint(np.asarray(self.times) / unit).astype(np.int64)
+            t_min, t_max = int(ticks.min()), int(ticks.max())
+        else:
+            ticks = [round(t / unit) for t in self.times]
+            t_min, t_max = min(ticks), max(ticks)
+        blob = encode_chunk(ticks, self.values, self.store.level)
+        with open(self.path + CHUNK_SUFFIX, "ab") as f:
+            f.write(blob)
+        with open(self.path + INDEX_SUFFIX, "ab") as f:
+            f.write(INDEX_STRUCT.pack(t_min, t_max, self.offset, len(blob), len(self.times)))
+        self.offset += len(blob)
+
+        for resolution, pending in self.pending.items():
+            rows = aggregate(ticks, self.values, self.store.rollups[resolution])
+            if pending is not None:
+                for row in rows:
+                    if row[0] == pending[0]:
+                        row[1] += pending[1]
+                        row[2] += pending[2]
+                        row[3] = min(row[3], pending[3])
+                        row[4] = max(row[4], pending[4])
+                        break
+                else:
+                    rows.append(pending)
+                    rows.sort()
+            self.pending[resolution] = rows.pop()
+            if rows:
+                self.write_rollup(resolution, rows)
+
+        self.times = []
+        self.values = []
+
+
+class TimeSeriesStore:
+    # a directory of series files, one pair per (sw_id, metric). a store can
+    # be appended to by one writer and read at the same time, points still in
+    # the append buffers of the writer are not visible until they are flushed
+    def __init__(self, root, chunk_points=CHUNK_POINTS, level=ZLIB_LEVEL, time_unit=TIME_UNIT, rollups=ROLLUPS):
+        self.root = root
+        self.chunk_points = chunk_points
+        self.level = level
+        self.time_unit = time_unit
+        # rollup resolution in seconds to resolution in ticks
+        self.rollups = {resolution: round(resolution / time_unit) for resolution in rollups}
+        self.open_series = {}
+        os.makedirs(root, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def path(self, sw_id, metric):
+        return os.path.join(self.root, SERIES_FORMAT.format(sw_id, metric))
+
+    def rollup_path(self, path, resolution):
+        return f"{path}.{resolution:g}s{ROLLUP_SUFFIX}"
+
+    # the append buffer of a series, for appending without a lookup per point
+    def series(self, sw_id, metric):
+        series = self.open_series.get((sw_id, metric))
+        if series is None:
+            series = self.open_series[(sw_id, metric)] = Series(self, self.path(sw_id, metric))
+        return series
+
+    def append(self, sw_id, metric, t, value):
+        self.series(sw_id, metric).append(t, value)
+
+    def flush(self):
+        for series in self.open_series.values():
+            series.flush()
+
+    def close(self):
+        self.flush()
+        self.open_series.clear()
+
+    # (sw_id, metric) of every series in the store
+    def keys(self):
+        keys = []
+        for path in glob.glob(os.path.join(glob.escape(self.root), "*" + INDEX_SUFFIX)):
+            match = SERIES_RE.match(os.path.basename(path))
+            if match:
+                keys.append((int(match.group(1)), match.group(2)))
+        return sorted(keys)
+
+    # the index records of a series, a numpy record array or a list of tuples
+    def index(self, sw_id, metric):
+        try:
+            with open(self.path(sw_id, metric) + INDEX_SUFFIX, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            raise KeyError((sw_id, metric)) from None
+        # a record still being appended is left out
+        data = data[: len(data) - len(data) % INDEX_STRUCT.size]
+        if np is not None:
+            return np.frombuffer(data, INDEX_DTYPE)
+        return list(INDEX_STRUCT.iter_unpack(data))
+
+    def has_rollup(self, sw_id, metric, resolution):
+        return os.path.exists(self.rollup_path(self.path(sw_id, metric), resolution))
+
+    # the rollup records of a series at resolution seconds, an int64 array of
+    # ROLLUP_FIELDS columns or a list of tuples
+    def rollup(self, sw_id, metric, resolution):
+        try:
+            with open(self.rollup_path(self.path(sw_id, metric), resolution), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            raise KeyError((sw_id, metric, resolution)) from None
+        data = data[: len(data) - len(data) % ROLLUP_STRUCT.size]
+        if np is not None:
+            return np.frombuffer(data, "<i8").reshape(-1, ROLLUP_FIELDS)
+        return list(ROLLUP_STRUCT.iter_unpack(data))
+
+    # times in seconds and values of the points of a series in [start, end),
+    # float64 and int64 arrays with numpy, lists without. only the chunks
+    # whose time range overlaps the range are read
+    def read(self, sw_id, metric, start=None, end=None):
+        unit = self.time_unit
+        ticks, values = self.read_ticks(sw_id, metric, None if start is None else round(start / unit),
+                                        None if end is None else round(end / unit))
+        if np is not None:
+            return ticks * unit, values
+        return [t * unit for t in ticks], values
+
+    # read() with the times and the range in ticks
+    def read_ticks(self, sw_id, metric, start_tick=None, end_tick=None):
+        index = self.index(sw_id, metric)
+
+        if np is not None:
+            sel = np.ones(len(index), bool)
+            if start_tick is not None:
+                sel &= index["t_max"] >= start_tick
+            if end_tick is not None:
+                sel &= index["t_min"] < end_tick
+            chunks = index[sel].tolist()
+        else:
+            chunks = [c for c in index
+                      if (start_tick is None or c[1] >= start_tick) and (end_tick is None or c[0] < end_tick)]
+
+        ticks = []
+        values = []
+        with open(self.path(sw_id, metric) + CHUNK_SUFFIX, "rb") as f:
+            for _, _, offset, size, points in chunks:
+                f.seek(offset)
+                chunk_ticks, chunk_values = decode_chunk(f.read(size), points)
+                ticks.append(chunk_ticks)
+                values.append(chunk_values)
+
+        if np is not None:
+            ticks = np.concatenate(ticks) if ticks else np.zeros(0, np.int64)
+            values = np.concatenate(values) if values else np.zeros(0, np.int64)
+            keep = np.ones(len(ticks), bool)
+            if start_tick is not None:
+                keep &= ticks >= start_tick
+            if end_tick is not None:
+                keep &= ticks < end_tick
+            ticks, values = ticks[keep], values[keep]
+            # chunks of later runs or late points can overlap earlier ones
+            if len(ticks) > 1 and (np.diff(ticks) < 0).any():
+                order = np.argsort(ticks, kind="stable")
+                ticks, values = ticks[order], values[order]
+            return ticks, values
+
+        points = [(t, v) for chunk_ticks, chunk_values in zip(ticks, values)
+                  for t, v in zip(chunk_ticks, chunk_values)
+                  if (start_tick is None or t >= start_tick) and (end_tick is None or t < end_tick)]
+        points.sort(key=lambda point: point[0])
+        return [t for t, _ in points], [v for _, v in points]
+
+
+# appends the points of a collector text output, lines of "time, value"
+def import_text(store, sw_id, metric, path):
+    series = store.series(sw_id, metric)
+    points = 0
+    with open(path) as f:
+        for line in f:
+            t, _, value = line.partition(",")
+            if not value:
+                continue
+            series.append(float(t), int(float(value)))
+            points += 1
+    series.flush()
+    return points
+
+
+def print_info(store):
+    for sw_id, metric in store.keys():
+        index = store.index(sw_id, metric)
+        if not len(index):
+            continue
+        if np is not None:
+            points = int(index["points"].sum())
+            size = int(index["size"].sum())
+            t_min, t_max = int(index["t_min"].min()), int(index["t_max"].max())
+        else:
+            points = sum(c[4] for c in index)
+            size = sum(c[3] for c in index)
+            t_min, t_max = min(c[0] for c in index), max(c[1] for c in index)
+        print(f"switch {sw_id} {metric}: {points} points in {len(index)} chunks, {size} bytes "
+              f"({size / points:0.2f} bytes per point), "
+              f"{t_min * store.time_unit:0.4f}s to {t_max * store.time_unit:0.4f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="INT time-series store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import", help="append collector s<id>_data.txt outputs to a store")
+    importer.add_argument("root", help="store directory")
+    importer.add_argument("files", nargs="+", help="s<id>_data.txt files, the switch comes from the name")
+    importer.add_argument("--metric", default="hop_latency", help="metric the files hold")
+    info = commands.add_parser("info", help="list the series of a store")
+    info.add_argument("root", help="store directory")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        with TimeSeriesStore(args.root) as store:
+            for path in args.files:
+                match = TEXT_OUTPUT_RE.search(os.path.basename(path))
+                if not match:
+                    parser.error(f"{path} is not named s<id>_data.txt")
+                points = import_text(store, int(match.group(1)), args.metric, path)
+                print(f"imported {points} points from {path}")
+    else:
+        print_info(TimeSeriesStore(args.root))
+
+
+if __name__ == "__main__":
+    main()
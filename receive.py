@@ -1,41 +1,48 @@
 #!/usr/bin/env python3
 import sys
-import struct
-import os
+import argparse
+import logging
 
-from scapy.all import sniff, sendp, hexdump, get_if_list, get_if_hwaddr
-from scapy.all import Packet, IPOption
-from scapy.all import ShortField, IntField, LongField, BitField, FieldListField, FieldLenField
-from scapy.all import IP, TCP, UDP, Raw
-from scapy.layers.inet import _IPOption_HDR
+from scapy.all import sniff, get_if_list, UDP
+
+import int_log
+
+log = logging.getLogger("receive")
 
 
 def get_if():
-    ifs = get_if_list()
     iface = None
     for i in get_if_list():
         if "eth0" in i:
             iface = i
             break
     if not iface:
-        print("Cannot find eth0 interface")
+        log.error("Cannot find eth0 interface")
         exit(1)
     return iface
 
 
-def handle_pkt(pkt):
+# packets are counted for the status line, dumps picks the ones shown
+def handle_pkt(pkt, status, dumps):
     if UDP in pkt and pkt[UDP].dport == 8002:
-        print("got a packet")
-        pkt.show2()
-        sys.stdout.flush()
+        status.packets += 1
+        if dumps is not None and dumps.sample():
+            pkt.show2()
+            sys.stdout.flush()
 
 
 def main():
+    parser = argparse.ArgumentParser(description="prints the INT reports sniffed on eth0")
+    int_log.add_arguments(parser, dump_every=1000)
+    args = parser.parse_args()
+    int_log.setup(args.log_level)
+    dumps = int_log.Sampler(args.dump_every) if args.dump_every else None
+
     iface = get_if()
-    print("sniffing on %s" % iface)
-    sys.stdout.flush()
-    sniff(iface=iface,
-          prn=lambda x: handle_pkt(x))
+    log.info("sniffing on %s", iface)
+    with int_log.StatusLine(log, args.status_interval) as status:
+        sniff(iface=iface,
+              prn=lambda x: handle_pkt(x, status, dumps))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# python -m unittest test_int_capture
+import os
+import struct
+import tempfile
+import unittest
+
+import int_bench
+import int_capture
+
+PORT = int_bench.COLLECTOR_PORT
+
+
+def pcapng_block(block_type, body):
+    body += b"\0" * (-len(body) % 4)
+    length = 12 + len(body)
+    return struct.pack("<II", block_type, length) + body + struct.pack("<I", length)
+
+
+class UdpPayloadTest(unittest.TestCase):
+    def test_report_frame(self):
+        report = int_bench.synth_report()
+        frame = int_bench.synth_frame(report)
+        self.assertEqual(bytes(int_capture.udp_payload(memoryview(frame), PORT)), report)
+
+    def test_malformed_frames(self):
+        frame = bytearray(int_bench.synth_frame(int_bench.synth_report()))
+        ip = int_capture.ETH_HDR_SIZE
+        long_ihl = bytearray(frame)
+        long_ihl[ip] = 0x4F
+        bad_version = bytearray(frame)
+        bad_version[ip] = 0x65
+        short_ihl = bytearray(frame)
+        short_ihl[ip] = 0x44
+        for bad in (long_ihl[:50], bad_version, short_ihl):
+            self.assertIsNone(int_capture.udp_payload(memoryview(bytes(bad)), PORT))
+
+
+class PcapngTest(unittest.TestCase):
+    def test_simple_packet_blocks(self):
+        frame = int_bench.synth_frame(int_bench.synth_report())
+        snaplen = len(frame) - 3
+        data = pcapng_block(int_capture.PCAPNG_SHB, struct.pack("<IHHq", int_capture.PCAPNG_BYTE_ORDER_MAGIC,
+                                                                 1, 0, -1))
+        data += pcapng_block(int_capture.PCAPNG_IDB, struct.pack("<HHI", int_capture.LINKTYPE_ETHERNET, 0,
+                                                                 snaplen))
+        ticks = 5_000_000
+        data += pcapng_block(int_capture.PCAPNG_EPB, struct.pack("<IIIII", 0, ticks >> 32, ticks & 0xFFFFFFFF,
+                                                                 snaplen, len(frame)) + frame[:snaplen])
+        data += pcapng_block(int_capture.PCAPNG_SPB, struct.pack("<I", len(frame)) + frame[:snaplen])
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "capture.pcapng")
+            with open(path, "wb") as f:
+                f.write(data)
+            with int_capture.PcapFileReader(path) as reader:
+                packets = [(ts, bytes(frame)) for ts, frame in reader]
+        self.assertEqual(packets, [(5.0, frame[:snaplen]), (5.0, frame[:snaplen])])
+
+    def test_unknown_interface(self):
+        frame = int_bench.synth_frame(int_bench.synth_report())
+        data = pcapng_block(int_capture.PCAPNG_SHB, struct.pack("<IHHq", int_capture.PCAPNG_BYTE_ORDER_MAGIC,
+                                                                 1, 0, -1))
+        data += pcapng_block(int_capture.PCAPNG_IDB, struct.pack("<HHI", int_capture.LINKTYPE_ETHERNET, 0, 0))
+        offset = len(data)
+        data += pcapng_block(int_capture.PCAPNG_EPB, struct.pack("<IIIII", 1, 0, 0, len(frame), len(frame))
+                             + frame)
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "capture.pcapng")
+            with open(path, "wb") as f:
+                f.write(data)
+            with int_capture.PcapFileReader(path) as reader:
+                with self.assertRaisesRegex(ValueError, f"interface 1 at offset {offset}"):
+                    list(reader)
+
+
+if __name__ == "__main__":
+    unittest.main()
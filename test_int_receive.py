@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# python -m unittest test_int_receive
+import os
+import struct
+import tempfile
+import unittest
+
+import int_bench
+import int_receive
+
+
+class SeqAccountingTest(unittest.TestCase):
+    def account(self, seqs):
+        accounting = int_receive.SeqAccounting()
+        for seq_no in seqs:
+            accounting.count(1, seq_no)
+        return accounting.switches[1]
+
+    def test_gap_filled_late_is_reordered(self):
+        state = self.account([1, 2, 4, 3, 5])
+        self.assertEqual((state.received, state.lost, state.reordered, state.late), (5, 0, 1, 0))
+
+    def test_gap_is_lost(self):
+        state = self.account([1, 2, 5])
+        self.assertEqual((state.received, state.lost, state.reordered), (3, 2, 0))
+
+    def test_out_of_order_start_is_late(self):
+        # seq 0 was below the first seq_no seen, it was never counted lost
+        state = self.account([1, 0])
+        self.assertEqual((state.received, state.lost, state.reordered, state.late), (2, 0, 0, 1))
+        state = self.account([5, 3, 6, 4, 7])
+        self.assertEqual((state.received, state.lost, state.reordered, state.late), (5, 0, 0, 2))
+
+    def test_out_of_order_start_then_gap(self):
+        state = self.account([3, 2, 5, 4])
+        self.assertEqual((state.received, state.lost, state.reordered, state.late), (4, 0, 1, 1))
+
+    def test_duplicate(self):
+        state = self.account([1, 2, 2])
+        self.assertEqual((state.received, state.lost, state.duplicates), (3, 0, 1))
+
+    def test_summary_loss_is_not_negative(self):
+        accounting = int_receive.SeqAccounting()
+        for seq_no in (1, 0):
+            accounting.count(1, seq_no)
+        self.assertIn("lost 0 (0.000%)", accounting.summary())
+
+
+def observed_report(src_port=1, **fields):
+    hop = [0] * len(int_receive.HOP_FIELD_NAMES)
+    hop[int_receive.SWITCH_ID_DATA] = 1
+    for name, value in fields.items():
+        hop[int_receive.HOP_FIELD_NAMES.index(name)] = value
+    return int_receive.IntReport(1, 0, 0, 17, 1, 2, src_port, 8001, 0, 0, 0, 0, [tuple(hop)])
+
+
+class FlowTableTest(unittest.TestCase):
+    def flow_table(self, max_flows=2, idle_timeout=10.0):
+        return int_receive.FlowTable(max_flows, idle_timeout, output_path=None, path_output_path=None,
+                                     path_change_output_path=None)
+
+    def test_least_recently_seen_flow_is_evicted(self):
+        table = self.flow_table()
+        for now, port in enumerate((1, 2, 1, 3)):
+            table(observed_report(port, hop_latency=10), float(now))
+        self.assertEqual([key[3] for key in table.flows], [1, 3])
+        self.assertEqual((table.evicted, table.expired), (1, 0))
+        self.assertEqual(table.flows[int_receive.flow_key(observed_report(1))].reports, 2)
+
+    def test_idle_flows_expire(self):
+        table = self.flow_table(max_flows=8)
+        table(observed_report(1), 0.0)
+        table(observed_report(2), 5.0)
+        table(observed_report(3), 12.0)
+        self.assertEqual([key[3] for key in table.flows], [2, 3])
+        self.assertEqual((table.evicted, table.expired), (0, 1))
+
+    def test_path_change(self):
+        table = self.flow_table()
+        table(observed_report(1, egress_port_id=1), 0.0)
+        table(observed_report(1, egress_port_id=2), 1.0)
+        table(observed_report(1, egress_port_id=2), 2.0)
+        self.assertEqual((table.path_changes, len(table.paths)), (1, 2))
+
+
+class TimelineTest(unittest.TestCase):
+    def test_wraparound(self):
+        timeline = int_receive.Timeline(int_receive.TSTAMP_MODULO - 10, 1.0)
+        self.assertEqual(timeline.seconds(5), 15.0)
+        # steps below half the counter range keep moving it forward across wraps
+        step = int_receive.TSTAMP_MODULO // 4 - 1
+        for n in range(1, 10):
+            self.assertEqual(timeline.seconds((5 + n * step) & int_receive.TSTAMP_MASK), 15.0 + n * step)
+
+    def test_late_value_does_not_move_the_timeline(self):
+        timeline = int_receive.Timeline(int_receive.TSTAMP_MODULO - 10, 1.0)
+        self.assertEqual(timeline.seconds(5), 15.0)
+        # from before the first value, across the wrap
+        self.assertEqual(timeline.seconds(int_receive.TSTAMP_MODULO - 12), -2.0)
+        self.assertEqual(timeline.seconds(3), 13.0)
+        self.assertEqual(timeline.seconds(6), 16.0)
+
+    def test_long_gap_follows_the_arrival_time(self):
+        unit = int_receive.HOP_TSTAMP_UNIT
+        timeline = int_receive.Timeline(1000, unit, origin=2.0)
+        self.assertEqual(timeline.seconds(2000, 2.0), 2.0 + 1000 * unit)
+        # several wraps of the counter later, the raw value alone is ambiguous
+        ticks = 3 * int_receive.TSTAMP_MODULO + 500
+        self.assertAlmostEqual(timeline.seconds((1000 + ticks) & int_receive.TSTAMP_MASK, 2.0 + ticks * unit),
+                               2.0 + ticks * unit)
+
+
+class ListOutput:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, line):
+        self.lines.append(line)
+
+    def close(self):
+        pass
+
+
+class DecodeTest(unittest.TestCase):
+    def test_truncated_tcp_report_is_malformed(self):
+        report = int_bench.synth_report(tcp=True)
+        for n in range(int_receive.INNER_L4_OFFSET, int_receive.TCP_DATA_OFFSET_IDX + 1):
+            with self.assertRaises((struct.error, ValueError)):
+                int_receive.decode_int_report(memoryview(report[:n]))
+
+    def test_mixed_contiguous_buffer(self):
+        udp = [int_bench.synth_report(seq_no=i) for i in range(3)]
+        tcp = int_bench.synth_report(tcp=True, seq_no=3)
+        for reports in ([tcp] + udp, udp[:1] + [tcp] + udp[1:], udp + [int_bench.synth_report(num_hops=2)]):
+            batch = int_receive.decode_int_reports_batch(b"".join(reports))
+            seqs = dict(zip(batch.index.tolist(), batch.columns["seq_no"].tolist()))
+            seqs.update((i, report.seq_no) for i, report in batch.fallback)
+            self.assertEqual([seqs.get(i) for i in range(len(reports))],
+                             [int_receive.decode_int_report(memoryview(report)).seq_no for report in reports])
+            self.assertEqual(batch.errors, 0)
+        with self.assertRaises(ValueError):
+            int_receive.decode_int_reports_batch(b"".join(udp)[:-1])
+
+    def test_missing_field_is_not_written(self):
+        output = ListOutput()
+        outputs = int_receive.SwitchOutputs(open_output=lambda path, mode: output)
+        hop = [0] * len(int_receive.HOP_FIELD_NAMES)
+        hop[int_receive.SWITCH_ID_DATA] = 1
+        hop[int_receive.HOP_LATENCY_DATA] = None
+        outputs.write_hop(1.0, hop)
+        hop[int_receive.HOP_LATENCY_DATA] = 7
+        outputs.write_hop(2.0, hop)
+        self.assertEqual(output.lines, ["2.0000, 7\n"])
+
+
+class BinaryHopWriterTest(unittest.TestCase):
+    def test_missing_fields_are_marked_invalid(self):
+        hop = list(range(1, len(int_receive.HOP_FIELD_NAMES) + 1))
+        partial = list(hop)
+        partial[int_receive.HOP_LATENCY_DATA] = None
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "hops.npy")
+            with int_receive.BinaryHopWriter(path) as writer:
+                writer.write_hop(1.0, hop)
+                writer.write_hop(2.0, partial)
+            with int_receive.HopRecordStore(path) as store:
+                hops = [int_receive.record_hop(record) for record in store.records()]
+        self.assertEqual(hops, [(1.0, hop), (2.0, partial)])
+
+    def test_plan_record_matches_partial_record(self):
+        report = int_bench.synth_report(instruction_mask=0xCC00)
+        payload = memoryview(report)
+        _, plan, num_transits, payload_idx = int_receive.decode_int_headers(payload)
+        hops, _ = int_receive.parse_int_data(plan, num_transits, payload, payload_idx)
+        with tempfile.TemporaryDirectory() as root:
+            records = []
+            for use_plan in (plan, None):
+                path = os.path.join(root, "hops.npy")
+                with int_receive.BinaryHopWriter(path) as writer:
+                    for hop in hops:
+                        writer.write_hop(1.0, hop, use_plan)
+                with int_receive.HopRecordStore(path) as store:
+                    records.append([int_receive.record_hop(record) for record in store.records()])
+        self.assertEqual(records[0], records[1])
+        self.assertEqual([hop for _, hop in records[0]], [list(hop) for hop in hops])
+
+    def test_export_skips_missing_fields(self):
+        hop = [0] * len(int_receive.HOP_FIELD_NAMES)
+        hop[int_receive.SWITCH_ID_DATA] = 1
+        hop[int_receive.HOP_LATENCY_DATA] = 300
+        partial = list(hop)
+        partial[int_receive.HOP_LATENCY_DATA] = None
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "hops.npy")
+            with int_receive.BinaryHopWriter(path) as writer:
+                writer.write_hop(1.0, hop)
+                writer.write_hop(2.0, partial)
+            path_format = os.path.join(root, int_receive.OUTPUT_PATH_FORMAT)
+            with int_receive.HopRecordStore(path) as store:
+                store.export_text(["hop_latency"], [path_format])
+            with open(path_format.format(1)) as f:
+                self.assertEqual(f.read(), "1.0000, 300\n")
+
+
+class LogHistogramTest(unittest.TestCase):
+    def test_quantiles_within_bucket_error(self):
+        histogram = int_receive.LogHistogram()
+        for value in range(1, 10001):
+            histogram.record(value)
+        self.assertEqual((histogram.count, histogram.max), (10000, 10000))
+        for value, exact in zip(histogram.quantiles(), (5000, 9900, 9990)):
+            self.assertAlmostEqual(value / exact, 1, delta=2 ** -int_receive.HISTOGRAM_SUB_BITS)
+
+    def test_small_values_are_exact(self):
+        histogram = int_receive.LogHistogram()
+        for value in (0, 1, 2, 3, 40):
+            histogram.record(value)
+        self.assertEqual(histogram.quantiles((0.2, 0.6, 1.0)), [0, 2, 40])
+
+    def test_merge_matches_one_stream(self):
+        whole, low, high = int_receive.LogHistogram(), int_receive.LogHistogram(), int_receive.LogHistogram()
+        for value in range(0, 100000, 7):
+            whole.record(value)
+            (low if value % 2 else high).record(value)
+        low.merge(high)
+        self.assertEqual((low.counts, low.count, low.max), (whole.counts, whole.count, whole.max))
+        self.assertEqual(low.quantiles(), whole.quantiles())
+
+    def test_text_round_trip(self):
+        histogram = int_receive.LogHistogram()
+        for value in (5, 500, 50000, 50000):
+            histogram.record(value)
+        copy = int_receive.LogHistogram.from_text(histogram.to_text())
+        self.assertEqual((copy.counts, copy.count, copy.max), (histogram.counts, histogram.count, histogram.max))
+
+    def test_window_keeps_the_last_slots(self):
+        windowed = int_receive.WindowedHistogram(2)
+        for slot_id, value in ((0, 1), (1, 2), (2, 3), (0, 4)):
+            windowed.record(slot_id, int_receive.histogram_bucket(value), value)
+        window = windowed.window(2, int_receive.LogHistogram())
+        self.assertEqual((window.count, window.max), (2, 3))
+        total = windowed.total(int_receive.LogHistogram())
+        self.assertEqual((total.count, total.max), (4, 4))
+
+
+class HopSketchesTest(unittest.TestCase):
+    def test_switch_wide_sketch_merges_the_ports(self):
+        sketches = int_receive.HopSketches(output_path=None, sketch_path=None)
+        hop = [0] * len(int_receive.HOP_FIELD_NAMES)
+        hop[int_receive.SWITCH_ID_DATA] = 1
+        report = int_receive.IntReport(1, 0, 0, 17, 0, 0, 0, 0, 0, 0, 0, 0, [])
+        for port, latency in ((1, 100), (2, 200), (2, 300)):
+            hop[int_receive.EGRESS_PORT_ID_DATA] = port
+            hop[int_receive.HOP_LATENCY_DATA] = latency
+            report.hops = [tuple(hop)]
+            sketches(report, 0.0)
+        windows = {(sw_id, port, metric): (histogram.count, histogram.max)
+                   for _, sw_id, port, metric, histogram in sketches.windows()}
+        self.assertEqual(windows[(1, None, "hop_latency")], (3, 300))
+        self.assertEqual(windows[(1, 1, "hop_latency")], (1, 100))
+        self.assertEqual(windows[(1, 2, "hop_latency")], (2, 300))
+
+
+class BurstDetectorTest(unittest.TestCase):
+    def detect(self, samples, rise=20, fall=5):
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "bursts.txt")
+            detector = int_receive.BurstDetector(rise, fall, path)
+            for now, (port, q_occupancy) in enumerate(samples):
+                detector(observed_report(egress_port_id=port, q_occupancy=q_occupancy), float(now))
+            finished, active = detector.finished, len(detector.active)
+            detector.close()
+            with open(path) as f:
+                lines = f.read().splitlines()[1:]
+        return finished, active, [line.split(", ") for line in lines]
+
+    def test_rise_and_fall(self):
+        finished, active, bursts = self.detect([(1, 10), (1, 20), (1, 30), (1, 10), (1, 5), (1, 30)])
+        self.assertEqual((finished, active), (1, 1))
+        start, end, duration, sw_id, port, peak, peak_time, samples, flows = bursts[0]
+        self.assertEqual((start, end, duration, sw_id, port, peak, peak_time, samples),
+                         ("1.0000", "4.0000", "3.0000", "1", "1", "30", "2.0000", "4"))
+        self.assertEqual(flows, "0.0.0.1:1-0.0.0.2:8001/17x4")
+        # an ongoing burst is written when the detector closes
+        self.assertEqual(bursts[1][:3], ["5.0000", "5.0000", "0.0000"])
+
+    def test_ports_burst_independently(self):
+        finished, active, bursts = self.detect([(1, 25), (2, 25), (1, 0), (2, 19)])
+        self.assertEqual((finished, active), (1, 1))
+        self.assertEqual([(burst[4], burst[7]) for burst in bursts], [("1", "2"), ("2", "2")])
+
+    def test_below_rise_is_ignored(self):
+        self.assertEqual(self.detect([(1, 19), (1, 0), (1, 19)]), (0, 0, []))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# python -m unittest test_int_shm
+import struct
+import unittest
+
+import int_shm
+
+
+def payload(i):
+    return struct.pack("!I", i) * 4
+
+
+class ShmRingTest(unittest.TestCase):
+    def setUp(self):
+        self.ring = None
+        self.reader = None
+
+    def tearDown(self):
+        for ring in (self.reader, self.ring):
+            if ring is not None:
+                ring.close()
+
+    def open(self, policy):
+        self.ring = int_shm.ShmRing.create(1, slots=8, slot_size=64, policy=policy)
+        self.reader = int_shm.ShmRing.attach(self.ring.name)
+
+    def test_drop_policy_keeps_unread_reports(self):
+        self.open("drop")
+        put = [self.ring.put(0, payload(i), 0.0) for i in range(10)]
+        self.ring.finish()
+        read = [bytes(p) for batch in self.reader.reader(0) for _, p in batch]
+        self.assertEqual(put.count(True), 8)
+        self.assertEqual(read, [payload(i) for i in range(8)])
+        self.assertEqual(self.ring.drops(0), 2)
+
+    def test_overwritten_batch_stays_intact(self):
+        self.open("overwrite")
+        for i in range(4):
+            self.ring.put(0, payload(i), 0.0)
+        self.ring.publish()
+        batches = self.reader.reader(0, batch=4)
+        batch = next(batches)
+        # the producer laps the reader while the batch is decoded
+        for i in range(100, 112):
+            self.ring.put(0, payload(i), 0.0)
+        self.ring.finish()
+        self.assertEqual([bytes(p) for _, p in batch], [payload(i) for i in range(4)])
+        rest = [bytes(p) for batch in batches for _, p in batch]
+        self.assertEqual(rest, [payload(i) for i in range(108, 112)])
+        self.assertEqual(self.reader.overruns(0), 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
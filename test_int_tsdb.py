@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# python -m unittest test_int_tsdb
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+import int_tsdb
+
+
+def points(n, seed=1):
+    rng = random.Random(seed)
+    times = []
+    values = []
+    t = 0.0
+    for _ in range(n):
+        t += rng.choice((0.0, 0.000001, 0.01, 0.5, 3.0))
+        times.append(round(t, 6))
+        values.append(rng.choice((0, 1, 300, 70000, 2 ** 40, -5)))
+    return times, values
+
+
+class ChunkTest(unittest.TestCase):
+    def test_round_trip(self):
+        ticks = [5, 5, 6, 1000, 3, 2 ** 40, 2 ** 40 + 1]
+        values = [0, -1, 2 ** 62, -(2 ** 62), 7, 7, 0]
+        for encode_np in (int_tsdb.np, None):
+            with mock.patch.object(int_tsdb, "np", encode_np):
+                blob = int_tsdb.encode_chunk(ticks, values)
+            for decode_np in (int_tsdb.np, None):
+                with mock.patch.object(int_tsdb, "np", decode_np):
+                    decoded_ticks, decoded_values = int_tsdb.decode_chunk(blob, len(ticks))
+                self.assertEqual((list(decoded_ticks), list(decoded_values)), (ticks, values))
+
+
+class StoreTest(unittest.TestCase):
+    def test_points_round_trip(self):
+        times, values = points(5000)
+        with tempfile.TemporaryDirectory() as root:
+            with int_tsdb.TimeSeriesStore(root, chunk_points=300) as store:
+                for t, v in zip(times, values):
+                    store.append(1, "hop_latency", t, v)
+            store = int_tsdb.TimeSeriesStore(root)
+            self.assertEqual(store.keys(), [(1, "hop_latency")])
+            self.assertEqual(sum(int(chunk[4]) for chunk in store.index(1, "hop_latency")), len(times))
+            ticks, read_values = store.read_ticks(1, "hop_latency")
+            self.assertEqual(list(ticks), [round(t / int_tsdb.TIME_UNIT) for t in times])
+            self.assertEqual(list(read_values), values)
+
+            start, end = times[1000], times[3000]
+            expected = [(t, v) for t, v in zip(times, values) if start <= t < end]
+            read_times, read_values = store.read(1, "hop_latency", start, end)
+            self.assertEqual([round(t, 6) for t in read_times], [t for t, _ in expected])
+            self.assertEqual(list(read_values), [v for _, v in expected])
+
+    def test_rollups_match_the_points(self):
+        times, values = points(5000, seed=2)
+        with tempfile.TemporaryDirectory() as root:
+            store = int_tsdb.TimeSeriesStore(root, chunk_points=256)
+            for t, v in zip(times, values):
+                store.append(2, "q_occupancy", t, v)
+            store.close()
+            for resolution, resolution_ticks in store.rollups.items():
+                expected = {}
+                for t, v in zip(times, values):
+                    bucket = round(t / int_tsdb.TIME_UNIT) // resolution_ticks
+                    count, total, low, high = expected.get(bucket, (0, 0, v, v))
+                    expected[bucket] = (count + 1, total + v, min(low, v), max(high, v))
+                # a bucket can have several records, they add up to the bucket
+                rollup = {}
+                for bucket, count, total, low, high in store.rollup(2, "q_occupancy", resolution):
+                    if bucket in rollup:
+                        c, s, lo, hi = rollup[bucket]
+                        count, total, low, high = c + count, s + total, min(lo, low), max(hi, high)
+                    rollup[bucket] = (count, total, low, high)
+                self.assertEqual(rollup, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()